@@ -0,0 +1,69 @@
+# 對局歷史的成本：整批附加寫檔（每局）、rollup 查詢 vs 每次請求掃整份原始紀錄，以及啟動時重建 rollup。
+# 用法：python bench/history_stats.py [--games 100000] [--pairs 500] [--batch 50]
+import os, sys, time, json, random, argparse, tempfile, heapq
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from history import HistoryStore, GAMES, new_rollup, fold, summarize
+
+def fake_game(rng: random.Random, pairs: int) -> dict:
+    n = rng.randint(4, 10)
+    uc = set(rng.sample(range(n), max(1, n // 2 - 1)))
+    rounds = rng.randint(1, n - 2)
+    pair = rng.randrange(pairs)
+    return {
+        "room": f"room-{rng.randrange(1000)}", "session": 1, "started": 0.0, "ended": 1.0,
+        "pair": [f"平民詞{pair}", f"臥底詞{pair}"],
+        "players": [[s, f"玩家{s}", "undercover" if s in uc else "civilian"] for s in range(n)],
+        "votes": [[[v, rng.randrange(n)] for v in range(n)] for _ in range(rounds)],
+        "eliminated": list(range(rounds)), "ties": int(rng.random() < 0.2), "rounds": rounds,
+        "winner": rng.choice(("civilian", "undercover")),
+    }
+
+def scan(path: str) -> dict:
+    """不用 rollup：每次請求把整份紀錄讀過一遍再算。"""
+    rollup = new_rollup()
+    with open(path, "rb") as f:
+        for line in f:
+            fold(rollup, json.loads(line))
+    return rollup
+
+def query(rollup: dict):
+    summarize(rollup["total"])
+    heapq.nlargest(50, rollup["pairs"].items(), key=lambda kv: kv[1][GAMES])
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="history store write cost and stats query cost")
+    ap.add_argument("--games", type=int, default=100_000)
+    ap.add_argument("--pairs", type=int, default=500)
+    ap.add_argument("--batch", type=int, default=50)
+    args = ap.parse_args()
+    rng = random.Random(1)
+    games = [fake_game(rng, args.pairs) for _ in range(args.games)]
+    store = HistoryStore(tempfile.mkdtemp(prefix="uc-history-bench-"), 0)
+    store.open()
+
+    t0 = time.perf_counter()
+    for i in range(0, len(games), args.batch):
+        for g in games[i:i + args.batch]:
+            store.append(g)
+        store.write(store.take())
+    dt = time.perf_counter() - t0
+    size = os.path.getsize(store.log_path)
+    print(f"{args.games:,} games, {size / 1e6:.1f} MB ({size / args.games:.0f} B/game)")
+    print(f"append + fold + batched write (batch={args.batch}): {dt / args.games * 1e6:.2f} us/game")
+
+    t0 = time.perf_counter()
+    for _ in range(1000):
+        query(store.rollup)
+    print(f"stats from rollup:        {(time.perf_counter() - t0) / 1000 * 1e3:8.3f} ms/request")
+    t0 = time.perf_counter()
+    query(scan(store.log_path))
+    print(f"stats from full log scan: {(time.perf_counter() - t0) * 1e3:8.3f} ms/request")
+
+    store.save_rollup(store.rollup_text())
+    t0 = time.perf_counter()
+    HistoryStore(os.path.dirname(store.log_path), 0).open()
+    print(f"startup with saved rollup: {(time.perf_counter() - t0) * 1e3:.2f} ms")
+    os.unlink(store.rollup_path)
+    t0 = time.perf_counter()
+    HistoryStore(os.path.dirname(store.log_path), 0).open()
+    print(f"startup rebuilding rollup: {(time.perf_counter() - t0) * 1e3:.2f} ms")
@@ -0,0 +1,67 @@
+# 狀態日誌每筆記錄的成本：event loop 上的 append、背景執行緒整批寫入（依批量），
+# 對照「每筆同步 commit」的寫法，以及 snapshot compaction 一次的成本。
+# 用法：python bench/journal_cost.py [--rooms 200] [--players 8]
+import os, sys, time, argparse, tempfile
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from journal import Journal
+
+def room_records(i: int, players: int) -> list:
+    """一房一局的典型記錄：建房、入座、開局、每回合淘汰一人 + 換回合、結束、重置。"""
+    rid = f"room-{i}"
+    recs = [(rid, 0, "create", {"host": "c0", "speak_seconds": 20, "vote_seconds": 30, "early": False,
+                                 "use_builtin": True, "pools": [], "custom": []})]
+    recs += [(rid, s, "join", [f"c{s}", s, f"玩家{s}", f"c{s}.{'x' * 22}"]) for s in range(players)]
+    recs.append((rid, 50, "start", {"session": 1, "pair": ["可樂", "汽水"], "undercover": [1, 4],
+                                    "alive": list(range(players))}))
+    for rnd in range(1, players // 2):
+        recs.append((rid, 100 * rnd, "phase", ["voting", rnd]))
+        recs.append((rid, 100 * rnd + 1, "eliminate", rnd))
+        recs.append((rid, 100 * rnd + 2, "phase", ["playing", rnd + 1]))
+    recs.append((rid, 999, "phase", ["ended", players // 2]))
+    recs.append((rid, 1000, "reset", None))
+    return recs
+
+def bench_append(records: list) -> float:
+    j = Journal(":memory:")
+    t0 = time.perf_counter()
+    for rec in records:
+        j.append(*rec)
+    return (time.perf_counter() - t0) / len(records)
+
+def bench_batched(path: str, records: list, batch: int) -> float:
+    j = Journal(path, snapshot_every=1 << 60)
+    j.open()
+    t0 = time.perf_counter()
+    for i in range(0, len(records), batch):
+        j.write(records[i:i + batch])
+    dt = time.perf_counter() - t0
+    j.db.close()
+    return dt / len(records)
+
+def bench_compact(path: str, records: list) -> tuple:
+    j = Journal(path, snapshot_every=1 << 60)
+    j.open()
+    j.write(records)
+    rooms = len(j.dirty)
+    t0 = time.perf_counter()
+    j.compact()
+    dt = time.perf_counter() - t0
+    j.db.close()
+    return dt, rooms
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="per-record cost of the room state journal")
+    ap.add_argument("--rooms", type=int, default=200)
+    ap.add_argument("--players", type=int, default=8)
+    args = ap.parse_args()
+    records = [rec for i in range(args.rooms) for rec in room_records(i, args.players)]
+    tmp = tempfile.mkdtemp(prefix="uc-journal-bench-")
+    print(f"{len(records):,} records ({args.rooms} rooms × {args.players} players)")
+    print(f"{'mode':<28} {'us/record':>10}")
+    print(f"{'append (event loop)':<28} {bench_append(records) * 1e6:>10.2f}")
+    for batch in (1, 10, 100, 1000):
+        label = "sync commit per record" if batch == 1 else f"write-behind batch={batch}"
+        path = os.path.join(tmp, f"b{batch}.db")
+        print(f"{label:<28} {bench_batched(path, records, batch) * 1e6:>10.2f}")
+    dt, rooms = bench_compact(os.path.join(tmp, "compact.db"), records)
+    print(f"compaction: {dt * 1000:.2f} ms for {rooms} rooms ({dt / rooms * 1e6:.1f} us/room)")
@@ -0,0 +1,282 @@
+# WebSocket 壓測：在本機起 server，N 房 × M 人走完整局（建房、入房、開局、輪流發言、投票含強制平票、重置）
+# 延遲 = 送出指令到該連線收到對應回應（見 EXPECT）的時間；結果寫成 JSON，可在版本間 diff。
+# 用法：python bench/loadtest.py --rooms 50 --players 6 --games 2 [--workers 3] [--enc msgpack] [--out loadtest.json]
+#       python bench/loadtest.py --rooms 5 --watchers 500 ...     # 每房加觀眾，看玩家延遲是否受影響
+#       python bench/loadtest.py --url ws://127.0.0.1:8000/ws ...   # 打已在跑的 server
+# 壓測端是單一 process，房數很多時客戶端本身可能先成為瓶頸，比較版本時請用相同參數。
+import os, sys, json, time, zlib, random, socket, asyncio, argparse, platform, subprocess, tempfile
+import websockets
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# 指令 -> 判斷「對應回應」的條件（在送出者自己的連線上比對）
+EXPECT = {
+    "create_room_setup": lambda c, m: m["type"] == "room",
+    "join_room":         lambda c, m: m["type"] == "room",
+    "watch_room":        lambda c, m: m["type"] == "room",
+    "start_game":        lambda c, m: m["type"] == "roster" and m.get("op") == "status_changed" and m.get("status") == "playing",
+    "say":               lambda c, m: (m["type"] == "chat" and m.get("from") == c.name) or m["type"] == "hint",
+    "vote":              lambda c, m: m["type"] in ("vote_ack", "hint"),
+    "reset_game":        lambda c, m: m["type"] == "roster" and m.get("op") == "status_changed" and m.get("status") == "waiting",
+}
+
+class Client:
+    def __init__(self, run, name, watcher=False):
+        self.run = run
+        self.name = name
+        self.watcher = watcher  # 觀眾只計數，不進事件佇列
+        self.ws = None
+        self.pending = []       # [(type, t0)]，依送出順序等回應
+        self.events = asyncio.Queue()
+
+    async def connect(self):
+        self.ws = await websockets.connect(self.run.ws_url, max_size=None)
+        self.reader = asyncio.create_task(self._read())
+
+    async def send(self, **msg):
+        if msg["type"] in EXPECT:
+            self.pending.append((msg["type"], time.perf_counter()))
+        data = msgpack.packb(msg) if self.run.enc == "msgpack" else json.dumps(msg)
+        await self.ws.send(data)
+        self.run.sent += 1
+
+    def _decode(self, raw):
+        if isinstance(raw, bytes):
+            if self.run.enc == "msgpack":
+                return msgpack.unpackb(raw)
+            raw = zlib.decompress(raw, -15).decode()
+        return json.loads(raw)
+
+    async def _read(self):
+        try:
+            async for raw in self.ws:
+                data = self._decode(raw)
+                for m in data if isinstance(data, list) else [data]:
+                    self.run.received += 1
+                    self._on_message(m)
+        except websockets.ConnectionClosed:
+            pass
+
+    def _on_message(self, m):
+        t = m.get("type")
+        if t == "ping":
+            asyncio.ensure_future(self.ws.send('{"type":"pong"}'))
+            return
+        if self.pending:
+            kind, t0 = self.pending[0]
+            if EXPECT[kind](self, m):
+                self.pending.pop(0)
+                self.run.latency.setdefault(kind, []).append(time.perf_counter() - t0)
+        if self.watcher:
+            self.run.watched += 1
+        else:
+            self.events.put_nowait(m)
+
+    async def close(self):
+        await self.ws.close()
+        self.reader.cancel()
+
+class RoomDriver:
+    """以 Host 連線收到的廣播推進遊戲：輪到誰就由誰發言，開票就讓存活者投票。"""
+
+    def __init__(self, run, index):
+        self.run = run
+        self.room = f"load-{index}-{run.rng.randrange(1 << 30)}"
+        self.host = Client(run, f"r{index}h")
+        self.players = [Client(run, f"r{index}p{j}") for j in range(run.players - 1)]
+        self.by_name = {c.name: c for c in [self.host] + self.players}
+        self.watchers = [Client(run, f"r{index}w{j}", watcher=True) for j in range(run.watchers)]
+
+    async def next_event(self, *types, when=None):
+        while True:
+            m = await asyncio.wait_for(self.host.events.get(), self.run.timeout)
+            if m["type"] in types and (when is None or when(m)):
+                return m
+
+    async def play(self):
+        everyone = [self.host] + self.players
+        for c in everyone:
+            await c.connect()
+        await self.host.send(type="create_room_setup", name=self.host.name, room=self.room, use_builtin=True)
+        await self.next_event("room")
+        for c in self.players:
+            await c.send(type="join_room", name=c.name, room=self.room)
+        joined = 1
+        while joined < len(everyone):
+            await self.next_event("roster")
+            joined += 1
+        for w in self.watchers:
+            await w.connect()
+            await w.send(type="watch_room", room=self.room)
+        for _ in range(self.run.games):
+            await self.play_game()
+            await self.host.send(type="reset_game")
+            await self.next_event("roster", when=lambda m: m.get("status") == "waiting")
+            self.run.games_done += 1
+        # 等其他人的回應也到齊再斷線，避免漏記延遲
+        for _ in range(int(self.run.timeout * 20)):
+            if not any(c.pending for c in everyone + self.watchers):
+                break
+            await asyncio.sleep(0.05)
+        for c in everyone + self.watchers:
+            await c.close()
+
+    async def play_game(self):
+        await self.host.send(type="start_game")
+        while True:
+            m = await self.next_event("status", "voting_open", "gameover")
+            if m["type"] == "gameover":
+                return
+            if m["type"] == "status":
+                msg = m.get("msg", "")
+                if "現在輪到 <b>" in msg:
+                    name = msg.split("<b>", 1)[1].split("</b>", 1)[0]
+                    await asyncio.sleep(self.run.think)
+                    await self.by_name[name].send(type="say", text=f"{name} 的描述")
+                continue
+            await self.vote(m["alive"])
+
+    async def vote(self, alive):
+        voters = [self.by_name[a["name"]] for a in alive]
+        cids = [a["cid"] for a in alive]
+        if len(cids) >= 3 and self.run.rng.random() < self.run.tie_rate:
+            # 強制平票：前兩位各拿一半，奇數時多出的一票投第三位
+            self.run.ties += 1
+            targets = [cids[i % 2] for i in range(len(voters))]
+            if len(voters) % 2:
+                targets[-1] = cids[2]
+        else:
+            target = self.run.rng.choice(cids)
+            targets = [target] * len(voters)
+        for c, target in zip(voters, targets):
+            await c.send(type="vote", target=target)
+
+class Run:
+    def __init__(self, args, ws_url):
+        self.ws_url = ws_url
+        self.enc = args.enc
+        self.players = args.players
+        self.watchers = args.watchers
+        self.games = args.games
+        self.think = args.think
+        self.tie_rate = args.tie_rate
+        self.timeout = args.timeout
+        self.rng = random.Random(args.seed)
+        self.latency = {}
+        self.sent = self.received = self.games_done = self.ties = self.watched = 0
+
+def free_port() -> int:
+    s = socket.socket()
+    s.bind(("127.0.0.1", 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+def launch(workers: int, port: int) -> subprocess.Popen:
+    env = dict(os.environ, WEB_CONCURRENCY=str(workers), UC_IPC_DIR=tempfile.mkdtemp(prefix="uc-ipc-"))
+    # 每次從空的日誌開始，不把上一輪壓測的房間恢復回來
+    env.setdefault("UC_JOURNAL_DIR", tempfile.mkdtemp(prefix="uc-journal-"))
+    env.setdefault("UC_HISTORY_DIR", tempfile.mkdtemp(prefix="uc-history-"))
+    # 機器人以機器速度連續發言/投票，放寬入站限流，免得量到的是限流而不是 server
+    env.setdefault("RATE_LIMITS", "frame=1000:2000,say=500:1000,vote=500:1000,start_game=100:200,reset_game=100:200")
+    if workers > 1:
+        cmd = ["gunicorn", "-k", "uc_worker.Worker", "server_V2:app", "--workers", str(workers),
+               "--bind", f"127.0.0.1:{port}", "--log-level", "warning"]
+    else:
+        cmd = [sys.executable, "-m", "uvicorn", "server_V2:app", "--host", "127.0.0.1", "--port", str(port),
+               "--log-level", "warning", "--ws-per-message-deflate", "false"]
+    proc = subprocess.Popen(cmd, cwd=ROOT, env=env, stdout=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            socket.create_connection(("127.0.0.1", port), 0.2).close()
+            return proc
+        except OSError:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError("server did not start")
+
+def percentiles(xs: list) -> dict:
+    xs = sorted(xs)
+    p = lambda q: round(xs[min(len(xs) - 1, int(q * len(xs)))] * 1000, 3)
+    return {"count": len(xs), "p50": p(.50), "p95": p(.95), "p99": p(.99),
+            "max": round(xs[-1] * 1000, 3), "mean": round(sum(xs) / len(xs) * 1000, 3)}
+
+def git_rev() -> str | None:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+async def main(args, ws_url):
+    run = Run(args, ws_url)
+    drivers = [RoomDriver(run, i) for i in range(args.rooms)]
+    t0 = time.perf_counter()
+    results = await asyncio.gather(*(d.play() for d in drivers), return_exceptions=True)
+    elapsed = time.perf_counter() - t0
+    errors = [repr(e) for e in results if isinstance(e, BaseException)]
+    return {
+        "config": {k: v for k, v in vars(args).items() if k not in ("out", "url")},
+        "git": git_rev(),
+        "python": platform.python_version(),
+        "elapsed_s": round(elapsed, 3),
+        "games": run.games_done,
+        "forced_ties": run.ties,
+        "spectator_messages": run.watched,
+        "errors": errors[:20],
+        "error_count": len(errors),
+        "throughput": {
+            "sent_per_s": round(run.sent / elapsed, 1),
+            "received_per_s": round(run.received / elapsed, 1),
+            "games_per_s": round(run.games_done / elapsed, 3),
+        },
+        "latency_ms": {k: percentiles(v) for k, v in sorted(run.latency.items())},
+    }
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="drive full games over /ws and report per-message latency")
+    ap.add_argument("--rooms", type=int, default=20)
+    ap.add_argument("--players", type=int, default=6, help="players per room, host included (>= 3)")
+    ap.add_argument("--games", type=int, default=2, help="games per room")
+    ap.add_argument("--watchers", type=int, default=0, help="spectators per room")
+    ap.add_argument("--workers", type=int, default=1, help="server workers (> 1 uses gunicorn + sharding)")
+    ap.add_argument("--enc", choices=("json", "msgpack"), default="json")
+    ap.add_argument("--think", type=float, default=0.0, help="seconds before each say")
+    ap.add_argument("--tie-rate", type=float, default=0.25, help="fraction of votes forced into a tie")
+    ap.add_argument("--timeout", type=float, default=30.0, help="seconds to wait for any expected broadcast")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--url", help="target an already running server instead of launching one")
+    ap.add_argument("--out", default="loadtest.json")
+    args = ap.parse_args()
+    if args.players < 3:
+        ap.error("--players must be >= 3")
+    if args.enc == "msgpack" and not msgpack:
+        ap.error("msgpack is not installed")
+
+    proc = None
+    if args.url:
+        base = args.url
+    else:
+        port = free_port()
+        proc = launch(args.workers, port)
+        base = f"ws://127.0.0.1:{port}/ws"
+    query = "?batch=1" + ("&enc=msgpack" if args.enc == "msgpack" else "&z=1")
+    try:
+        result = asyncio.run(main(args, base + query))
+    finally:
+        if proc:
+            proc.terminate()
+            proc.wait()
+
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f"{args.rooms} rooms × {args.players} players × {args.games} games in {result['elapsed_s']} s, "
+          f"{result['error_count']} errors, {result['forced_ties']} forced ties")
+    print(f"{'type':<18} {'count':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for k, v in result["latency_ms"].items():
+        print(f"{k:<18} {v['count']:>7} {v['p50']:>8} {v['p95']:>8} {v['p99']:>8} {v['max']:>8}")
+    print(f"throughput: {result['throughput']}  -> {args.out}")
@@ -0,0 +1,58 @@
+# 房間記憶體量測：舊版 dict-of-dicts vs Room/Player (__slots__)
+# 用法：python bench/room_memory.py
+import os, sys, uuid, tracemalloc
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from server_V2 import Room, WORD_PAIRS
+from engine import Tally, SlotSet
+
+ROOMS = 50
+
+def legacy_room(host, cids):
+    # 與舊版 rooms[room_id] 結構相同
+    r = {
+        "host": host, "clients": {}, "status": "playing", "round": 1,
+        "word_pool": list(WORD_PAIRS), "pair": WORD_PAIRS[0], "last_pair": WORD_PAIRS[0],
+        "undercover_ids": set(), "votes": {}, "session": 1,
+        "speak_order": [], "speak_index": 0, "spoken_this_turn": set(),
+        "limit_20s": False, "speak_token": None, "timer_task": None,
+    }
+    for i, cid in enumerate(cids):
+        r["clients"][cid] = {"ws": None, "name": f"p{i}", "alive": True, "role": "civilian"}
+    r["speak_order"] = list(cids)
+    r["undercover_ids"] = set(cids[: len(cids) // 2 - 1])
+    r["spoken_this_turn"] = set(cids[: len(cids) // 2])
+    r["votes"] = {c: cids[0] for c in cids}
+    return r
+
+def slots_room(host, cids):
+    r = Room("r", host)
+    g = r.game
+    for i, cid in enumerate(cids):
+        g.seat(r.add_player(cid, f"p{i}", None).slot)
+    slots = [p.slot for p in r.seats]
+    g._ring(list(slots))
+    g.undercover = SlotSet(slots[: len(slots) // 2 - 1])
+    for s in slots[: len(slots) // 2]:
+        g._unlink(s, spoke=True)  # 前半已發言：在環上記成 SPOKE，不另存 set
+    g.tally = Tally()           # 投票中才有；舊版結構同時帶著 speak_order 與 votes，這裡也一起算
+    for s in slots:
+        g.tally.cast(s, slots[0])
+    return r
+
+def measure(build, n):
+    # cid 字串由連線持有，兩種結構都要付，先建好不列入計算
+    batches = [[str(uuid.uuid4()) for _ in range(n)] for _ in range(ROOMS)]
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    keep = [build(cids[0], cids) for cids in batches]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del keep
+    return (after - before) / ROOMS
+
+if __name__ == "__main__":
+    print(f"{'players':>8} {'dict bytes/room':>16} {'slots bytes/room':>17} {'ratio':>6}")
+    for n in (10, 100, 1000):
+        a = measure(legacy_room, n)
+        b = measure(slots_room, n)
+        print(f"{n:>8} {a:>16,.0f} {b:>17,.0f} {b / a:>6.2f}")
@@ -0,0 +1,77 @@
+# 一整輪發言（每位存活者講一次，最後自動開票）的成本：舊版 say/advance_after_speak vs engine 的發言環
+# 用法：python bench/speak_turn.py
+import os, sys, time, random
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from engine import Game
+
+class LegacyTurn:
+    """與舊版相同：每次 say 重建 alive_set、壓縮 speak_order，推進時 index() 後線性找下一位。"""
+
+    def __init__(self, alive: list, order: list):
+        self.alive = {s: True for s in alive}
+        self.order = list(order)
+        self.index = 0
+        self.spoken = set()
+        self.voting = False
+
+    def alive_slots(self) -> list:
+        return [s for s, a in self.alive.items() if a]
+
+    def say(self, slot: int):
+        alive_set = set(self.alive_slots())
+        order = [x for x in self.order if x in alive_set]
+        self.order = order
+        idx = self.index % len(order)
+        self.index = idx
+        if order[idx] != slot:
+            return
+        self.spoken.add(slot)
+        self.advance(slot)
+
+    def advance(self, who: int):
+        alive_set = set(self.alive_slots())
+        if alive_set.issubset(self.spoken):
+            self.voting = True
+            return
+        order = [x for x in self.order if x in alive_set]
+        start = order.index(who)
+        for k in range(1, len(order) + 1):
+            c = order[(start + k) % len(order)]
+            if c not in self.spoken:
+                self.index = (start + k) % len(order)
+                return
+        self.voting = True
+
+def legacy_turn(alive: list, order: list):
+    t = LegacyTurn(alive, order)
+    for slot in order:
+        t.say(slot)
+    assert t.voting
+
+def engine_turn(g: Game):
+    g.status = "playing"
+    g.round += 1
+    g._new_turn()
+    while g.status == "playing":
+        g.say(g.cursor)
+
+def best(fn, *args, repeat: int = 3) -> float:
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn(*args)
+        times.append(time.perf_counter() - t0)
+    return min(times)
+
+if __name__ == "__main__":
+    print(f"{'players':>8} {'legacy ms/turn':>15} {'ring ms/turn':>13} {'speedup':>8}")
+    for n in (50, 500, 5000):
+        alive = list(range(n))
+        order = alive[:]
+        random.Random(n).shuffle(order)
+        g = Game(random.Random(n))
+        for s in alive:
+            g.seat(s)
+        a = best(legacy_turn, alive, order, repeat=1 if n >= 5000 else 3)
+        b = best(engine_turn, g)
+        print(f"{n:>8} {a * 1000:>15.2f} {b * 1000:>13.2f} {a / b:>7.0f}x")
@@ -0,0 +1,74 @@
+# 發言計時：每次換人建立一個 Task（舊做法） vs 共用 heap 排程器
+# 用法：python bench/timer_scheduler.py [rooms]
+# （開著 tracemalloc 量峰值記憶體，絕對耗時會偏高，只看兩者相對差距）
+import os, sys, time, asyncio, tracemalloc
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from server_V2 import Scheduler
+
+ROOMS = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+RESTARTS = 5        # 每房換發言者次數（每次都要取消舊計時、建立新計時）
+FIRE_DELAY = 0.2    # 最後一輪實際等到期，量觸發延遲
+
+async def task_per_timer():
+    fired = []
+    tasks = [None] * ROOMS
+
+    async def timer(i, delay, armed):
+        await asyncio.sleep(delay)
+        fired.append(time.perf_counter() - armed - delay)
+
+    t0 = time.perf_counter()
+    for _ in range(RESTARTS):
+        for i in range(ROOMS):
+            old = tasks[i]
+            if old and not old.done():
+                old.cancel()
+                try:
+                    await old
+                except asyncio.CancelledError:
+                    pass
+            tasks[i] = asyncio.create_task(timer(i, 20, time.perf_counter()))
+    for i in range(ROOMS):
+        tasks[i].cancel()
+        tasks[i] = asyncio.create_task(timer(i, FIRE_DELAY, time.perf_counter()))
+    arm = time.perf_counter() - t0
+    peak = tracemalloc.get_traced_memory()[1]
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return arm, peak, fired
+
+async def shared_scheduler():
+    fired = []
+    sch = Scheduler()
+    timers = [None] * ROOMS
+
+    def cb(armed, delay, t):
+        fired.append(time.perf_counter() - armed - delay)
+
+    t0 = time.perf_counter()
+    for _ in range(RESTARTS):
+        for i in range(ROOMS):
+            if timers[i]:
+                sch.cancel(timers[i])
+            timers[i] = sch.call_later(20, cb, time.perf_counter(), 20)
+    for i in range(ROOMS):
+        sch.cancel(timers[i])
+        timers[i] = sch.call_later(FIRE_DELAY, cb, time.perf_counter(), FIRE_DELAY)
+    arm = time.perf_counter() - t0
+    peak = tracemalloc.get_traced_memory()[1]
+    while len(fired) < ROOMS:
+        await asyncio.sleep(0.05)
+    return arm, peak, fired
+
+def report(name, arm, peak, fired):
+    fired = sorted(fired)
+    p = lambda q: fired[min(len(fired) - 1, int(q * len(fired)))] * 1000
+    print(f"{name:<16} arm {arm * 1000:8.1f} ms  peak {peak / 1e6:7.1f} MB  "
+          f"fire lag p50 {p(.5):6.1f} ms  p99 {p(.99):6.1f} ms  max {fired[-1] * 1000:6.1f} ms")
+
+if __name__ == "__main__":
+    print(f"{ROOMS} rooms, {RESTARTS} restarts each, then one real expiry")
+    for name, fn in (("task-per-timer", task_per_timer), ("heap scheduler", shared_scheduler)):
+        tracemalloc.start()
+        arm, peak, fired = asyncio.run(fn())
+        tracemalloc.stop()
+        report(name, arm, peak, fired)
@@ -0,0 +1,46 @@
+# 一輪投票的計票成本：舊版每票重掃全部存活者 + 最後重建 tally，vs engine.Game 的即時計票
+# 用法：python bench/vote_tally.py
+import os, sys, time, random
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from engine import Game, SlotSet
+
+def legacy_round(alive: list, targets: list):
+    # 與舊版 vote / settle_votes 相同：每票 all() 掃一遍，最後建 tally 再找 max
+    votes = {}
+    for voter, target in zip(alive, targets):
+        votes[voter] = target
+        if all(v in votes for v in alive):
+            tally = {}
+            for t in votes.values():
+                tally[t] = tally.get(t, 0) + 1
+            top_votes = max(tally.values())
+            return [s for s, c in tally.items() if c == top_votes]
+
+def engine_round(g: Game, alive: list, targets: list):
+    g.status = "playing"
+    g.open_vote()
+    for voter, target in zip(alive, targets):
+        g.vote(voter, target)
+
+def measure(fn, *args) -> float:
+    t0 = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - t0
+
+if __name__ == "__main__":
+    rng = random.Random(1)
+    print(f"{'voters':>7} {'legacy us/vote':>15} {'tally us/vote':>14}")
+    for n in (50, 500, 5000):
+        alive = list(range(n))
+        # 票集中在少數人身上，像觀眾投票；最後一票之前不會結算
+        targets = [rng.randrange(min(n, 8)) for _ in alive]
+        g = Game(random.Random(1))
+        for s in alive:
+            g.seat(s)
+        # settle 會淘汰一人，每次量測前補回
+        def one_engine():
+            g.alive = SlotSet(alive)
+            engine_round(g, alive, targets)
+        a = min(measure(legacy_round, alive, targets) for _ in range(3))
+        b = min(measure(one_engine) for _ in range(3))
+        print(f"{n:>7} {a / n * 1e6:>15.2f} {b / n * 1e6:>14.2f}")
@@ -0,0 +1,522 @@
+# engine.py — 誰是臥底規則引擎：純狀態轉移，不碰網路、不讀時間。
+# 座位一律用整數 slot；每個轉移回傳事件 list（tuple，第一個元素為事件名），由呼叫端轉成訊息/計時器。
+# 隨機性只來自建構時給的 rng（random.Random），同一個種子、同一串操作必得到同一串事件。
+#
+# 事件：
+#   ("reject", code, *args)        指令不合法，狀態不變
+#   ("session", n)                 新的一局（第 n 局）
+#   ("roles", uc_count)            已分配角色
+#   ("turn", slot, fresh)          輪到 slot 發言；fresh=True 表示新一輪剛隨機排好順序
+#   ("started",)                   開局完成
+#   ("spoke", slot)                slot 已發言
+#   ("timed_out", slot)            slot 發言逾時，視同已發言
+#   ("vote_open",)                 進入投票
+#   ("vote_ack", slot, changed)    slot 的票已記下；changed=True 表示改票
+#   ("vote_timeout",)              投票逾時，未投者棄權
+#   ("vote_result", [(voter, target|None), ...])
+#   ("tie",)                       平票，無人出局，同一回合重新發言
+#   ("eliminated", slot)
+#   ("gameover", "civilian"|"undercover")
+#   ("round", n, forced)           進入第 n 回合；forced=True 為 Host 強制切換
+#   ("reset",)
+# 恢復（restore）另回傳 ("turn", slot, True) 或 ("vote_open",)，與一般轉移相同。
+import random
+
+MIN_PLAYERS = 3
+SPOKE = -1          # Game.nxt 中的標記：本回合已發言
+
+def undercover_count(n: int) -> int:
+    """起始臥底數：floor(n/2) - 1，至少 1 人且少於總人數。"""
+    return max(1, min(n // 2 - 1, n - 1))
+
+class SlotSet:
+    """座位集合，存成一個 int bitmask（第 slot 位）：座位號是連續小整數，
+    每房三份（在座 / 存活 / 臥底）用 set 存，光雜湊表就比整個房間其餘狀態還大。
+    只提供 Game 與呼叫端用到的 set 操作；迭代依 slot 由小到大。"""
+    __slots__ = ("bits",)
+
+    def __init__(self, slots=()):
+        bits = 0
+        for slot in slots:
+            bits |= 1 << slot
+        self.bits = bits
+
+    def __contains__(self, slot) -> bool:
+        return type(slot) is int and slot >= 0 and self.bits >> slot & 1 == 1
+
+    def __len__(self) -> int:
+        return self.bits.bit_count()
+
+    def __iter__(self):
+        return (slot for slot, bit in enumerate(bin(self.bits)[:1:-1]) if bit == "1")
+
+    def __and__(self, other: "SlotSet") -> "SlotSet":
+        out = SlotSet()
+        out.bits = self.bits & other.bits
+        return out
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, SlotSet) and self.bits == other.bits
+
+    def __repr__(self) -> str:
+        return f"SlotSet({list(self)})"
+
+    def add(self, slot: int):
+        self.bits |= 1 << slot
+
+    def discard(self, slot: int):
+        self.bits &= ~(1 << slot)
+
+    def copy(self) -> "SlotSet":
+        out = SlotSet()
+        out.bits = self.bits
+        return out
+
+class Tally:
+    """即時計票：投票、改票、撤票都是 O(1)（目標離場作廢投給他的票為 O(存活數)，很少發生）。
+
+    各票數層級（level[c] = 得 c 票的目標集合）以 up/down 串成由低到高的鏈結（0 為底），
+    票數每次只變動 1，搬到相鄰層級即可，最高票與第二名不必重掃；同 LFU 快取的做法。
+    票數不會超過投票人數，層級與鏈結都是以票數為索引的 list，用到更高票數時才加長。
+    """
+    __slots__ = ("votes", "counts", "level", "up", "down", "top")
+
+    def __init__(self):
+        self.votes = {}         # voter -> target
+        self.counts = {}        # target -> 得票數（只記數字：每個目標一個 set 在小房間裡比整張票還大）
+        self.level = [None]     # level[票數] -> SlotSet[target]；空層級為 None
+        self.up = [None]        # 層級鏈結：下一個較高的非空層級
+        self.down = [None]      # 層級鏈結：下一個較低的非空層級（最低者指向 0）
+        self.top = 0            # 最高票數
+
+    def count(self, target) -> int:
+        return self.counts.get(target, 0)
+
+    def cast(self, voter, target):
+        """記一票（或改票），回傳原本投的目標；同一目標重投不變動。"""
+        old = self.votes.get(voter)
+        if old == target:
+            return old
+        if old is not None:
+            self._drop(voter, old)
+        self.votes[voter] = target
+        c = self.counts.get(target, 0)
+        self.counts[target] = c + 1
+        self._move(target, c, c + 1)
+        return old
+
+    def withdraw(self, voter):
+        """撤回 voter 的票，回傳原目標（沒投過為 None）。"""
+        old = self.votes.pop(voter, None)
+        if old is not None:
+            self._drop(voter, old)
+        return old
+
+    def void_target(self, target) -> list:
+        """目標離場：投給他的票全部作廢，回傳受影響的投票者。"""
+        voters = [v for v, t in self.votes.items() if t == target]
+        for v in voters:
+            self.withdraw(v)
+        return voters
+
+    def leaders(self):
+        return self.level[self.top] or ()
+
+    def margin(self) -> int:
+        """最高票領先第二名的票數；並列第一時為 0。"""
+        if len(self.leaders()) != 1:
+            return 0
+        return self.top - self.down[self.top]
+
+    def ranking(self, k: int) -> list:
+        """前 k 名 [(target, 票數), ...]，同票數者順序不定；O(k + 經過的層級數)。"""
+        out = []
+        c = self.top
+        while c and len(out) < k:
+            for t in self.level[c]:
+                out.append((t, c))
+                if len(out) == k:
+                    break
+            c = self.down[c]
+        return out
+
+    def _drop(self, voter, target):
+        n = self.counts[target] - 1
+        if n:
+            self.counts[target] = n
+        else:
+            del self.counts[target]
+        self._move(target, n + 1, n)
+
+    def _move(self, target, c: int, nc: int):
+        # target 從 c 票層級搬到 nc = c±1；先掛上新層級，再拆掉變空的舊層級
+        level, up, down = self.level, self.up, self.down
+        if nc == len(level):
+            level.append(None)
+            up.append(None)
+            down.append(None)
+        if nc:
+            if level[nc] is None:
+                level[nc] = SlotSet()
+                lo, hi = (c, up[c]) if nc > c else (down[c], c)
+                up[lo] = nc
+                down[nc] = lo
+                up[nc] = hi
+                if hi is not None:
+                    down[hi] = nc
+            level[nc].add(target)
+        if c:
+            old = level[c]
+            old.discard(target)
+            if not old:
+                level[c] = None
+                lo, hi = down[c], up[c]
+                down[c] = up[c] = None
+                up[lo] = hi
+                if hi is not None:
+                    down[hi] = lo
+        if nc > self.top:
+            self.top = nc
+        elif c == self.top and level[c] is None:
+            self.top = nc
+
+class Game:
+    __slots__ = (
+        "rng", "uc_formula", "early", "seated", "status", "round", "session", "pair",
+        "alive", "undercover", "uc_alive", "tally", "pending", "nxt", "prv", "cursor",
+    )
+
+    def __init__(self, rng: random.Random | None = None, uc_formula=undercover_count, early: bool = False):
+        self.rng = rng or random     # 未指定就共用模組層級的亂數源，不為每房多建一份狀態
+        self.uc_formula = uc_formula
+        self.early = early          # True：未投的票已無法改變結果時提前結算（已投的票視為凍結，見 decided）
+        self.seated = SlotSet()     # 在房內的座位
+        self.status = "waiting"     # "waiting"|"playing"|"voting"|"ended"
+        self.round = 0
+        self.session = 0
+        self.pair = None            # (平民詞, 臥底詞)
+        self.alive = SlotSet()
+        self.undercover = SlotSet()
+        self.uc_alive = 0           # 存活臥底數，勝負判定不必做集合交集
+        self.tally = None           # 本輪投票；只在投票階段存在（開票時建立、結算/重置時丟掉）
+        self.pending = 0            # 本輪尚未投票的存活者數
+        # 發言環：本回合「還沒發言」的存活者依發言順序串成雙向環，cursor 為目前發言者。
+        # 發言/逾時/離場都只是從環上摘掉一個節點，下一位就是 nxt[cursor]，不必重建順序或線性搜尋。
+        # 以 slot 為索引的 list（座位號是連續小整數），比 dict 省記憶體；不在環上為 None，
+        # 本回合講完而摘出環的記成 SPOKE（「已發言」就是這個標記，不另外存一份 set）。
+        self.nxt = []               # nxt[slot] -> 環上下一位
+        self.prv = []               # prv[slot] -> 環上前一位
+        self.cursor = None
+
+    # ----- 查詢 -----
+    @property
+    def votes(self) -> dict:
+        """voter slot -> target slot（唯讀檢視，改動請走 vote/unseat）。"""
+        return self.tally.votes if self.tally else {}
+
+    @property
+    def spoken(self) -> set:
+        """本回合已發言 set[slot]（由發言環的標記算出）。"""
+        return {slot for slot, n in enumerate(self.nxt) if n == SPOKE}
+
+    def is_alive(self, slot: int) -> bool:
+        return slot in self.alive
+
+    def is_undercover(self, slot: int) -> bool:
+        return slot in self.undercover
+
+    def role(self, slot: int) -> str:
+        return "undercover" if slot in self.undercover else "civilian"
+
+    def word(self, slot: int):
+        if not self.pair:
+            return None
+        return self.pair[1] if slot in self.undercover else self.pair[0]
+
+    def alive_slots(self) -> list:
+        return sorted(self.alive)
+
+    def current_speaker(self):
+        return self.cursor if self.status == "playing" else None
+
+    def speak_queue(self) -> list:
+        """從目前發言者起，本回合還沒發言的人（依順序）。"""
+        out = []
+        slot = self.cursor
+        while slot is not None and (not out or slot != out[0]):
+            out.append(slot)
+            slot = self.nxt[slot]
+        return out
+
+    # ----- 座位 -----
+    def seat(self, slot: int):
+        # 中途加入者與舊版相同：視為存活的平民，但不在本回合發言順序內；
+        # 投票中加入也要等他投，pending 必須與存活者同步（離開時 unseat 才扣得對）
+        if self.status == "voting" and slot not in self.alive:
+            self.pending += 1
+        self.seated.add(slot)
+        self.alive.add(slot)
+
+    def unseat(self, slot: int) -> list:
+        # 離開者的票與被投的票都作廢，避免結算時指到空位；投給他的人改回未投票
+        if self.status == "voting" and slot in self.alive:
+            if self.tally.withdraw(slot) is None:
+                self.pending -= 1
+            self.pending += len(self.tally.void_target(slot))
+        voting = self.status == "voting" and slot in self.alive
+        if slot in self.alive and slot in self.undercover:
+            self.uc_alive -= 1
+        self.seated.discard(slot)
+        self.alive.discard(slot)
+        self.undercover.discard(slot)
+        # 走掉的是最後一位未投者（被踢或重連逾時）：與 vote() 相同的條件結算，不必等人手動下一輪
+        if voting and (self.pending <= 0 or (self.early and self.decided())):
+            return self.settle()
+        # 走掉的是目前發言者：輪到環上下一位；環空了代表其他人都講過，直接開票
+        if self._unlink(slot) and self.status == "playing":
+            if self.cursor is None:
+                return self.open_vote()
+            return [("turn", self.cursor, False)]
+        return []
+
+    # ----- 開局 / 重置 -----
+    def start(self, draw_pair) -> list:
+        """draw_pair()：通過檢查後才呼叫，回傳本局 (平民詞, 臥底詞)。"""
+        players = sorted(self.seated)
+        if len(players) < MIN_PLAYERS:
+            return [("reject", "too_few", MIN_PLAYERS)]
+        self.alive = SlotSet(players)
+        self.tally = None
+        self.status = "playing"
+        self.round = 1
+        self.session += 1
+        events = [("session", self.session)]
+
+        self.pair = draw_pair()
+        n = len(players)
+        uc = max(1, min(self.uc_formula(n), n - 1))
+        self.undercover = SlotSet(self.rng.sample(players, uc))
+        self.uc_alive = uc
+        events.append(("roles", uc))
+        events += self._new_turn()
+        events.append(("started",))
+        return events
+
+    def reset(self) -> list:
+        self.status = "waiting"
+        self.round = 0
+        self.pair = None
+        self.tally = None
+        self.pending = 0
+        self.undercover = SlotSet()
+        self.uc_alive = 0
+        self._ring([])
+        self.alive = self.seated.copy()
+        return [("reset",)]
+
+    def dump(self) -> dict:
+        """完整狀態（含發言順序、目前發言者、本輪的票），只用 JSON 型別；load() 可原樣還原。"""
+        return {
+            "early": self.early, "seated": sorted(self.seated), "status": self.status,
+            "round": self.round, "session": self.session, "pair": list(self.pair) if self.pair else None,
+            "alive": sorted(self.alive), "undercover": sorted(self.undercover),
+            "votes": list(self.votes.items()), "pending": self.pending,
+            "order": self.speak_queue(), "spoken": sorted(self.spoken),
+        }
+
+    def load(self, st: dict):
+        self.early = st["early"]
+        self.seated = SlotSet(st["seated"])
+        self.status = st["status"]
+        self.round = st["round"]
+        self.session = st["session"]
+        self.pair = tuple(st["pair"]) if st["pair"] else None
+        self.alive = SlotSet(st["alive"])
+        self.undercover = SlotSet(st["undercover"])
+        self.uc_alive = len(self.undercover & self.alive)
+        self.tally = Tally() if self.status == "voting" else None
+        for voter, target in st["votes"]:
+            self.tally.cast(voter, target)
+        self.pending = st["pending"]
+        self._ring(st["order"])     # order 從目前發言者開始
+        for slot in st["spoken"]:
+            self._mark(slot, SPOKE)
+
+    def restore(self, status: str, round_no: int, session: int, pair, alive, undercover) -> list:
+        """從日誌恢復（座位需先 seat 好）。日誌只到回合層級：發言中重新排一輪，投票中重新開票。"""
+        self.status = status
+        self.round = round_no
+        self.session = session
+        self.pair = tuple(pair) if pair else None
+        self.alive = SlotSet(alive) & self.seated if status != "waiting" else self.seated.copy()
+        self.undercover = SlotSet(undercover) & self.seated
+        self.uc_alive = len(self.undercover & self.alive)
+        self.tally = None
+        self.pending = 0
+        self._ring([])
+        if status == "playing":
+            return self._new_turn()
+        if status == "voting":
+            self.status = "playing"
+            return self.open_vote()
+        return []
+
+    def next_round(self) -> list:
+        """Host 強制進入下一回合。"""
+        self.status = "playing"
+        self.tally = None
+        self.pending = 0
+        self.round += 1
+        return self._new_turn() + [("round", self.round, True)]
+
+    # ----- 發言 -----
+    def say(self, slot: int, spoke: bool = True) -> list:
+        if self.status not in ("playing", "voting"):
+            return [("reject", "not_speaking_phase")]
+        if slot not in self.alive:
+            return [("reject", "dead")]
+        if self.status == "voting":
+            return [("reject", "voting")]
+        if slot < len(self.nxt) and self.nxt[slot] == SPOKE:
+            return [("reject", "already_spoke")]
+        current = self.cursor
+        if current is None:
+            return [("reject", "no_order")]
+        if slot != current:
+            return [("reject", "not_your_turn", current)]
+        events = []
+        if spoke:
+            events.append(("spoke", slot))
+        return events + self._advance(slot, spoke)
+
+    def _new_turn(self) -> list:
+        order = sorted(self.alive)
+        self.rng.shuffle(order)
+        self._ring(order)
+        return [("turn", order[0], True)] if order else []
+
+    def _ring(self, order: list):
+        n = len(order)
+        size = max(order) + 1 if order else 0
+        nxt, prv = [None] * size, [None] * size
+        for i, slot in enumerate(order):
+            nxt[slot] = order[(i + 1) % n]
+            prv[slot] = order[i - 1]
+        self.nxt, self.prv = nxt, prv
+        self.cursor = order[0] if order else None
+
+    def _in_ring(self, slot: int) -> bool:
+        # 環建好後才入座的人 slot 可能超出 list 長度
+        return slot < len(self.nxt) and self.nxt[slot] is not None and self.nxt[slot] != SPOKE
+
+    def _mark(self, slot: int, mark):
+        """不在環上的 slot 記成 SPOKE 或清掉（None）。"""
+        if slot >= len(self.nxt):
+            if mark is None:
+                return
+            grow = slot + 1 - len(self.nxt)
+            self.nxt.extend([None] * grow)
+            self.prv.extend([None] * grow)
+        self.nxt[slot] = mark
+
+    def _unlink(self, slot: int, spoke: bool = False) -> bool:
+        """把 slot 從發言環摘掉（spoke=True 記為本回合已發言），回傳它是否為目前發言者（cursor 會移到下一位）。"""
+        if not self._in_ring(slot):
+            self._mark(slot, SPOKE if spoke else None)
+            return False
+        nxt, prv = self.nxt[slot], self.prv[slot]
+        self.nxt[slot] = SPOKE if spoke else None
+        self.prv[slot] = None
+        was_current = self.cursor == slot
+        if nxt == slot:
+            self.cursor = None
+        else:
+            self.nxt[prv] = nxt
+            self.prv[nxt] = prv
+            if was_current:
+                self.cursor = nxt
+        return was_current
+
+    def _advance(self, who: int, done: bool) -> list:
+        # done=True：who 本回合講完，摘出環；False（空白發言）：留在環上，繞一圈後再輪到他
+        if self.status != "playing":
+            return []
+        if done:
+            self._unlink(who, spoke=True)
+        elif self._in_ring(who):
+            self.cursor = self.nxt[who]
+        if self.cursor is None:
+            return self.open_vote()
+        return [("turn", self.cursor, False)]
+
+    # ----- 投票 -----
+    def open_vote(self) -> list:
+        if self.status != "playing":
+            return []
+        self.status = "voting"
+        self._ring([])
+        self.tally = Tally()
+        self.pending = len(self.alive)
+        return [("vote_open",)]
+
+    def vote(self, voter: int, target) -> list:
+        """投票或改票（結算前都可改）；每票 O(1)，不重掃全部存活者。"""
+        if self.status != "voting":
+            return [("reject", "not_voting")]
+        if voter not in self.alive:
+            return [("reject", "dead_voter")]
+        if target not in self.alive:
+            return [("reject", "bad_target")]
+        old = self.tally.cast(voter, target)
+        if old is None:
+            self.pending -= 1
+        events = [("vote_ack", voter, old is not None)]
+        if self.pending <= 0 or (self.early and self.decided()):
+            events += self.settle()
+        return events
+
+    def decided(self) -> bool:
+        """剩下未投的票全投給第二名也追不上榜首。
+        只算未投的票：已投的人雖可在結算前改票，提前結算等於把已投的票凍結（改票可能翻盤的情形不考慮）。"""
+        return self.tally.margin() > self.pending
+
+    def settle(self) -> list:
+        # 投票截止（全員投完、提前確定或時間到）：未投者視為棄權
+        tally = self.tally
+        events = [("vote_result", [(v, tally.votes.get(v)) for v in sorted(self.alive)])]
+        top = tally.leaders()
+        self.tally = None
+        self.pending = 0
+
+        if len(top) != 1:
+            # 平票（含無人投票）：無人出局，留在同一回合，重新輪流發言一次
+            self.status = "playing"
+            return events + [("tie",)] + self._new_turn()
+
+        out = next(iter(top))
+        self.alive.discard(out)
+        if out in self.undercover:
+            self.uc_alive -= 1
+        events.append(("eliminated", out))
+        uc_alive = self.uc_alive
+        civ_alive = len(self.alive) - uc_alive
+        if uc_alive == 0:
+            self.status = "ended"
+            return events + [("gameover", "civilian")]
+        if uc_alive >= civ_alive:
+            self.status = "ended"
+            return events + [("gameover", "undercover")]
+        self.status = "playing"
+        self.round += 1
+        return events + self._new_turn() + [("round", self.round, False)]
+
+    # ----- 逾時 -----
+    def timeout(self) -> list:
+        if self.status == "playing":
+            current = self.cursor
+            if current is None:
+                return []
+            return [("timed_out", current)] + self._advance(current, True)
+        if self.status == "voting":
+            return [("vote_timeout",)] + self.settle()
+        return []
@@ -0,0 +1,130 @@
+# history.py — 已結束對局的歷史紀錄與統計。
+# 每局一行 JSON，整批附加到 history-<編號>.jsonl（只增不改）；統計不掃原始紀錄，
+# 而是收到每局時就累加進 rollup（總計 / 依人數 / 依詞對），查詢只讀 rollup。
+# rollup 定期連同「已涵蓋到的檔案位置」寫成 rollup-<編號>.json；啟動時讀 rollup，再補 fold 之後的尾巴。
+#
+# 一局的紀錄：
+#   {"room", "session", "started", "ended", "pair": [平民詞, 臥底詞],
+#    "players": [[slot, name, role], ...], "votes": [[[voter, target|None], ...], ...]（每次開票一組）,
+#    "eliminated": [slot, ...], "ties": 平票次數, "rounds": 回合數, "winner": "civilian"|"undercover"}
+import os, json
+
+# 累計欄位（依人數、依詞對共用同一種 list，省記憶體）
+GAMES, UC_WINS, ROUNDS, TIES, TIE_GAMES = range(5)
+
+def new_rollup() -> dict:
+    return {"offset": 0, "total": [0] * 5, "players": {}, "pairs": {}}
+
+def pair_key(pair) -> str:
+    return f"{pair[0]}\t{pair[1]}"
+
+def add(entry: list, game: dict):
+    entry[GAMES] += 1
+    entry[UC_WINS] += game["winner"] == "undercover"
+    entry[ROUNDS] += game["rounds"]
+    entry[TIES] += game["ties"]
+    entry[TIE_GAMES] += game["ties"] > 0
+
+def fold(rollup: dict, game: dict):
+    """把一局加進 rollup；O(1)。"""
+    add(rollup["total"], game)
+    n = str(len(game["players"]))
+    add(rollup["players"].setdefault(n, [0] * 5), game)
+    add(rollup["pairs"].setdefault(pair_key(game["pair"]), [0] * 5), game)
+
+def merge_rollup(into: dict, other: dict):
+    """把另一個 worker 的 rollup 累加進來（查詢時合併用）。"""
+    for i, v in enumerate(other["total"]):
+        into["total"][i] += v
+    for table in ("players", "pairs"):
+        mine = into[table]
+        for k, entry in other[table].items():
+            acc = mine.setdefault(k, [0] * 5)
+            for i, v in enumerate(entry):
+                acc[i] += v
+
+def summarize(entry: list) -> dict:
+    games = entry[GAMES]
+    if not games:
+        return {"games": 0}
+    return {
+        "games": games,
+        "civilian_win_rate": round(1 - entry[UC_WINS] / games, 4),
+        "undercover_win_rate": round(entry[UC_WINS] / games, 4),
+        "avg_rounds": round(entry[ROUNDS] / games, 3),
+        "ties_per_game": round(entry[TIES] / games, 3),
+        "tie_game_rate": round(entry[TIE_GAMES] / games, 4),
+    }
+
+class HistoryStore:
+    """單一 worker 的歷史檔。append/take/rollup_text 在 event loop 上；open/write/save_rollup/close 在背景執行緒，一次一個。"""
+
+    def __init__(self, directory: str, index: int):
+        self.log_path = os.path.join(directory, f"history-{index}.jsonl")
+        self.rollup_path = os.path.join(directory, f"rollup-{index}.json")
+        self.buffer = []            # 尚未寫出的對局
+        self.rollup = new_rollup()  # 已換出（寫入中或已寫入）的對局的統計
+        self.written = 0
+
+    def append(self, game: dict):
+        self.buffer.append(game)
+
+    def take(self) -> list:
+        """換出緩衝並計入 rollup；寫檔交給 write()。rollup 因此只比檔案早一批。"""
+        batch, self.buffer = self.buffer, []
+        for game in batch:
+            fold(self.rollup, game)
+        return batch
+
+    def open(self) -> dict:
+        """讀 rollup，再 fold 它之後寫進檔案的紀錄；rollup 遺失或對不上檔案時整份重建。"""
+        rollup = None
+        try:
+            with open(self.rollup_path, encoding="utf-8") as f:
+                rollup = json.load(f)
+        except (OSError, ValueError):
+            pass
+        if not os.path.exists(self.log_path):
+            open(self.log_path, "ab").close()
+        with open(self.log_path, "r+b") as f:
+            size = f.seek(0, os.SEEK_END)
+            if not rollup or rollup["offset"] > size:
+                rollup = new_rollup()
+            f.seek(rollup["offset"])
+            end = rollup["offset"]
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                end += len(line)
+                try:
+                    fold(rollup, json.loads(line))
+                except (ValueError, KeyError, TypeError):
+                    pass
+            if end < size:
+                f.truncate(end)     # 寫到一半當掉的最後一行：截掉，免得下一批接在它後面
+        rollup["offset"] = end
+        self.rollup = rollup
+        return rollup
+
+    def write(self, batch: list):
+        """整批附加到檔尾。只動 rollup["offset"]；詞對與計數只在 event loop 上（take）改。"""
+        data = "".join(json.dumps(g, ensure_ascii=False, separators=(",", ":")) + "\n" for g in batch).encode()
+        with open(self.log_path, "ab") as f:
+            f.write(data)
+        self.rollup["offset"] += len(data)
+        self.written += len(batch)
+
+    def rollup_text(self) -> str:
+        """在沒有寫入進行時序列化 rollup，offset 才會剛好對上已計入的對局。"""
+        return json.dumps(self.rollup, ensure_ascii=False, separators=(",", ":"))
+
+    def save_rollup(self, text: str):
+        tmp = self.rollup_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp, self.rollup_path)
+
+    def close(self, batch: list = ()):
+        if batch:
+            self.write(batch)
+        self.save_rollup(self.rollup_text())
@@ -0,0 +1,149 @@
+# journal.py — 房間狀態日誌：當機或重啟後把進行中的房間找回來。
+# event loop 上只做 append（放進記憶體 list）；寫檔在背景執行緒整批進行（write-behind），
+# 同一條執行緒把記錄折疊（fold）成每房的精簡狀態，每 snapshot_every 筆把有變動的房間寫進 snapshot 表，
+# 並刪掉已被涵蓋的日誌（compaction）。啟動時 = snapshot + 剩下的日誌依序 fold。
+#
+# 記錄：(room_id, at, kind, data)，at 為當下的房內廣播序號
+#   ("create", {host, speak_seconds, vote_seconds, early, use_builtin, pools, custom})
+#   ("join",   [cid, slot, name, token])        新入座或改名
+#   ("leave",  cid)
+#   ("start",  {session, pair, undercover, alive})
+#   ("eliminate", slot)
+#   ("phase",  [status, round])                 階段或回合變了（開票、平票重講、下一回合、結束）
+#   ("reset",  None)
+#   ("drop",   None)                            拆房
+# 日誌只到回合層級：發言進度與本輪的票不記，恢復後該回合重新輪流發言 / 重新開票。
+import json, sqlite3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS journal (seq INTEGER PRIMARY KEY, room TEXT, at INTEGER, kind TEXT, data TEXT);
+CREATE TABLE IF NOT EXISTS snapshot (room TEXT PRIMARY KEY, state TEXT);
+"""
+
+def new_room(data: dict) -> dict:
+    return {"settings": data, "host": data.get("host"), "players": {}, "at": 0,
+            "status": "waiting", "round": 0, "session": 0, "pair": None,
+            "alive": set(), "undercover": set()}
+
+def fold(rooms: dict, room_id: str, at: int, kind: str, data):
+    """把一筆記錄套到 rooms（room_id -> 狀態 dict）；與 engine 的座位規則一致。"""
+    if kind == "create":
+        rooms[room_id] = new_room(data)
+        return
+    st = rooms.get(room_id)
+    if st is None:
+        return
+    st["at"] = at
+    if kind == "join":
+        cid, slot, name, token = data
+        if cid not in st["players"]:
+            st["alive"].add(slot)       # 中途加入者視為存活的平民
+        st["players"][cid] = [slot, name, token]
+    elif kind == "leave":
+        p = st["players"].pop(data, None)
+        if p:
+            st["alive"].discard(p[0])
+            st["undercover"].discard(p[0])
+    elif kind == "start":
+        st.update(status="playing", round=1, session=data["session"], pair=data["pair"],
+                  alive=set(data["alive"]), undercover=set(data["undercover"]))
+    elif kind == "eliminate":
+        st["alive"].discard(data)
+    elif kind == "phase":
+        st["status"], st["round"] = data
+    elif kind == "reset":
+        st.update(status="waiting", round=0, pair=None, undercover=set(),
+                  alive={p[0] for p in st["players"].values()})
+    elif kind == "drop":
+        del rooms[room_id]
+
+def dump_state(st: dict) -> str:
+    return json.dumps({**st, "alive": sorted(st["alive"]), "undercover": sorted(st["undercover"])},
+                      ensure_ascii=False, separators=(",", ":"))
+
+def load_state(text: str) -> dict:
+    st = json.loads(text)
+    st["alive"] = set(st["alive"])
+    st["undercover"] = set(st["undercover"])
+    return st
+
+class Journal:
+    """單一 worker 的日誌檔。append 在 event loop 上呼叫；open/write/compact/close 都在背景執行緒，一次只有一個。"""
+
+    def __init__(self, path: str, snapshot_every: int = 5000):
+        self.path = path
+        self.snapshot_every = snapshot_every
+        self.buffer = []            # 尚未寫出的記錄
+        self.rooms = {}             # fold 後的狀態（只在寫入執行緒上讀寫）
+        self.dirty = set()          # 上次 snapshot 之後有變動的房間
+        self.since_snapshot = 0
+        self.written = 0
+        self.snapshots = 0
+        self.db = None
+
+    def append(self, room_id: str, at: int, kind: str, data=None):
+        self.buffer.append((room_id, at, kind, data))
+
+    def take(self) -> list:
+        """在 event loop 上把緩衝整批換出；交給 write() 在執行緒裡寫。"""
+        batch, self.buffer = self.buffer, []
+        return batch
+
+    def open(self) -> dict:
+        """開檔並重建狀態，回傳 room_id -> 狀態 dict（呼叫端不可修改）。"""
+        self.db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")    # WAL 下只在 checkpoint 時 fsync；掉電最多丟最後幾批
+        self.db.executescript(SCHEMA)
+        for room_id, state in self.db.execute("SELECT room, state FROM snapshot"):
+            self.rooms[room_id] = load_state(state)
+        tail = 0
+        for room_id, at, kind, data in self.db.execute("SELECT room, at, kind, data FROM journal ORDER BY seq"):
+            fold(self.rooms, room_id, at, kind, json.loads(data))
+            self.dirty.add(room_id)
+            tail += 1
+        self.since_snapshot = tail
+        if tail:
+            self.compact()
+        return self.rooms
+
+    def write(self, batch: list):
+        rows = [(room_id, at, kind, json.dumps(data, ensure_ascii=False, separators=(",", ":")))
+                for room_id, at, kind, data in batch]
+        db = self.db
+        db.execute("BEGIN")
+        db.executemany("INSERT INTO journal (room, at, kind, data) VALUES (?, ?, ?, ?)", rows)
+        db.execute("COMMIT")
+        for room_id, at, kind, data in batch:
+            fold(self.rooms, room_id, at, kind, data)
+            self.dirty.add(room_id)
+        self.written += len(batch)
+        self.since_snapshot += len(batch)
+        if self.since_snapshot >= self.snapshot_every:
+            self.compact()
+
+    def compact(self):
+        """有變動的房間寫進 snapshot、拆掉的刪除，再刪掉全部日誌；同一個交易，中途當掉不會半套。"""
+        db = self.db
+        db.execute("BEGIN")
+        for room_id in self.dirty:
+            st = self.rooms.get(room_id)
+            if st is None:
+                db.execute("DELETE FROM snapshot WHERE room = ?", (room_id,))
+            else:
+                db.execute("INSERT OR REPLACE INTO snapshot (room, state) VALUES (?, ?)", (room_id, dump_state(st)))
+        db.execute("DELETE FROM journal")
+        db.execute("COMMIT")
+        self.dirty.clear()
+        self.since_snapshot = 0
+        self.snapshots += 1
+
+    def close(self, batch: list = ()):
+        if self.db is None:
+            return
+        if batch:
+            self.write(batch)
+        if self.since_snapshot:
+            self.compact()
+        self.db.close()
+        self.db = None
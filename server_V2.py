@@ -1,11 +1,37 @@
 # server_V2.py — 多臥底版（自動投票 / 搶話提示 / 平票重講 / 起始UC= floor(n/2)-1 / 投票明細
 # + 粗體輪到的人 / Host可踢人 / 可選每人發言20秒倒數
 # + NEW: 每局結束彈窗揭示身份與字詞（10秒，玩家名稱粗體）、開始遊戲時顯示本局臥底人數
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Response
-from fastapi.responses import HTMLResponse
-import uvicorn, json, random, uuid, math, asyncio
-
-app = FastAPI()
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Response, Request
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse
+from contextlib import asynccontextmanager
+import uvicorn, json, random, uuid, asyncio, os, time, traceback, zlib, fcntl, base64, heapq, gzip, hashlib, csv, codecs, re, unicodedata, secrets, hmac, bisect, signal
+from collections import deque
+from engine import Game
+from journal import Journal
+from history import HistoryStore, GAMES, UC_WINS, new_rollup, merge_rollup, summarize
+
+@asynccontextmanager
+async def lifespan(app):
+    # 先搶 worker 編號，接手上一代交出的房間、再讀日誌，最後才開 IPC 收其他 worker 轉來的指令
+    await backend.claim()
+    await handoff_receive()
+    await journal_open()
+    await history_open()
+    await backend.start()
+    install_drain_signal()
+    tasks = [asyncio.create_task(reaper_loop()), asyncio.create_task(lag_watchdog())]
+    if journal:
+        tasks.append(asyncio.create_task(journal_loop()))
+    if history_store:
+        tasks.append(asyncio.create_task(history_loop()))
+    yield
+    for t in tasks:
+        t.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await drain()
+    await backend.stop()
+
+app = FastAPI(lifespan=lifespan)
 
 # ===== 內建題庫 =====
 WORD_PAIRS = [
@@ -21,562 +47,2492 @@ WORD_PAIRS = [
     ("蕾絲","絲襪"),("爺爺","外公"),("紅燒牛肉麵","清燉牛肉麵"),("老公","老公公"),
 ]
 
+# ===== 題庫 =====
+# 題庫一律是不可變的 tuple，登記在 word_pools 供所有房間共用；內容相同的題庫只會存一份。
+# 房間不複製題庫，只持有 Deck：共用題庫 + 房內自訂題目（overlay）的串接視圖，
+# 抽題用延遲 Fisher–Yates 洗牌袋，只記錄被換過位置的索引，每次抽題 O(1)，一袋抽完才重洗。
+class WordPool:
+    __slots__ = ("id", "name", "pairs")
+
+    def __init__(self, pool_id: str, pairs: tuple, name: str | None = None):
+        self.id = pool_id
+        self.name = name or pool_id
+        self.pairs = pairs          # tuple[(a,b)]
+
+# word_pools[pool_id] = WordPool
+word_pools = {}
+
+def pool_digest(pairs) -> str:
+    h = hashlib.sha256()
+    for a, b in pairs:
+        h.update(f"{a}\t{b}\n".encode())
+    return h.hexdigest()[:16]
+
+def register_pool(pairs, pool_id: str | None = None, name: str | None = None) -> WordPool:
+    """登記題庫；未指定 id 時以內容雜湊為 id，同內容重複登記回傳既有的那份。"""
+    pairs = tuple((a, b) for a, b in pairs)
+    pool_id = pool_id or pool_digest(pairs)
+    wp = word_pools.get(pool_id)
+    if not wp:
+        wp = word_pools[pool_id] = WordPool(pool_id, pairs, name)
+    return wp
+
+BUILTIN_POOL = register_pool(WORD_PAIRS, "builtin")
+
+class Deck:
+    __slots__ = ("segments", "size", "drawn", "swaps")
+
+    def __init__(self, pools: list, overlay: tuple = ()):
+        self.segments = tuple(wp.pairs for wp in pools if wp.pairs)
+        if overlay:
+            self.segments += (tuple(overlay),)
+        self.size = sum(len(seg) for seg in self.segments)
+        self.drawn = 0              # 本袋已抽張數；[0, drawn) 為已抽出的位置
+        self.swaps = {}             # 位置 -> 換過來的原始索引（沒換過的位置 i 就是 i）
+
+    def _at(self, i: int):
+        for seg in self.segments:
+            if i < len(seg):
+                return seg[i]
+            i -= len(seg)
+        raise IndexError(i)
+
+    def draw(self, avoid=None):
+        """抽一題；同一袋內不重複。avoid 為上一局的題目，避免換袋時馬上又抽到。"""
+        if not self.size:
+            return None
+        if self.drawn >= self.size:
+            self.drawn = 0
+            self.swaps.clear()
+        i, n, swaps = self.drawn, self.size, self.swaps
+        j = random.randrange(i, n)
+        pair = self._at(swaps.get(j, j))
+        if pair == avoid and n - i > 1:
+            # 抽到上一題（只會發生在換袋後）：改從其餘位置均勻抽一個，不靠重試碰運氣
+            k = random.randrange(i, n - 1)
+            j = k + (k >= j)
+            pair = self._at(swaps.get(j, j))
+        # 位置 i 之後不會再被讀，只需把 i 原本的索引搬到 j
+        swaps[j] = swaps.pop(i, i)
+        self.drawn = i + 1
+        return pair
+
 # ===== 房間狀態 =====
-# rooms[room_id] = {
-#   "host": cid,
-#   "clients": { cid: {"ws":ws, "name":str, "alive":bool, "role":"civilian"|"undercover"} },
-#   "status": "waiting"|"playing"|"voting"|"ended",
-#   "round": int,
-#   "word_pool": list[(a,b)],
-#   "pair": (a,b)|None,
-#   "last_pair": (a,b)|None,
-#   "undercover_ids": set[cid],
-#   "votes": { voter_cid: target_cid },
-#   "session": int,
-#   "speak_order": [cid,...],
-#   "speak_index": int,
-#   "spoken_this_turn": set[cid],
-#   "limit_20s": bool,
-#   "speak_token": str|None,
-#   "timer_task": asyncio.Task|None
-# }
+# 玩家與房間改用 __slots__ 類別：沒有逐個實例的 __dict__，屬性存取也比多層字串 key 便宜。
+# 遊戲規則狀態（存活、臥底、發言順序、票）在 engine.Game，一律以整數座位 slot 表示；
+# Room 只保留連線、計時器與廣播相關的部分。
+class Inbox:
+    """房間 actor 的指令佇列：介面取 asyncio.Queue 用到的部分。
+    asyncio.Queue 每個實例自帶兩個 deque、計數器與 Event 等物件，每房都建一個太佔記憶體；
+    這裡只有一個 deque，有指令排隊時才建立、取空就放掉（閒置的房間佔大多數）；
+    等待用的 future 在 actor 真的閒下來等指令時才建立。"""
+    __slots__ = ("items", "waiter")
+
+    def __init__(self):
+        self.items = None
+        self.waiter = None
+
+    def put_nowait(self, item):
+        if self.items is None:
+            self.items = deque()
+        self.items.append(item)
+        w = self.waiter
+        if w is not None and not w.done():
+            w.set_result(None)
+
+    async def get(self):
+        while not self.items:
+            self.waiter = asyncio.get_running_loop().create_future()
+            try:
+                await self.waiter
+            finally:
+                self.waiter = None
+        item = self.items.popleft()
+        if not self.items:
+            self.items = None
+        return item
+
+    def qsize(self) -> int:
+        return len(self.items) if self.items else 0
+
+    def empty(self) -> bool:
+        return not self.items
+
+class Player:
+    __slots__ = ("cid", "slot", "name", "out", "secret", "expire")
+
+    def __init__(self, cid: str, slot: int, name: str, out):
+        self.cid = cid
+        self.slot = slot
+        self.name = name
+        self.out = out              # Outbox；斷線保留座位期間為 OFFLINE
+        self.secret = secrets.token_bytes(16)   # 斷線重連憑證的祕密部分（完整 token 見 token）
+        self.expire = None          # 斷線保留座位的到期計時（scheduler Timer）
+
+    @property
+    def token(self) -> str:
+        """斷線重連憑證 "<cid>.<secret>"；用到才組字串，每位玩家只存 16 bytes。"""
+        return f"{self.cid}.{base64.urlsafe_b64encode(self.secret).rstrip(b'=').decode()}"
+
+    @token.setter
+    def token(self, token: str):
+        # 日誌 / 交接帶來的 token（與 secrets.token_urlsafe(16) 同一種編碼）
+        self.secret = base64.urlsafe_b64decode(token.partition(".")[2] + "==")
+
+class Room:
+    __slots__ = (
+        "id", "host", "clients", "seats", "game",
+        "setup", "deck", "last_pair",
+        "speak_seconds", "vote_seconds", "timer",
+        "inbox", "actor", "cmd_max",
+        "roster_ver", "seq", "history", "last_active", "audience", "record",
+    )
+
+    def __init__(self, room_id: str, host: str, deck: Deck | None = None, speak_seconds: int = 0):
+        self.id = room_id
+        self.host = host
+        self.clients = {}               # cid -> Player
+        self.seats = []                 # seats[slot] -> Player|None（離開後留空，不回收）
+        self.game = Game()              # 規則狀態，見 engine.py
+        self.setup = None               # 建房設定（日誌 / 交接時用來重建房間與 Deck）
+        self.deck = deck or Deck([BUILTIN_POOL])
+        self.last_pair = None
+        self.speak_seconds = speak_seconds  # 每人發言時限，0 = 不限
+        self.vote_seconds = 0           # 投票時限，0 = 不限
+        self.timer = None               # 目前的發言/投票計時（scheduler Timer）
+        # actor：本房所有狀態變更都經由 inbox 依序套用
+        self.inbox = Inbox()
+        self.actor = None
+        self.cmd_max = 0.0              # 本房處理最久的一則指令（秒，不含排隊），見 /metrics
+        self.roster_ver = 0             # 名單版本，每次增量 +1
+        self.seq = 0                    # 廣播事件序號
+        self.history = None             # 最近的廣播 Frame，供重連補送；第一次廣播才建立（deque）
+        self.last_active = time.monotonic()         # 最後一次處理指令的時間（閒置回收用）
+        self.audience = None            # 觀眾（Audience），第一位觀眾進來才建立
+        self.record = None              # 進行中這局的歷史紀錄（見「對局歷史」），局結束時交出
+
+    @property
+    def status(self) -> str:
+        return self.game.status
+
+    @property
+    def round(self) -> int:
+        return self.game.round
+
+    @property
+    def session(self) -> int:
+        return self.game.session
+
+    def add_player(self, cid: str, name: str, out) -> Player:
+        p = Player(cid, len(self.seats), name, out)
+        self.seats.append(p)
+        self.clients[cid] = p
+        return p
+
+    def remove_player(self, cid: str):
+        p = self.clients.pop(cid, None)
+        if p:
+            self.seats[p.slot] = None
+        return p
+
+# rooms[room_id] = Room
 rooms = {}
 
+# 反查索引：client_room[cid] = room_id；建房/入房/踢人/斷線/拆房時同步維護，
+# 讓每則訊息的 room_of() 不必掃過所有房間
+client_room = {}
+
+# ===== 訊息編碼 =====
+# 連線時以 ?enc= 協商序列化格式，?z=1 表示前端能解 deflate-raw。
+#   json / orjson：文字 frame（orjson 有裝就當預設，兩者輸出同樣的 JSON）
+#   msgpack      ：二進位 frame，給非瀏覽器客戶端
+# 廣播先包成 Frame，同一種格式只編碼/壓縮一次，整房共用同一份資料。
+# 大於 DEFLATE_MIN 的 JSON 會在應用層壓一次後以二進位 frame 送出；
+# 因此 worker 端關閉 permessage-deflate（見 uc_worker.py），避免每條連線各自重壓。
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+DEFLATE_MIN = int(os.environ.get("DEFLATE_MIN", "1024"))
+
+class Codec:
+    __slots__ = ("name", "binary", "encode", "decode")
+
+    def __init__(self, name, binary, encode, decode):
+        self.name = name
+        self.binary = binary
+        self.encode = encode
+        self.decode = decode
+
+CODECS = {"json": Codec("json", False, lambda o: json.dumps(o, ensure_ascii=False), json.loads)}
+if orjson:
+    CODECS["orjson"] = Codec("orjson", False, lambda o: orjson.dumps(o).decode(), orjson.loads)
+if msgpack:
+    CODECS["msgpack"] = Codec("msgpack", True, msgpack.packb, msgpack.unpackb)
+DEFAULT_CODEC = "orjson" if orjson else "json"
+
+def deflate(data: str) -> bytes:
+    z = zlib.compressobj(6, zlib.DEFLATED, -15)
+    return z.compress(data.encode()) + z.flush()
+
+class Frame:
+    """一則待送出的訊息；data(fmt) 依 (codec, z) 快取編碼結果。"""
+    __slots__ = ("payload", "low", "cache")
+
+    def __init__(self, payload: dict):
+        self.payload = payload
+        self.low = payload.get("type") in LOW_PRIORITY_TYPES
+        self.cache = {}
+
+    def data(self, fmt: tuple):
+        d = self.cache.get(fmt)
+        if d is None:
+            codec, z = fmt
+            d = CODECS[codec].encode(self.payload)
+            if z and len(d) >= DEFLATE_MIN:
+                d = deflate(d)
+            self.cache[fmt] = d
+        return d
+
+def msgpack_array(parts: list) -> bytes:
+    # 已編碼的 msgpack 物件直接接在陣列標頭後面即可組成陣列
+    n = len(parts)
+    head = bytes([0x90 | n]) if n < 16 else b"\xdc" + n.to_bytes(2, "big")
+    return head + b"".join(parts)
+
+def negotiate_fmt(ws: WebSocket) -> tuple:
+    codec = ws.query_params.get("enc") or DEFAULT_CODEC
+    if codec not in CODECS:
+        codec = DEFAULT_CODEC
+    z = ws.query_params.get("z") == "1" and not CODECS[codec].binary
+    return (codec, z)
+
+# ===== 連線輸出佇列 =====
+# 每條連線一個有界佇列 + 專屬 writer task；broadcast 只負責入列，不再逐一 await 送出，
+# 慢的手機只會拖慢自己。佇列滿時依 OUTBOX_POLICY 處理：
+#   "drop_oldest"：丟掉最舊的低優先訊息（狀態/提示），沒有可丟的才斷線
+#   "disconnect" ：直接斷開該連線
+OUTBOX_SIZE = int(os.environ.get("OUTBOX_SIZE", "128"))
+OUTBOX_POLICY = os.environ.get("OUTBOX_POLICY", "drop_oldest")
+LOW_PRIORITY_TYPES = {"status", "hint", "chat_divider", "vote_ack", "ping"}
+# 批次模式（連線時帶 ?batch=1 協商）：writer 醒來時把佇列中累積的訊息
+# 併成一個陣列 frame 送出；一次 handler 產生的多則訊息通常會落在同一批。
+# 已壓縮的大訊息不併批，單獨送出。
+OUTBOX_BATCH = os.environ.get("OUTBOX_BATCH", "1") == "1"
+OUTBOX_BATCH_MAX = int(os.environ.get("OUTBOX_BATCH_MAX", "64"))
+
+class Outbox:
+    def __init__(self, ws: WebSocket, conn: str, batch: bool = False, fmt: tuple = (DEFAULT_CODEC, False)):
+        self.ws = ws
+        self.conn = conn              # 連線 id（每條 socket 一個，重連後玩家 cid 不變、conn 會換）
+        self.cid = conn               # 這條連線代表的玩家；房間 actor 驗過 resume 才 bind 成原座位的 cid
+        self.batch = batch
+        self.fmt = fmt                # (codec, z)
+        self.queue = deque()          # [(data, low_priority)]，data 為 str 或 bytes
+        self.wake = asyncio.Event()
+        self.closing = False          # 送完剩餘訊息後關閉
+        self.closed = False
+        self.close_code = 1000
+        self.dropped = 0
+        self.last_seen = time.monotonic()   # 最後一次收到客戶端 frame 的時間
+        self.task = asyncio.create_task(self._writer())
+
+    def push(self, data, low: bool = False) -> bool:
+        if self.closed or self.closing:
+            return False
+        if len(self.queue) >= OUTBOX_SIZE:
+            if OUTBOX_POLICY != "drop_oldest" or not self._drop_oldest_low():
+                print(f"[ws] outbox full, disconnecting: {self.conn}")
+                OUTBOX_DROPS.inc(len(self.queue), "disconnect")
+                self.close(drain=False, code=1013)
+                return False
+        self.queue.append((data, low))
+        self.wake.set()
+        return True
+
+    def _drop_oldest_low(self) -> bool:
+        for i, (_, low) in enumerate(self.queue):
+            if low:
+                del self.queue[i]
+                self.dropped += 1
+                OUTBOX_DROPS.inc(1, "low_priority")
+                return True
+        return False
+
+    def bind(self, cid: str):
+        self.cid = cid
+
+    def close(self, drain: bool = True, code: int = 1000):
+        if self.closed: return
+        self.close_code = code
+        if not drain:
+            self.queue.clear()
+        self.closing = True
+        self.wake.set()
+
+    async def _writer(self):
+        try:
+            while True:
+                while self.queue:
+                    data = self._next_frame()
+                    if isinstance(data, str):
+                        await self.ws.send_text(data)
+                    else:
+                        await self.ws.send_bytes(data)
+                if self.closing:
+                    break
+                self.wake.clear()
+                await self.wake.wait()
+            await self.ws.close(code=self.close_code)
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            pass
+        finally:
+            self.closed = True
+            self.queue.clear()
+
+    def _next_frame(self):
+        data, _ = self.queue.popleft()
+        if not self.batch or not self.queue:
+            return data
+        # 文字 JSON 可併；二進位只有 msgpack 能併（JSON 的二進位 frame 是壓縮過的）
+        kind = type(data)
+        if kind is bytes and not CODECS[self.fmt[0]].binary:
+            return data
+        parts = [data]
+        while self.queue and len(parts) < OUTBOX_BATCH_MAX and type(self.queue[0][0]) is kind:
+            parts.append(self.queue.popleft()[0])
+        if len(parts) == 1:
+            return data
+        return "[" + ",".join(parts) + "]" if kind is str else msgpack_array(parts)
+
+    def stop(self):
+        """連線結束時呼叫：直接取消 writer。"""
+        self.closed = True
+        self.queue.clear()
+        if not self.task.done():
+            self.task.cancel()
+
+class OfflineOutbox:
+    """斷線保留座位期間的佔位：訊息直接丟棄，重連時由 history 補送。"""
+    conn = None
+    fmt = (DEFAULT_CODEC, False)
+
+    def push(self, data, low: bool = False) -> bool:
+        return False
+
+    def bind(self, cid: str):
+        pass
+
+    def close(self, drain: bool = True, code: int = 1000):
+        pass
+
+    def stop(self):
+        pass
+
+OFFLINE = OfflineOutbox()
+
+# ===== 計時器 =====
+# 所有房間的發言/投票期限共用一個 heap 排程器：底層只掛一個 loop.call_at，
+# 到期時一次取出所有已到期的項目批次觸發，不再每換一位發言者就建立/取消一個 Task。
+# 取消採惰性標記，過期項目累積過多時才重建 heap。cancelled 只計還留在 heap 裡的已取消項目。
+class Timer:
+    __slots__ = ("when", "callback", "args", "cancelled")
+
+    def __init__(self, when: float, callback, args: tuple):
+        self.when = when
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+class Scheduler:
+    def __init__(self):
+        self.heap = []          # [(when, seq, Timer)]
+        self.seq = 0
+        self.handle = None      # 底層 asyncio.TimerHandle
+        self.armed_at = None
+        self.cancelled = 0
+        self.fired = 0
+
+    def call_later(self, delay: float, callback, *args) -> Timer:
+        loop = asyncio.get_running_loop()
+        t = Timer(loop.time() + delay, callback, args)
+        self.seq += 1
+        heapq.heappush(self.heap, (t.when, self.seq, t))
+        if self.armed_at is None or t.when < self.armed_at:
+            self._arm(loop)
+        return t
+
+    def cancel(self, t: Timer):
+        if t.cancelled: return
+        t.cancelled = True
+        self.cancelled += 1
+        if self.cancelled > 64 and self.cancelled * 2 > len(self.heap):
+            self.heap = [e for e in self.heap if not e[2].cancelled]
+            heapq.heapify(self.heap)
+            self.cancelled = 0
+
+    def __len__(self):
+        return len(self.heap) - self.cancelled
+
+    def _arm(self, loop):
+        if self.handle:
+            self.handle.cancel()
+            self.handle = self.armed_at = None
+        while self.heap and self.heap[0][2].cancelled:
+            heapq.heappop(self.heap)
+            self.cancelled -= 1
+        if self.heap:
+            self.armed_at = self.heap[0][0]
+            self.handle = loop.call_at(self.armed_at, self._fire)
+
+    def _fire(self):
+        loop = asyncio.get_running_loop()
+        self.handle = self.armed_at = None
+        now = loop.time()
+        due = []
+        while self.heap and self.heap[0][0] <= now:
+            _, _, t = heapq.heappop(self.heap)
+            if t.cancelled:
+                self.cancelled -= 1
+            else:
+                t.cancelled = True  # 已出 heap：之後再 cancel（例如 actor 先處理了排在前面的指令）不可再計數
+                due.append(t)
+        for t in due:
+            self.fired += 1
+            try:
+                t.callback(*t.args, t)
+            except Exception:
+                traceback.print_exc()
+        self._arm(loop)
+
+scheduler = Scheduler()
+
+# ===== 監控指標 =====
+# 行程內指標登錄表，GET /metrics 以 Prometheus 文字格式輸出。
+# 熱路徑只做一次 bisect 加幾次加法：直方圖的 bucket 建立時就配置好；
+# 所有更新都在 event loop 執行緒上，不需要鎖。即時數量（房間、連線、佇列深度）在抓取時才計算。
+# 多 worker 時每個 worker 各自一份，回應的是處理該次請求的 worker。
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+LAG_SAMPLE_INTERVAL = float(os.environ.get("LAG_SAMPLE_INTERVAL", "0.25"))
+
+metrics = []    # 依登錄順序輸出
+
+def fmt_labels(pairs) -> str:
+    pairs = [(k, v) for k, v in pairs if k is not None]
+    return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}" if pairs else ""
+
+class Histogram:
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds: tuple):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)   # 最後一格為 +Inf
+        self.sum = 0.0
+
+    def observe(self, v: float):
+        self.counts[bisect.bisect_left(self.bounds, v)] += 1
+        self.sum += v
+
+class HistogramMetric:
+    """直方圖家族；label 值 -> Histogram。sample 不為 None 時於抓取當下由 sample() 的數值現算。"""
+
+    def __init__(self, name: str, help: str, bounds: tuple, label: str | None = None, sample=None):
+        self.name = name
+        self.help = help
+        self.bounds = bounds
+        self.label = label
+        self.sample = sample
+        self.children = {}
+        metrics.append(self)
+
+    def labels(self, value=None) -> Histogram:
+        h = self.children.get(value)
+        if h is None:
+            h = self.children[value] = Histogram(self.bounds)
+        return h
+
+    def observe(self, v: float, value=None):
+        self.labels(value).observe(v)
+
+    def render(self) -> list:
+        children = self.children
+        if self.sample:
+            h = Histogram(self.bounds)
+            for v in self.sample():
+                h.observe(v)
+            children = {None: h}
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for value, h in children.items():
+            base = [(self.label, value)] if self.label else []
+            acc = 0
+            for bound, n in zip(self.bounds + ("+Inf",), h.counts):
+                acc += n
+                lines.append(f"{self.name}_bucket{fmt_labels(base + [('le', bound)])} {acc}")
+            lines.append(f"{self.name}_sum{fmt_labels(base)} {h.sum}")
+            lines.append(f"{self.name}_count{fmt_labels(base)} {acc}")
+        return lines
+
+class CounterMetric:
+    def __init__(self, name: str, help: str, label: str | None = None):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.values = {} if label else {None: 0}
+        metrics.append(self)
+
+    def inc(self, n: int = 1, value=None):
+        self.values[value] = self.values.get(value, 0) + n
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for value, n in self.values.items():
+            lines.append(f"{self.name}{fmt_labels([(self.label, value)])} {n}")
+        return lines
+
+class GaugeMetric:
+    """抓取時呼叫 fn()；回傳單一數值，或 {label 值: 數值}。kind 可設為 counter 給外部累計值用。"""
+
+    def __init__(self, name: str, help: str, fn, label: str | None = None, kind: str = "gauge"):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.label = label
+        self.kind = kind
+        metrics.append(self)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        v = self.fn()
+        items = v.items() if isinstance(v, dict) else [(None, v)]
+        for value, n in items:
+            lines.append(f"{self.name}{fmt_labels([(self.label, value)])} {n}")
+        return lines
+
+def render_metrics() -> str:
+    lines = []
+    for m in metrics:
+        lines.extend(m.render())
+    return "\n".join(lines) + "\n"
+
+# actor 內部事件（指令以外）；handler 名稱以外的標籤一律歸為 "other"，限制指標基數
+ACTOR_KINDS = frozenset({"leave", "lost", "expire", "timeout"})
+
+def live_players() -> dict:
+    online = offline = 0
+    for r in rooms.values():
+        for p in r.clients.values():
+            if p.out is OFFLINE:
+                offline += 1
+            else:
+                online += 1
+    return {"online": online, "offline": offline}
+
+HANDLER_SECONDS = HistogramMetric("undercover_handler_seconds",
+    "Room actor command processing time by message type.", LATENCY_BUCKETS, label="type")
+BROADCAST_SECONDS = HistogramMetric("undercover_broadcast_seconds",
+    "Time to encode and enqueue one broadcast to every player in a room.", LATENCY_BUCKETS)
+BROADCAST_FANOUT = HistogramMetric("undercover_broadcast_recipients",
+    "Number of connections a broadcast was enqueued to.", SIZE_BUCKETS)
+SEND_FAILURES = CounterMetric("undercover_send_failures_total",
+    "Frames not enqueued because the connection was closing, closed or offline.")
+OUTBOX_DROPS = CounterMetric("undercover_outbox_drops_total",
+    "Outbound frames dropped by the full-queue policy.", label="reason")
+LOOP_LAG = HistogramMetric("undercover_loop_lag_seconds",
+    "Event loop scheduling delay sampled by the watchdog.", LATENCY_BUCKETS)
+loop_lag_last = 0.0
+GaugeMetric("undercover_loop_lag_last_seconds", "Most recent event loop lag sample.", lambda: loop_lag_last)
+GaugeMetric("undercover_rooms", "Rooms owned by this worker.", lambda: len(rooms))
+GaugeMetric("undercover_connections", "WebSocket connections held by this worker.", lambda: len(connections))
+GaugeMetric("undercover_players", "Seated players in rooms owned by this worker.", live_players, label="state")
+GaugeMetric("undercover_spectators", "Spectators watching rooms owned by this worker.",
+    lambda: sum(len(r.audience.viewers) for r in rooms.values() if r.audience))
+INBOUND_DROPS = CounterMetric("undercover_inbound_dropped_total",
+    "Inbound frames dropped before reaching a room.", label="reason")
+INBOUND_DISCONNECTS = CounterMetric("undercover_inbound_disconnects_total",
+    "Connections closed by the inbound policy.", label="reason")
+AUDIENCE_SKIPPED = CounterMetric("undercover_audience_skipped_total",
+    "Frames not sent to spectators that were falling behind.")
+JOURNAL_RECORDS = CounterMetric("undercover_journal_records_total",
+    "Room state transitions written to the journal.")
+JOURNAL_FLUSH_SECONDS = HistogramMetric("undercover_journal_flush_seconds",
+    "Time to write one journal batch (off the event loop).", LATENCY_BUCKETS)
+GaugeMetric("undercover_journal_backlog", "Journal records waiting for the next flush.",
+    lambda: len(journal.buffer) if journal else 0)
+HISTORY_GAMES = CounterMetric("undercover_history_games_total",
+    "Finished games appended to the history store.")
+HISTORY_FLUSH_SECONDS = HistogramMetric("undercover_history_flush_seconds",
+    "Time to append one history batch (off the event loop).", LATENCY_BUCKETS)
+HistogramMetric("undercover_room_players", "Seated players per room.", SIZE_BUCKETS,
+    sample=lambda: (len(r.clients) for r in rooms.values()))
+HistogramMetric("undercover_outbox_depth", "Queued outbound frames per connection.", SIZE_BUCKETS,
+    sample=lambda: (len(out.queue) for out in connections.values()))
+GaugeMetric("undercover_room_inbox_depth_max", "Deepest room actor inbox.",
+    lambda: max((r.inbox.qsize() for r in rooms.values()), default=0))
+GaugeMetric("undercover_room_command_seconds_max", "Slowest single command processed by any live room.",
+    lambda: max((r.cmd_max for r in rooms.values()), default=0.0))
+GaugeMetric("undercover_timers_pending", "Live entries in the timer scheduler.", lambda: len(scheduler))
+GaugeMetric("undercover_timers_fired_total", "Timers fired by the scheduler.", lambda: scheduler.fired, kind="counter")
+GaugeMetric("undercover_reaped_total", "Resources reclaimed by the reaper.",
+    lambda: {k: v for k, v in reaper_stats.items() if k != "runs"}, label="kind", kind="counter")
+
+async def lag_watchdog():
+    global loop_lag_last
+    loop = asyncio.get_running_loop()
+    while True:
+        t = loop.time()
+        await asyncio.sleep(LAG_SAMPLE_INTERVAL)
+        loop_lag_last = max(0.0, loop.time() - t - LAG_SAMPLE_INTERVAL)
+        LOOP_LAG.observe(loop_lag_last)
+
 # ===== Web Pages =====
 @app.get("/", response_class=HTMLResponse)
-async def index():
-    return HTMLResponse(HTML)
+async def index(request: Request):
+    return asset_response(request, ASSETS[""])
+
+@app.get("/static/{name}")
+async def static_asset(name: str, request: Request):
+    asset = ASSETS.get(name) if name else None
+    if not asset:
+        return Response(status_code=404)
+    return asset_response(request, asset)
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
 
 @app.get("/favicon.ico")
 async def favicon():
     return Response(status_code=204)
 
+# ===== 題庫上傳 =====
+# POST /pools?fmt=csv|jsonl&name=...&upload=<token>：串流解析上傳內容，不把整份檔案讀進記憶體。
+#   每行一組（CSV：a,b；JSONL：["a","b"] 或 {"a":..,"b":..}），NFKC 正規化、壓縮空白後去重，
+#   (a,b) 與 (b,a) 視為同一組，內建題庫已有的組合也略過。
+#   結果排序後依內容雜湊登記成共用題庫，並寫入 POOL_DIR 讓其他 worker 建房時按需載入。
+# GET /pools/progress/{token}：上傳進度（只有處理該上傳的 worker 查得到，結束 60 秒後清除）。
+POOL_DIR = os.environ.get("UC_POOL_DIR", "/tmp/undercover-pools")
+UPLOAD_MAX_BYTES = int(os.environ.get("UC_UPLOAD_MAX_BYTES", str(8 * 1024 * 1024)))
+UPLOAD_MAX_PAIRS = int(os.environ.get("UC_UPLOAD_MAX_PAIRS", "100000"))
+UPLOAD_LINE_MAX = 1024
+WORD_MAX_CHARS = 32
+CUSTOM_INLINE_MAX = 200     # create_room_setup 內嵌 custom_list 的上限
+POOL_ID_RE = re.compile(r"[0-9a-f]{16}")
+
+uploads = {}                # token -> 進度 stats
+
+class UploadError(Exception):
+    def __init__(self, status: int, error: str):
+        super().__init__(error)
+        self.status = status
+        self.error = error
+
+def normalize_word(w) -> str:
+    if not isinstance(w, str):
+        return ""
+    return " ".join(unicodedata.normalize("NFKC", w).split())
+
+def pair_key(a: str, b: str) -> tuple:
+    return (a, b) if a <= b else (b, a)
+
+BUILTIN_KEYS = frozenset(pair_key(normalize_word(a), normalize_word(b)) for a, b in WORD_PAIRS)
+
+def parse_pair_line(line: str, fmt: str):
+    if fmt == "jsonl":
+        try:
+            row = json.loads(line)
+        except ValueError:
+            return None
+        if isinstance(row, dict):
+            row = [row.get("a"), row.get("b")]
+    else:
+        row = next(csv.reader([line]), None)
+    if not isinstance(row, list) or len(row) != 2:
+        return None
+    a, b = normalize_word(row[0]), normalize_word(row[1])
+    if not a or not b or a == b or len(a) > WORD_MAX_CHARS or len(b) > WORD_MAX_CHARS:
+        return None
+    return a, b
+
+class PairImport:
+    """逐塊餵入上傳內容；未以換行結尾的最後一段留到下一塊再解析。"""
+
+    def __init__(self, fmt: str):
+        self.fmt = fmt
+        self.decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+        self.tail = ""
+        self.seen = set()
+        self.pairs = []
+        self.stats = {"bytes": 0, "lines": 0, "accepted": 0, "duplicates": 0,
+                      "builtin": 0, "invalid": 0, "done": False}
+
+    def feed(self, chunk: bytes, final: bool = False):
+        self.stats["bytes"] += len(chunk)
+        if self.stats["bytes"] > UPLOAD_MAX_BYTES:
+            raise UploadError(413, f"upload exceeds {UPLOAD_MAX_BYTES} bytes")
+        lines = (self.tail + self.decoder.decode(chunk, final)).split("\n")
+        self.tail = "" if final else lines.pop()
+        if len(self.tail) > UPLOAD_LINE_MAX:
+            raise UploadError(413, f"line exceeds {UPLOAD_LINE_MAX} chars")
+        for line in lines:
+            self._line(line.strip())
+
+    def _line(self, line: str):
+        if not line or line.startswith("#"):
+            return
+        st = self.stats
+        st["lines"] += 1
+        pair = parse_pair_line(line, self.fmt) if len(line) <= UPLOAD_LINE_MAX else None
+        if not pair:
+            st["invalid"] += 1
+            return
+        key = pair_key(*pair)
+        if key in BUILTIN_KEYS:
+            st["builtin"] += 1
+        elif key in self.seen:
+            st["duplicates"] += 1
+        elif len(self.pairs) >= UPLOAD_MAX_PAIRS:
+            raise UploadError(413, f"more than {UPLOAD_MAX_PAIRS} pairs")
+        else:
+            self.seen.add(key)
+            self.pairs.append(pair)
+            st["accepted"] += 1
+
+def pool_path(pool_id: str) -> str:
+    return os.path.join(POOL_DIR, f"{pool_id}.json")
+
+def save_pool(pairs: list, name: str) -> tuple:
+    """排序、雜湊並落地（在執行緒中跑，不卡 event loop）；回傳 (pool_id, pairs)。"""
+    pairs = tuple(sorted(pairs))
+    pool_id = pool_digest(pairs)
+    path = pool_path(pool_id)
+    if not os.path.exists(path):
+        os.makedirs(POOL_DIR, exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"name": name, "pairs": pairs}, f, ensure_ascii=False)
+        os.replace(tmp, path)
+    return pool_id, pairs
+
+def get_pool(pool_id: str):
+    """查共用題庫；本 worker 沒有時從 POOL_DIR 載入一次。"""
+    wp = word_pools.get(pool_id)
+    if wp or not POOL_ID_RE.fullmatch(pool_id):
+        return wp
+    try:
+        with open(pool_path(pool_id), encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return register_pool(data["pairs"], pool_id, data.get("name"))
+
+def drop_upload(token: str, stats: dict, timer: "Timer"):
+    # 同一個 token 之後又有新的上傳：進度已換成新的，不能清掉
+    if uploads.get(token) is stats:
+        del uploads[token]
+
+@app.post("/pools")
+async def upload_pool(request: Request):
+    q = request.query_params
+    fmt = q.get("fmt") or ("jsonl" if "json" in request.headers.get("content-type", "") else "csv")
+    if fmt not in ("csv", "jsonl"):
+        return JSONResponse({"error": "fmt must be csv or jsonl"}, status_code=400)
+    try:
+        length = int(request.headers.get("content-length") or 0)
+    except ValueError:
+        return JSONResponse({"error": "bad content-length"}, status_code=400)
+    if length > UPLOAD_MAX_BYTES:
+        return JSONResponse({"error": f"upload exceeds {UPLOAD_MAX_BYTES} bytes"}, status_code=413)
+    name = normalize_word(q.get("name"))[:64] or "custom"
+    # token 由前端產生（上傳進行中就要能查進度）；進行中的 token 不可重用，免得蓋掉別人的進度
+    token = q.get("upload") or uuid.uuid4().hex
+    if token in uploads and not uploads[token]["done"]:
+        return JSONResponse({"error": "upload token in use"}, status_code=409)
+    imp = PairImport(fmt)
+    uploads[token] = imp.stats
+    try:
+        async for chunk in request.stream():
+            imp.feed(chunk)
+        imp.feed(b"", final=True)
+        if not imp.pairs:
+            raise UploadError(422, "no usable pairs")
+        pool_id, pairs = await asyncio.to_thread(save_pool, imp.pairs, name)
+    except UploadError as e:
+        imp.stats["done"] = True
+        return JSONResponse({"error": e.error, **imp.stats}, status_code=e.status)
+    finally:
+        imp.stats["done"] = True
+        scheduler.call_later(60, drop_upload, token, imp.stats)
+    wp = register_pool(pairs, pool_id, name)
+    return JSONResponse({"id": wp.id, "name": wp.name, "size": len(wp.pairs), **imp.stats})
+
+@app.get("/pools/progress/{token}")
+async def upload_progress(token: str):
+    stats = uploads.get(token)
+    if stats is None:
+        return JSONResponse({"error": "unknown upload"}, status_code=404)
+    return JSONResponse(stats)
+
+@app.get("/pools/{pool_id}")
+async def pool_info(pool_id: str):
+    wp = get_pool(pool_id)
+    if not wp:
+        return JSONResponse({"error": "unknown pool"}, status_code=404)
+    return JSONResponse({"id": wp.id, "name": wp.name, "size": len(wp.pairs)})
+
+# ===== 入站限流 =====
+# 每條連線在解析前先檢查 frame 大小與整體 frame 速率，解析後再依訊息種類各扣一個 token bucket。
+# 超量的訊息靜默丟棄（不回 hint，避免被刷的時候反而放大輸出）；每丟一則扣一次「違規額度」，
+# 額度也按時間回補，持續超量把額度扣光才斷線（1008）。過大的 frame 直接斷線（1009）：
+# uvicorn 那層以 ws_max_size 擋（見 __main__ 與 uc_worker.py），不先把整個 frame 收進來；這裡的檢查是後備。
+# RATE_LIMITS 格式：type=每秒:突發,...；"*" 為未列出的種類，"frame" 為解析前的整體 frame 數。
+MAX_FRAME_BYTES = int(os.environ.get("MAX_FRAME_BYTES", "32768"))
+RATE_LIMITS_DEFAULT = ("frame=30:60,*=10:20,say=2:5,vote=2:5,create_room_setup=1:3,join_room=1:3,"
+                       "watch_room=1:3,resume=1:3,roster_sync=1:3,kick=2:5,start_game=1:3,"
+                       "open_vote=1:3,next_round=1:3,reset_game=1:3")
+RATE_STRIKES = os.environ.get("RATE_STRIKES", "1:30")   # 違規額度：每秒回補:上限
+
+def parse_rate(spec: str) -> tuple:
+    rate, _, burst = spec.partition(":")
+    return (float(rate), float(burst or rate))
+
+def parse_rate_limits(spec: str) -> dict:
+    limits = {}
+    for item in spec.split(","):
+        key, _, val = item.strip().partition("=")
+        if key and val:
+            limits[key] = parse_rate(val)
+    return limits
+
+RATE_LIMITS = parse_rate_limits(RATE_LIMITS_DEFAULT)
+RATE_LIMITS.update(parse_rate_limits(os.environ.get("RATE_LIMITS", "")))
+STRIKE_LIMIT = parse_rate(RATE_STRIKES)
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "stamp")
+
+    def __init__(self, rate: float, burst: float, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = now
+
+    def take(self, now: float) -> bool:
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+class InboundViolation(Exception):
+    def __init__(self, code: int, reason: str):
+        super().__init__(reason)
+        self.code = code
+        self.reason = reason
+
+class InboundLimiter:
+    """單一連線的入站額度；bucket 依訊息種類用到才建立。"""
+    __slots__ = ("buckets", "strikes", "dropped")
+
+    def __init__(self):
+        now = time.monotonic()
+        self.buckets = {}
+        self.strikes = TokenBucket(*STRIKE_LIMIT, now)
+        self.dropped = 0
+
+    def allow(self, kind: str, now: float) -> bool:
+        b = self.buckets.get(kind)
+        if b is None:
+            rate, burst = RATE_LIMITS.get(kind) or RATE_LIMITS["*"]
+            b = self.buckets[kind] = TokenBucket(rate, burst, now)
+        return b.take(now)
+
+    def strike(self, reason: str, now: float):
+        """記一次丟棄；違規額度用完時丟 InboundViolation，由 ws_endpoint 斷線。"""
+        self.dropped += 1
+        INBOUND_DROPS.inc(1, reason)
+        if not self.strikes.take(now):
+            raise InboundViolation(1008, "flood")
+
 # ===== WebSocket =====
+# 連線 handler 只負責解析與投遞：訊息丟進所在房間的 inbox，由該房的 actor 依序套用。
 @app.websocket("/ws")
 async def ws_endpoint(ws: WebSocket):
     await ws.accept()
-    cid = str(uuid.uuid4())
-    print(f"[ws] connected: {cid}")
+    conn = str(uuid.uuid4())
+    fmt = negotiate_fmt(ws)
+    codec = CODECS[fmt[0]]
+    out = Outbox(ws, conn, batch=OUTBOX_BATCH and ws.query_params.get("batch") == "1", fmt=fmt)
+    limiter = InboundLimiter()
+    room_id = None      # 本連線目前投遞的房間
+    backend.attach(conn, out)
+    connections[conn] = out
+    print(f"[ws] connected: {conn}")
     try:
         while True:
-            raw = await ws.receive_text()
-            msg = json.loads(raw)
-            t = msg.get("type")
-
-            # 建房（Host）
-            if t == "create_room_setup":
-                room = msg["room"].strip()
-                name = (msg.get("name") or "Host").strip()
-                use_builtin = bool(msg.get("use_builtin", True))
-                custom_list = [tuple(x) for x in (msg.get("custom_list") or []) if isinstance(x, list) and len(x)==2]
-                limit_20s = bool(msg.get("limit_20s", False))
-
-                pool = []
-                if use_builtin:
-                    pool.extend(WORD_PAIRS)
-                pool.extend(custom_list)
-                if not pool:
-                    pool = list(WORD_PAIRS)
-
-                rooms[room] = {
-                    "host": cid,
-                    "clients": { cid: {"ws": ws, "name": name, "alive": True, "role": "civilian"} },
-                    "status": "waiting",
-                    "round": 0,
-                    "word_pool": pool,
-                    "pair": None,
-                    "last_pair": None,
-                    "undercover_ids": set(),
-                    "votes": {},
-                    "session": 0,
-                    "speak_order": [],
-                    "speak_index": 0,
-                    "spoken_this_turn": set(),
-                    "limit_20s": limit_20s,
-                    "speak_token": None,
-                    "timer_task": None,
-                }
-                await ws.send_text(json.dumps({"type":"room_created","room":room}))
-                await syslog(room, "房間已建立。")
-                await broadcast_room_list(room)
+            frame = await ws.receive()
+            if frame["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(frame.get("code", 1000))
+            now = out.last_seen = time.monotonic()
+            raw = frame.get("text")
+            data = raw if raw is not None else frame.get("bytes") or b""
+            # 解析前：大小與整體速率（文字以字元數估，不另外編碼一次）
+            if len(data) > MAX_FRAME_BYTES:
+                raise InboundViolation(1009, "too_large")
+            if not limiter.allow("frame", now):
+                limiter.strike("frame_rate", now)
                 continue
-
-            # 入房（Player）
-            if t == "join_room":
-                room = msg["room"].strip()
-                name = (msg.get("name") or "玩家").strip()
-                if room not in rooms:
-                    await ws.send_text(json.dumps({"type":"error","msg":"房間不存在"}))
-                    continue
-                rooms[room]["clients"][cid] = {"ws": ws, "name": name, "alive": True, "role": "civilian"}
-                await syslog(room, f"{name} 加入房間。")
-                await broadcast_room_list(room)
+            try:
+                if raw is not None:
+                    msg = CODECS[DEFAULT_CODEC].decode(raw)
+                else:
+                    msg = (codec if codec.binary else CODECS[DEFAULT_CODEC]).decode(data)
+            except Exception:
+                msg = None
+            # 型別與欄位在這裡就驗掉，不合格的不會進房間 inbox（也不會為未知 type 建 bucket）
+            bad = validate_message(msg)
+            if bad:
+                limiter.strike(bad, now)
                 continue
-
-            # Host 踢人
-            if t == "kick":
-                room = find_room(cid)
-                if not room: continue
-                if rooms[room]["host"] != cid:
-                    continue
-                target = msg.get("target")
-                if not target or target not in rooms[room]["clients"]:
-                    continue
-                try:
-                    await rooms[room]["clients"][target]["ws"].send_text(json.dumps({"type":"kicked"}))
-                    await rooms[room]["clients"][target]["ws"].close()
-                except:
-                    pass
-                rooms[room]["clients"].pop(target, None)
-                await syslog(room, "已將一名玩家移出房間。")
-                await broadcast_room_list(room)
-                # 若踢掉當前發言者，補播提示 & 重置20秒
-                if rooms[room]["status"] == "playing" and rooms[room]["speak_order"]:
-                    order = rooms[room]["speak_order"]
-                    if target in order:
-                        order = [x for x in order if rooms[room]["clients"].get(x,{}).get("alive")]
-                        rooms[room]["speak_order"] = order
-                        if order:
-                            if rooms[room]["speak_index"] >= len(order):
-                                rooms[room]["speak_index"] %= len(order)
-                            cur = order[rooms[room]["speak_index"]]
-                            cur_name = rooms[room]["clients"][cur]["name"]
-                            await syslog(room, f"現在輪到 <b>{cur_name}</b> 發言。", session=rooms[room]["session"])
-                            await restart_speaker_timer(room)
+            t = msg["type"]
+            if t == "pong":
                 continue
-
-            # 開始遊戲（Host）
-            if t == "start_game":
-                room = find_room(cid)
-                if not room: continue
-                if rooms[room]["host"] != cid: continue
-
-                players = list(rooms[room]["clients"].keys())
-                if len(players) < 3:
-                    await syslog(room, "至少需要 3 名玩家才能開始。")
-                    continue
-
-                # reset
-                for pcid in rooms[room]["clients"]:
-                    rooms[room]["clients"][pcid]["alive"] = True
-                    rooms[room]["clients"][pcid]["role"] = "civilian"
-                await cancel_timer(room)
-                rooms[room]["votes"] = {}
-                rooms[room]["status"] = "playing"
-                rooms[room]["round"] = 1
-                rooms[room]["spoken_this_turn"] = set()
-
-                # 新局（分色分區）
-                rooms[room]["session"] += 1
-                await broadcast(room, {"type":"chat_session","session": rooms[room]["session"]})
-                await broadcast(room, {"type":"sys_session","session": rooms[room]["session"]})
-
-                # 抽題（避免連續重複）
-                pool = list(rooms[room]["word_pool"])
-                last = rooms[room]["last_pair"]
-                if last and len(pool) > 1:
-                    pool = [p for p in pool if p != last] or list(rooms[room]["word_pool"])
-                pair = random.choice(pool)
-                rooms[room]["pair"] = pair
-                rooms[room]["last_pair"] = pair
-
-                # 起始臥底數：floor(n/2) - 1（>=1 且 < n）
-                n = len(players)
-                uc_target = max(1, min(math.floor(n/2) - 1, n-1))
-
-                # 指派臥底 & 派字
-                rooms[room]["undercover_ids"] = set(random.sample(players, uc_target))
-                for pcid in players:
-                    role = "undercover" if pcid in rooms[room]["undercover_ids"] else "civilian"
-                    rooms[room]["clients"][pcid]["role"] = role
-                    word = pair[1] if role == "undercover" else pair[0]
-                    await rooms[room]["clients"][pcid]["ws"].send_text(json.dumps({
-                        "type":"you_are","word":word,"alive":True,"role":role
-                    }))
-
-                # 公佈本局臥底人數（依你新需求）
-                await syslog(room, f"本局臥底人數：<b>{uc_target}</b> 人。", session=rooms[room]["session"])
-
-                # 本回合發言順序（每人一次；都講完自動投票）
-                await start_new_turn(room)
-                await syslog(room, "遊戲開始！第 1 回合，請依序描述。", session=rooms[room]["session"])
-                await broadcast_room_list(room)
+            if not limiter.allow(t, now):
+                limiter.strike("rate_limited", now)
                 continue
-
-            # 開啟投票（Host 或系統自動）
-            if t == "open_vote":
-                room = find_room(cid)
-                if not room: continue
-                if rooms[room]["status"] != "playing":
-                    continue
-                await open_vote(room)
+            # 以哪個玩家身分投遞看 out.cid：resume 要等房間 actor 驗過 token 才會 bind 過去，
+            # 未確認前一律還是本連線自己的 id，不能拿公開的 cid 冒充別人到其他房間
+            if t in ("create_room_setup", "join_room", "resume", "watch_room"):
+                rid = msg["room"].strip()
+                if rid != room_id or t == "create_room_setup":
+                    backend.leave(room_id, out.cid, out)
+                room_id = rid
+            elif room_id is None:
                 continue
+            backend.submit(room_id, out.cid, msg, out)
 
-            # 投票（玩家）
-            if t == "vote":
-                room = find_room(cid)
-                if not room: continue
-                if rooms[room]["status"] != "voting": continue
-                if not rooms[room]["clients"][cid]["alive"]:
-                    await hint(room, cid, "已被淘汰，不能投票")
-                    continue
-                target = msg.get("target")
-                if target not in rooms[room]["clients"] or not rooms[room]["clients"][target]["alive"]:
-                    await hint(room, cid, "投票目標無效")
-                    continue
-                rooms[room]["votes"][cid] = target
-                await rooms[room]["clients"][cid]["ws"].send_text(json.dumps({"type":"vote_ack"}))
-
-                # 全部存活者都投了 -> 結算
-                alive_voters = [x for x,info in rooms[room]["clients"].items() if info["alive"]]
-                if all(v in rooms[room]["votes"] for v in alive_voters):
-                    # 投票明細
-                    vote_pairs = []
-                    for voter in alive_voters:
-                        v_name = rooms[room]["clients"][voter]["name"]
-                        t_cid = rooms[room]["votes"].get(voter)
-                        t_name = rooms[room]["clients"][t_cid]["name"] if t_cid else "(未投)"
-                        vote_pairs.append({"from": v_name, "to": t_name})
-                    await broadcast(room, {"type":"vote_result","pairs": vote_pairs})
-
-                    # 計票
-                    tally = {}
-                    for v in rooms[room]["votes"].values():
-                        tally[v] = tally.get(v, 0) + 1
-                    max_votes = max(tally.values()) if tally else 0
-                    top = [cid_ for cid_,cnt in tally.items() if cnt == max_votes]
-
-                    if len(top) != 1:
-                        # 平票：無人出局，留在同一回合，重新輪流發言一次
-                        await syslog(room, "平票！本回合無人出局，重新輪流發言。", session=rooms[room]["session"])
-                        rooms[room]["status"] = "playing"
-                        rooms[room]["votes"] = {}
-                        rooms[room]["spoken_this_turn"] = set()
-                        await start_new_turn(room)
-                        await broadcast_room_list(room)
-                    else:
-                        # 淘汰最高票
-                        eliminated = top[0]
-                        rooms[room]["clients"][eliminated]["alive"] = False
-                        name = rooms[room]["clients"][eliminated]["name"]
-                        await syslog(room, f"本輪淘汰：{name}", session=rooms[room]["session"])
-                        await broadcast(room, {"type":"round_result","eliminated":name})
-                        await rooms[room]["clients"][eliminated]["ws"].send_text(json.dumps({"type":"you_died"}))
-
-                        # 勝負判定
-                        alive_ids = [x for x,info in rooms[room]["clients"].items() if info["alive"]]
-                        uc_alive = [x for x in alive_ids if x in rooms[room]["undercover_ids"]]
-                        civ_alive = [x for x in alive_ids if x not in rooms[room]["undercover_ids"]]
-                        if len(uc_alive) == 0:
-                            rooms[room]["status"] = "ended"
-                            await cancel_timer(room)
-                            await syslog(room,
-                                f"遊戲結束：平民勝利！本局詞語：平民「{rooms[room]['pair'][0]}」 / 臥底「{rooms[room]['pair'][1]}」。",
-                                session=rooms[room]["session"])
-                            # NEW: 結束彈窗揭露全部身份與詞
-                            await reveal_all(room)
-                            await broadcast(room, {"type":"gameover","winner":"平民"})
-                        elif len(uc_alive) >= len(civ_alive):
-                            rooms[room]["status"] = "ended"
-                            await cancel_timer(room)
-                            await syslog(room,
-                                f"遊戲結束：臥底勝利！本局詞語：平民「{rooms[room]['pair'][0]}」 / 臥底「{rooms[room]['pair'][1]}」。",
-                                session=rooms[room]["session"])
-                            # NEW: 結束彈窗揭露全部身份與詞
-                            await reveal_all(room)
-                            await broadcast(room, {"type":"gameover","winner":"臥底"})
-                        else:
-                            # 下一回合
-                            rooms[room]["status"] = "playing"
-                            rooms[room]["round"] += 1
-                            rooms[room]["votes"] = {}
-                            rooms[room]["spoken_this_turn"] = set()
-                            await start_new_turn(room)
-                            await syslog(room, f"進入第 {rooms[room]['round']} 回合，請依序描述。", session=rooms[room]["session"])
-                            await broadcast_room_list(room)
+    except WebSocketDisconnect:
+        print(f"[ws] disconnected: {out.cid}")
+    except InboundViolation as e:
+        print(f"[ws] closing {out.cid}: {e.reason} ({limiter.dropped} dropped)")
+        INBOUND_DISCONNECTS.inc(1, e.reason)
+        out.stop()
+        try:
+            await ws.close(code=e.code)
+        except Exception:
+            pass
+    finally:
+        # 也涵蓋 writer 主動斷線（佇列爆滿 / 被踢）後 receive 失敗的情況
+        out.stop()
+        backend.leave(room_id, out.cid, out, lost=True)
+        backend.detach(conn)
+        connections.pop(conn, None)
+
+# ===== 房間 actor =====
+def open_room(room_id: str) -> Room:
+    if room_id in rooms:
+        drop_room(room_id)
+    r = rooms[room_id] = Room(room_id, None)
+    r.actor = asyncio.create_task(room_actor(r))
+    return r
+
+def dispatch_local(room_id: str, cid: str, msg: dict, out):
+    # 本 worker 擁有的房間：建房開新 actor，其餘投遞到既有房間
+    t = msg.get("type")
+    if t == "create_room_setup":
+        if draining:
+            send_to(out, {"type":"error","msg":"伺服器更新中，請稍後再建房"})
+            return
+        r = open_room(room_id)
+    else:
+        r = rooms.get(room_id)
+        if not r:
+            if t in ("join_room", "watch_room"):
+                send_to(out, {"type":"error","msg":"房間不存在"})
+            elif t == "resume":
+                send_to(out, {"type":"resume_failed"})
+            return
+    r.inbox.put_nowait(("msg", cid, msg, out))
+
+def leave_local(room_id: str | None, cid: str, out, lost: bool = False):
+    # lost=True：連線中斷（保留座位等重連）；False：主動換房
+    r = rooms.get(room_id) if room_id is not None else None
+    if r:
+        r.inbox.put_nowait(("lost" if lost else "leave", cid, None, out))
+
+async def room_actor(r: Room):
+    while rooms.get(r.id) is r:
+        kind, cid, data, out = await r.inbox.get()
+        t0 = time.perf_counter()
+        r.last_active = time.monotonic()
+        try:
+            if kind == "msg":
+                apply_message(r, cid, data, out)
+            elif kind == "leave":
+                p = r.clients.get(cid)
+                if p and p.out is out:
+                    remove_client(r, cid)
+                elif r.audience:
+                    r.audience.remove(cid, out)
+            elif kind == "lost":
+                if not (r.audience and r.audience.remove(cid, out)):
+                    on_lost(r, cid, out)
+            elif kind == "expire":
+                on_expire(r, cid, data)
+            elif kind == "timeout":
+                on_timeout(r, data)
+        except Exception:
+            traceback.print_exc()
+        dt = time.perf_counter() - t0
+        t = data.get("type") if kind == "msg" else kind
+        if t not in HANDLERS and t not in ACTOR_KINDS:
+            t = "other"
+        for hook in handler_hooks:
+            hook(t, dt)
+        if dt > r.cmd_max:
+            r.cmd_max = dt
+        # 人走光且沒有待處理指令才拆房，避免吃掉排隊中的入房
+        if not r.clients and r.inbox.empty() and rooms.get(r.id) is r:
+            drop_room(r.id)
+
+# ===== 訊息分派 =====
+# 每種訊息註冊一個 handler 與欄位規格；規格在 import 時編成驗證函式，
+# 連線端（ws_endpoint）投遞前先驗，房間 actor 只做一次 dict 查表就呼叫 handler。
+# 欄位規格：f_str / f_num / f_bool / f_list 回傳 (check, required)；未列出的欄位一律忽略。
+def f_str(max_len: int, required: bool = False, min_len: int = 0) -> tuple:
+    return (lambda v: type(v) is str and min_len <= len(v) <= max_len, required)
+
+def f_num(lo: float, hi: float, required: bool = False) -> tuple:
+    # bool 是 int 的子類別，要排除；前端數字可能是 20.0
+    return (lambda v: type(v) in (int, float) and lo <= v <= hi, required)
+
+def f_bool(required: bool = False) -> tuple:
+    return (lambda v: type(v) is bool, required)
+
+def f_list(max_items: int, item=None, required: bool = False) -> tuple:
+    if item is None:
+        return (lambda v: type(v) is list and len(v) <= max_items, required)
+    check = item[0]
+    return (lambda v: type(v) is list and len(v) <= max_items and all(check(x) for x in v), required)
+
+def compile_validator(fields: dict):
+    """回傳 validate(msg)：通過回傳 None，否則回傳第一個不合格的欄位名。"""
+    items = tuple((name, check, required) for name, (check, required) in fields.items())
+    def validate(msg: dict):
+        for name, check, required in items:
+            v = msg.get(name)
+            if v is None:
+                if required:
+                    return name
+            elif not check(v):
+                return name
+        return None
+    return validate
+
+class Handler:
+    __slots__ = ("type", "fn", "validate", "seated", "host")
+
+    def __init__(self, t: str, fn, validate, seated: bool, host: bool):
+        self.type = t
+        self.fn = fn
+        self.validate = validate
+        self.seated = seated    # 需要是房內玩家（收到的 me 不為 None）
+        self.host = host        # 只有 Host 能下
+
+# HANDLERS[type] = Handler
+HANDLERS = {}
+# 連線端處理、不進房間的訊息，仍要通過驗證
+EDGE_VALIDATORS = {"pong": compile_validator({})}
+
+def on(t: str, seated: bool = True, host: bool = False, **fields):
+    def register(fn):
+        HANDLERS[t] = Handler(t, fn, compile_validator(fields), seated, host)
+        return fn
+    return register
+
+def validate_message(msg) -> str | None:
+    """連線端檢查：回傳丟棄原因（None 表示可投遞）。"""
+    if type(msg) is not dict or type(msg.get("type")) is not str:
+        return "malformed"
+    t = msg["type"]
+    h = HANDLERS.get(t)
+    validate = h.validate if h else EDGE_VALIDATORS.get(t)
+    if validate is None:
+        return "unknown_type"
+    return "invalid" if validate(msg) else None
+
+# 每則指令處理完呼叫 hook(type, seconds)；預設只記到 HANDLER_SECONDS
+handler_hooks = [lambda t, dt: HANDLER_SECONDS.observe(dt, t)]
+
+def apply_message(r: Room, cid: str, msg: dict, out: Outbox):
+    h = HANDLERS.get(msg.get("type"))
+    if not h:
+        return
+    # 座位已由別條連線接手（重連後的舊連線、未通過驗證的 resume）：指令一律忽略
+    me = r.clients.get(cid)
+    if me and me.out is not out and h.type != "resume":
+        return
+    if h.seated and not me:
+        return
+    if h.host and r.host != cid:
+        return
+    h.fn(r, cid, msg, out, me)
+
+ROOM_ID = f_str(64, required=True)
+NAME = f_str(40)
+
+# 斷線重連：驗證 token 後把座位接到新連線，補送漏掉的事件
+@on("resume", seated=False, room=ROOM_ID, token=f_str(128, required=True), seq=f_num(0, 2**53))
+def on_resume(r: Room, cid: str, msg: dict, out, me):
+    # token = "<cid>.<secret>"；連線在驗證通過前仍以自己的 id 投遞，座位從 token 找
+    me = r.clients.get(msg["token"].partition(".")[0])
+    if not me or not msg["token"].isascii() or not hmac.compare_digest(me.token, msg["token"]):
+        send_to(out, {"type":"resume_failed"})
+        out.close()
+        return
+    resume_player(r, me, out, msg.get("seq"))
+
+# 建房（Host）
+@on("create_room_setup", seated=False, room=ROOM_ID, name=NAME, use_builtin=f_bool(),
+    custom_list=f_list(10000), pool_ids=f_list(8, f_str(64)),
+    speak_seconds=f_num(0, 86400), vote_seconds=f_num(0, 86400), limit_20s=f_bool(), early_settle=f_bool())
+def on_create_room(r: Room, cid: str, msg: dict, out, me):
+    name = (msg.get("name") or "Host").strip()
+    use_builtin = msg.get("use_builtin", True)
+    # 內嵌的 custom_list 只收少量；大量題目請先 POST /pools 上傳，再以 pool_ids 引用
+    custom_list = [(str(x[0]), str(x[1])) for x in (msg.get("custom_list") or [])[:CUSTOM_INLINE_MAX]
+                   if isinstance(x, list) and len(x)==2]
+    pools = [BUILTIN_POOL] if use_builtin else []
+    for pool_id in msg.get("pool_ids") or []:
+        wp = get_pool(pool_id)
+        if not wp:
+            send_to(out, {"type":"error","msg":"找不到上傳的題庫，請重新上傳"})
+            return
+        pools.append(wp)
+
+    deck = Deck(pools, custom_list)
+    if not deck.size:
+        deck = Deck([BUILTIN_POOL])
+
+    r.host = cid
+    r.deck = deck
+    # limit_20s 為舊版前端的欄位
+    r.speak_seconds = clamp_seconds(msg.get("speak_seconds", 20 if msg.get("limit_20s") else 0))
+    r.vote_seconds = clamp_seconds(msg.get("vote_seconds", 0))
+    r.game.early = bool(msg.get("early_settle"))   # 未投的票已改變不了結果就提前結算（已投的票視為凍結）
+    r.setup = {"host": cid, "speak_seconds": r.speak_seconds, "vote_seconds": r.vote_seconds,
+               "early": r.game.early, "use_builtin": bool(use_builtin),
+               "pools": [wp.id for wp in pools if wp is not BUILTIN_POOL], "custom": custom_list}
+    jot(r, "create", r.setup)
+    p = add_client(r, cid, name, out)
+    send_to(out, {"type":"room_created","room":r.id})
+    send_to(out, {"type":"resume_token","token":p.token})
+    syslog(r, "房間已建立。")
+    send_roster(r, p.out)
+
+# 入房（Player）
+@on("join_room", seated=False, room=ROOM_ID, name=NAME)
+def on_join_room(r: Room, cid: str, msg: dict, out, me):
+    name = (msg.get("name") or "玩家").strip()
+    p = add_client(r, cid, name, out)
+    send_to(out, {"type":"resume_token","token":p.token})
+    syslog(r, f"{name} 加入房間。")
+    roster_delta(r, "player_joined", skip=cid, player=roster_entry(r, p))
+    send_roster(r, p.out)
+
+# 觀戰：不入座，不出現在名單、發言順序與投票裡
+@on("watch_room", seated=False, room=ROOM_ID)
+def on_watch_room(r: Room, cid: str, msg: dict, out, me):
+    if me:
+        send_to(out, {"type":"error","msg":"你已在房內"})
+        return
+    watch(r, cid, out)
+
+# 名單版本有缺口，補一份完整快照（觀眾也可以要）
+@on("roster_sync", seated=False)
+def on_roster_sync(r: Room, cid: str, msg: dict, out, me):
+    if me or (r.audience and r.audience.viewers.get(cid) is out):
+        send_roster(r, out)
+
+# Host 踢人
+@on("kick", host=True, target=f_str(64, required=True))
+def on_kick(r: Room, cid: str, msg: dict, out, me):
+    target = r.clients.get(msg["target"])
+    if not target:
+        return
+    send_to(target.out, {"type":"kicked"})
+    target.out.close()
+    remove_client(r, target.cid)
+    syslog(r, "已將一名玩家移出房間。")
+
+# 開始遊戲（Host）
+@on("start_game", host=True)
+def on_start_game(r: Room, cid: str, msg: dict, out, me):
+    # 抽題（洗牌袋：整袋抽完前不重複，換袋時也避開上一題）
+    play(r, lambda: r.game.start(lambda: r.deck.draw(avoid=r.last_pair)))
+    if r.game.pair:
+        r.last_pair = r.game.pair
+
+# 開啟投票（Host 或系統自動）
+@on("open_vote")
+def on_open_vote(r: Room, cid: str, msg: dict, out, me):
+    play(r, r.game.open_vote)
+
+# 投票（玩家）
+@on("vote", target=f_str(64, required=True))
+def on_vote(r: Room, cid: str, msg: dict, out, me):
+    target = r.clients.get(msg["target"])
+    play(r, lambda: r.game.vote(me.slot, target.slot if target else None), cid)
+
+# 強制下一回合（Host）
+@on("next_round", host=True)
+def on_next_round(r: Room, cid: str, msg: dict, out, me):
+    play(r, r.game.next_round)
+
+# 重置（Host）
+@on("reset_game", host=True)
+def on_reset_game(r: Room, cid: str, msg: dict, out, me):
+    play(r, r.game.reset)
+
+# 發言：空白內容不算發言，但仍會推進到下一位
+@on("say", text=f_str(500))
+def on_say(r: Room, cid: str, msg: dict, out, me):
+    text = (msg.get("text") or "").strip()
+    play(r, lambda: r.game.say(me.slot, spoke=bool(text)), cid, text)
+
+# ===== 房間後端 =====
+# MemoryBackend ：單一 process，所有房間都在本機 rooms。
+# ShardedBackend：多個 gunicorn worker。房間依 crc32(room_id) % N 歸屬某個 worker，
+#   連線所在 worker 把非本機房間的指令經 Unix socket 轉給擁有者；
+#   擁有者用 RemoteOutbox 代表遠端玩家，輸出訊息再沿同一條 socket 送回。
+# worker 數取自 WEB_CONCURRENCY（與 gunicorn --workers 相同），大於 1 時自動啟用分片。
+WORKERS = int(os.environ.get("WEB_CONCURRENCY", "1"))
+IPC_DIR = os.environ.get("UC_IPC_DIR", "/tmp/undercover-ipc")
+IPC_LINE_LIMIT = 4 * 1024 * 1024    # 單筆轉送訊息上限（自訂題庫可能很大）
+
+# worker 編號：flock 隨 process 結束自動釋放，重啟或換版的 worker 會接手空出的編號（連同它的日誌與交接）
+# 開始 drain 的 process 會留下 draining-<編號> 標記，接手者搶到編號後清掉。
+CLAIM_WAIT = float(os.environ.get("UC_CLAIM_WAIT", "60"))
+
+def drain_marker(ipc_dir: str, index: int) -> str:
+    return os.path.join(ipc_dir, f"draining-{index}")
+
+async def claim_index(ipc_dir: str, workers: int, deploy_only: bool = False) -> tuple:
+    """回傳 (編號, lock fd)；全被占用時每 0.1 秒重試，換版時等舊 worker 交接完放出編號。
+    deploy_only：只有占用者正在 drain 才等，否則立刻失敗（另一個 instance 用了同一組目錄）。"""
+    os.makedirs(ipc_dir, exist_ok=True)
+    for _ in range(int(CLAIM_WAIT * 10)):
+        for i in range(workers):
+            fd = os.open(os.path.join(ipc_dir, f"worker-{i}.lock"), os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                os.close(fd)
                 continue
+            try:
+                os.unlink(drain_marker(ipc_dir, i))
+            except FileNotFoundError:
+                pass
+            return i, fd
+        if deploy_only and not any(os.path.exists(drain_marker(ipc_dir, i)) for i in range(workers)):
+            raise RuntimeError(f"worker slot in {ipc_dir} is held by another running instance; "
+                               "give each instance its own UC_IPC_DIR / UC_JOURNAL_DIR / UC_HISTORY_DIR")
+        await asyncio.sleep(0.1)
+    raise RuntimeError(f"no free worker slot in {ipc_dir} (WEB_CONCURRENCY={workers})")
+
+class MemoryBackend:
+    def __init__(self):
+        self.index = None
+        self.lock_fd = None
+
+    async def claim(self):
+        # 單一 process 沒有 gunicorn 先起新 worker 的情形：編號被占用又不是換版，多等也等不到
+        self.index, self.lock_fd = await claim_index(IPC_DIR, 1, deploy_only=True)
+
+    async def start(self): pass
+
+    async def stop(self):
+        if self.lock_fd is not None:
+            os.close(self.lock_fd)
+            self.lock_fd = None
+
+    def attach(self, conn: str, out: Outbox): pass
+    def detach(self, conn: str): pass
+
+    def submit(self, room_id: str, cid: str, msg: dict, out: Outbox):
+        dispatch_local(room_id, cid, msg, out)
+
+    def leave(self, room_id: str | None, cid: str, out: Outbox, lost: bool = False):
+        leave_local(room_id, cid, out, lost)
+
+def ipc_line(obj: dict) -> bytes:
+    return (json.dumps(obj, ensure_ascii=False) + "\n").encode()
+
+class RemoteOutbox:
+    """擁有者端代表遠端連線：介面同 Outbox，實際排隊/丟棄由連線所在 worker 的 Outbox 負責。"""
+    __slots__ = ("writer", "conn", "cid", "fmt")
+
+    def __init__(self, writer: asyncio.StreamWriter, conn: str, cid: str, fmt: tuple):
+        self.writer = writer
+        self.conn = conn
+        self.cid = cid      # 這條連線目前代表的玩家（resume 後會換）
+        self.fmt = fmt      # 遠端連線協商的格式；在擁有者端編碼一次後原樣轉回
+
+    def push(self, data, low: bool = False) -> bool:
+        if self.writer.is_closing():
+            return False
+        if isinstance(data, bytes):
+            obj = {"op":"out","conn":self.conn,"b64":base64.b64encode(data).decode(),"low":low}
+        else:
+            obj = {"op":"out","conn":self.conn,"data":data,"low":low}
+        self.writer.write(ipc_line(obj))
+        return True
+
+    def bind(self, cid: str):
+        self.cid = cid
+        if not self.writer.is_closing():
+            self.writer.write(ipc_line({"op":"bind","conn":self.conn,"cid":cid}))
+
+    def close(self, drain: bool = True, code: int = 1000):
+        if not self.writer.is_closing():
+            self.writer.write(ipc_line({"op":"close","conn":self.conn,"drain":drain,"code":code}))
+
+    def stop(self):
+        pass
 
-            # 強制下一回合（Host）
-            if t == "next_round":
-                room = find_room(cid)
-                if not room: continue
-                if rooms[room]["host"] != cid: continue
-                rooms[room]["status"] = "playing"
-                rooms[room]["votes"] = {}
-                rooms[room]["round"] += 1
-                rooms[room]["spoken_this_turn"] = set()
-                await start_new_turn(room)
-                await syslog(room, f"Host 已切到第 {rooms[room]['round']} 回合。", session=rooms[room]["session"])
-                await broadcast_room_list(room)
-                continue
+class PeerLink:
+    """本 worker -> 擁有者 worker 的單向指令通道（回覆走同一條 socket）。"""
+
+    def __init__(self, backend: "ShardedBackend", index: int):
+        self.backend = backend
+        self.index = index
+        self.pending = deque()
+        self.wake = asyncio.Event()
+        self.task = asyncio.create_task(self._run())
+
+    def send(self, obj: dict):
+        self.pending.append(ipc_line(obj))
+        self.wake.set()
+
+    async def _connect(self):
+        path = self.backend.sock_path(self.index)
+        for _ in range(50):
+            try:
+                return await asyncio.open_unix_connection(path, limit=IPC_LINE_LIMIT)
+            except OSError:
+                await asyncio.sleep(0.1)
+        raise ConnectionError(f"worker {self.index} unreachable: {path}")
+
+    async def _run(self):
+        writer = read_task = None
+        try:
+            reader, writer = await self._connect()
+            # 對方關閉 socket 時連帶結束寫入迴圈
+            read_task = asyncio.create_task(self._read(reader))
+            read_task.add_done_callback(lambda _: self.task.cancel())
+            while True:
+                while self.pending:
+                    writer.write(self.pending.popleft())
+                await writer.drain()
+                self.wake.clear()
+                await self.wake.wait()
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            print(f"[backend] link to worker {self.index} failed: {e}")
+        finally:
+            if read_task:
+                read_task.cancel()
+            if writer:
+                writer.close()
+            self.backend.link_lost(self)
+
+    async def _read(self, reader: asyncio.StreamReader):
+        while True:
+            line = await reader.readline()
+            if not line:
+                return
+            self.backend.on_reply(json.loads(line))
+
+class ShardedBackend:
+    def __init__(self, workers: int, ipc_dir: str):
+        self.workers = workers
+        self.ipc_dir = ipc_dir
+        self.index = None
+        self.lock_fd = None
+        self.server = None
+        self.links = {}     # 擁有者 index -> PeerLink
+        self.conns = {}     # conn -> Outbox（連線在本 worker）
+        self.routes = {}    # conn -> 擁有者 index（連線在本 worker、房間在別的 worker）
+
+    def sock_path(self, index: int) -> str:
+        return os.path.join(self.ipc_dir, f"worker-{index}.sock")
+
+    def owner(self, room_id: str) -> int:
+        return zlib.crc32(room_id.encode()) % self.workers
+
+    async def claim(self):
+        self.index, self.lock_fd = await claim_index(self.ipc_dir, self.workers)
+
+    async def start(self):
+        path = self.sock_path(self.index)
+        if os.path.exists(path):
+            os.unlink(path)
+        self.server = await asyncio.start_unix_server(self._serve_peer, path, limit=IPC_LINE_LIMIT)
+        print(f"[backend] worker {self.index}/{self.workers} listening on {path}")
+
+    async def stop(self):
+        for link in list(self.links.values()):
+            link.task.cancel()
+        if self.server:
+            self.server.close()
+            self.server = None
+        if self.lock_fd is not None:
+            os.close(self.lock_fd)
+            self.lock_fd = None
+
+    def attach(self, conn: str, out: Outbox):
+        self.conns[conn] = out
+
+    def detach(self, conn: str):
+        self.conns.pop(conn, None)
+        self.routes.pop(conn, None)
+
+    def link(self, index: int) -> PeerLink:
+        link = self.links.get(index)
+        if not link:
+            link = self.links[index] = PeerLink(self, index)
+        return link
+
+    def submit(self, room_id: str, cid: str, msg: dict, out: Outbox):
+        owner = self.owner(room_id)
+        if owner == self.index:
+            self.routes.pop(out.conn, None)
+            dispatch_local(room_id, cid, msg, out)
+        else:
+            self.routes[out.conn] = owner
+            self.link(owner).send({"op":"msg","room":room_id,"cid":cid,"conn":out.conn,"msg":msg,"fmt":out.fmt})
+
+    def leave(self, room_id: str | None, cid: str, out: Outbox, lost: bool = False):
+        if room_id is None: return
+        owner = self.owner(room_id)
+        if owner == self.index:
+            leave_local(room_id, cid, out, lost)
+        else:
+            self.link(owner).send({"op":"leave","room":room_id,"cid":cid,"conn":out.conn,"lost":lost})
+
+    def on_reply(self, obj: dict):
+        out = self.conns.get(obj["conn"])
+        if not out: return
+        if obj["op"] == "out":
+            data = base64.b64decode(obj["b64"]) if "b64" in obj else obj["data"]
+            out.push(data, obj["low"])
+        elif obj["op"] == "close":
+            out.close(obj["drain"], obj["code"])
+        elif obj["op"] == "bind":
+            out.bind(obj["cid"])
+
+    def link_lost(self, link: PeerLink):
+        if self.links.get(link.index) is link:
+            del self.links[link.index]
+        # 擁有者掛了，房間已不存在：請這些連線重連（1012 = service restart）
+        for conn, owner in list(self.routes.items()):
+            if owner == link.index:
+                self.routes.pop(conn, None)
+                out = self.conns.get(conn)
+                if out:
+                    out.close(drain=True, code=1012)
+
+    async def _serve_peer(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        proxies = {}    # 經這條 socket 進來的 conn -> RemoteOutbox
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                obj = json.loads(line)
+                cid, conn = obj["cid"], obj["conn"]
+                if obj["op"] == "msg":
+                    out = proxies.get(conn)
+                    if not out:
+                        out = proxies[conn] = RemoteOutbox(writer, conn, cid, tuple(obj["fmt"]))
+                    out.cid = cid
+                    dispatch_local(obj["room"], cid, obj["msg"], out)
+                elif obj["op"] == "leave":
+                    out = proxies.pop(conn, None)
+                    if out:
+                        leave_local(obj["room"], cid, out, obj["lost"])
+        except Exception as e:
+            print(f"[backend] peer connection error: {e}")
+        finally:
+            # 對方 worker 斷了：它轉過來的玩家一律視為斷線（保留座位等重連）
+            for out in proxies.values():
+                r = room_of(out.cid)
+                if r:
+                    leave_local(r.id, out.cid, out, lost=True)
+            writer.close()
+
+backend = ShardedBackend(WORKERS, IPC_DIR) if WORKERS > 1 else MemoryBackend()
 
-            # 重置（Host）
-            if t == "reset_game":
-                room = find_room(cid)
-                if not room: continue
-                if rooms[room]["host"] != cid: continue
-                rooms[room]["status"] = "waiting"
-                rooms[room]["round"] = 0
-                rooms[room]["pair"] = None
-                rooms[room]["votes"] = {}
-                rooms[room]["undercover_ids"] = set()
-                rooms[room]["speak_order"] = []
-                rooms[room]["speak_index"] = 0
-                rooms[room]["spoken_this_turn"] = set()
-                await cancel_timer(room)
-                for pcid in rooms[room]["clients"]:
-                    rooms[room]["clients"][pcid]["alive"] = True
-                    rooms[room]["clients"][pcid]["role"] = "civilian"
-                await syslog(room, "遊戲已重置；按『開始遊戲』將開啟新的一局。")
-                await broadcast_room_list(room)
-                continue
+# ===== 內部工具 =====
+def send_to(out: Outbox, payload: dict):
+    f = Frame(payload)
+    if not out.push(f.data(out.fmt), f.low):
+        SEND_FAILURES.inc()
+
+def broadcast(r: Room, payload: dict, skip: str | None = None):
+    # 每種格式只編碼一次，逐一入列；不等待任何一支手機。
+    # 廣播帶房內序號並留在 history，斷線重連時依 seq 補送
+    t0 = time.perf_counter()
+    r.seq += 1
+    payload["seq"] = r.seq
+    f = Frame(payload)
+    if r.history is None:
+        r.history = deque(maxlen=RESUME_BUFFER)
+    r.history.append(f)
+    sent = failed = 0
+    for p in list(r.clients.values()):
+        if p.cid != skip:
+            if p.out.push(f.data(p.out.fmt), f.low):
+                sent += 1
+            else:
+                failed += 1
+    if failed:
+        SEND_FAILURES.inc(failed)
+    if r.audience:
+        r.audience.publish(f)   # 觀眾另走一層，這裡只入列，不在玩家的路徑上扇出
+    BROADCAST_FANOUT.observe(sent)
+    BROADCAST_SECONDS.observe(time.perf_counter() - t0)
+
+def unicast(r: Room, cid: str, payload: dict):
+    p = r.clients.get(cid)
+    if not p: return
+    send_to(p.out, payload)
+
+def syslog(r: Room, text: str, session: int | None = None):
+    payload = {"type":"status", "msg": text}
+    if session is not None:
+        payload["session"] = session
+    broadcast(r, payload)
 
-            # 發言
-            if t == "say":
-                room = find_room(cid)
-                if not room: continue
-                if rooms[room]["status"] not in ("playing","voting"):
-                    await hint(room, cid, "目前不是發言階段")
-                    continue
-                if not rooms[room]["clients"][cid]["alive"]:
-                    await hint(room, cid, "你已被淘汰，不能發言")
-                    continue
-                if rooms[room]["status"] == "voting":
-                    await hint(room, cid, "目前在投票，不能發言")
-                    continue
-                if cid in rooms[room]["spoken_this_turn"]:
-                    await hint(room, cid, "你本回合已發言")
-                    continue
+def hint(r: Room, cid: str, text: str, ms: int = 3000):
+    unicast(r, cid, {"type":"hint","msg":text,"duration":ms})
 
-                # 檢查輪到誰
-                order = rooms[room]["speak_order"]
-                idx = rooms[room]["speak_index"]
-                if not order:
-                    await hint(room, cid, "尚未設定發言順序")
-                    continue
+# 名單同步：平常只廣播帶版本號的增量（roster），完整快照（room）只在入房
+# 或前端發現版本缺口（roster_sync）時單獨補給該玩家。
+# 名單不帶角色：角色只能在 you_are / reveal 中出現。
+def roster_entry(r: Room, p: Player) -> dict:
+    return {"cid": p.cid, "name": p.name, "alive": r.game.is_alive(p.slot), "is_host": (p.cid==r.host)}
 
-                # 壓縮到存活者
-                alive_set = set([x for x,info in rooms[room]["clients"].items() if info["alive"]])
-                order = [x for x in order if x in alive_set]
-                rooms[room]["speak_order"] = order
-                if not order:
-                    await hint(room, cid, "場上無人可發言")
-                    continue
-                idx = idx % len(order)
-                rooms[room]["speak_index"] = idx
-                current = order[idx]
+def roster_snapshot(r: Room) -> dict:
+    # at：快照對應的廣播序號，前端以此為 seq 起點
+    players = [roster_entry(r, x) for x in r.clients.values()]
+    return {"type":"room","v":r.roster_ver,"at":r.seq,"status":r.status,"round":r.round,"players":players}
 
-                if cid != current:
-                    name_now = rooms[room]["clients"][current]["name"]
-                    await hint(room, cid, f"現在輪到 {name_now} 發言", ms=3000)
-                    continue
+def send_roster(r: Room, out):
+    send_to(out, roster_snapshot(r))
 
-                # 發言
-                text = (msg.get("text") or "").strip()
-                if text:
-                    name = rooms[room]["clients"][cid]["name"]
-                    await broadcast(room, {"type":"chat","from":name,"text":text,"session": rooms[room]["session"]})
-                    rooms[room]["spoken_this_turn"].add(cid)
+def roster_delta(r: Room, op: str, skip: str | None = None, **fields):
+    # op: player_joined / player_left / player_eliminated / status_changed
+    r.roster_ver += 1
+    broadcast(r, {"type":"roster","op":op,"v":r.roster_ver, **fields}, skip=skip)
 
-                # 指向下一位 / 或自動投票
-                await advance_after_speak(room, cid)
-                continue
+def roster_status(r: Room, reset: bool = False):
+    # reset=True：全員復活（開新局 / 重置）
+    roster_delta(r, "status_changed", status=r.status, round=r.round, reset=reset)
 
-    except WebSocketDisconnect:
-        print(f"[ws] disconnected: {cid}")
-        remove_client(cid)
+def clamp_seconds(v) -> int:
+    try:
+        v = int(v)
+    except (TypeError, ValueError):
+        return 0
+    return 0 if v <= 0 else max(5, min(v, 600))
+
+def room_of(cid: str):
+    rid = client_room.get(cid)
+    return rooms.get(rid) if rid is not None else None
+
+def add_client(r: Room, cid: str, name: str, out: Outbox) -> Player:
+    # 重複入同一房：沿用原座位，只更新名稱
+    p = r.clients.get(cid)
+    if p:
+        p.name = name
+    else:
+        p = r.add_player(cid, name, out)
+        r.game.seat(p.slot)
+    client_room[cid] = r.id
+    jot(r, "join", [cid, p.slot, name, p.token])
+    return p
+
+def remove_client(r: Room, cid: str):
+    p = r.remove_player(cid)
+    if p and p.expire:
+        scheduler.cancel(p.expire)
+        p.expire = None
+    # 換房時新房的 actor 可能已先把索引指過去，只清掉指向本房的
+    if client_room.get(cid) == r.id:
+        del client_room[cid]
+    if p:
+        jot(r, "leave", cid)
+    if p and r.clients:
+        roster_delta(r, "player_left", cid=cid)
+        # 走掉的是目前發言者：補播輪到誰（含重置發言計時），其他人都講過了就直接開票；
+        # 投票中走掉的是最後一位未投者：直接結算
+        play(r, lambda: r.game.unseat(p.slot))
+    elif p:
+        r.game.unseat(p.slot)
+    return p
+
+def drop_room(room_id: str):
+    r = rooms.pop(room_id, None)
+    if not r: return
+    jot(r, "drop")
+    cancel_timer(r)
+    if r.actor and r.actor is not asyncio.current_task():
+        r.actor.cancel()
+    if r.audience:
+        r.audience.close()
+    for pcid, p in r.clients.items():
+        if p.expire:
+            scheduler.cancel(p.expire)
+        if client_room.get(pcid) == room_id:
+            client_room.pop(pcid, None)
+
+def check_room_index():
+    """一致性檢查（測試/除錯用）：client_room 與各房 clients 必須完全對應。"""
+    expected = {}
+    for rid, r in rooms.items():
+        for pcid, p in r.clients.items():
+            assert pcid not in expected, f"{pcid} 同時在 {expected[pcid]} 與 {rid}"
+            assert r.seats[p.slot] is p, f"{rid} 座位 {p.slot} 對應錯誤"
+            expected[pcid] = rid
+        assert sum(1 for p in r.seats if p) == len(r.clients), f"{rid} seats 與 clients 數量不符"
+    assert expected == client_room, f"索引不一致：{set(expected.items()) ^ set(client_room.items())}"
+
+# ===== 規則事件 -> 訊息 =====
+# 規則本身在 engine.Game（純狀態轉移）；這裡把它回傳的事件依序翻成廣播/私訊/計時器。
+# 名單狀態（status_changed）只在階段或回合真的變了、或開新局/重置時補一次。
+REJECT_HINTS = {
+    "not_speaking_phase": "目前不是發言階段",
+    "dead": "你已被淘汰，不能發言",
+    "voting": "目前在投票，不能發言",
+    "already_spoke": "你本回合已發言",
+    "no_order": "尚未設定發言順序",
+    "dead_voter": "已被淘汰，不能投票",
+    "bad_target": "投票目標無效",
+}
+
+def play(r: Room, events_of, cid: str | None = None, text: str = "") -> list:
+    """events_of()：呼叫一次 Game 的轉移並回傳事件；cid 為下指令者（收 hint 用），text 為發言內容。"""
+    g = r.game
+    before = (g.status, g.round)
+    events = events_of()
+    apply_events(r, events, cid, text)
+    fresh = any(ev[0] in ("started", "reset") for ev in events)
+    changed = (g.status, g.round) != before
+    if fresh or changed:
+        roster_status(r, reset=fresh)
+    if journal:
+        jot_events(r, events, changed and not fresh)
+    if history_store:
+        record_events(r, events)
+    return events
+
+def apply_events(r: Room, events: list, cid: str | None = None, text: str = ""):
+    g = r.game
+    for ev in events:
+        kind = ev[0]
+        if kind == "reject":
+            code = ev[1]
+            if code == "too_few":
+                syslog(r, f"至少需要 {ev[2]} 名玩家才能開始。")
+            elif code == "not_your_turn":
+                hint(r, cid, f"現在輪到 {r.seats[ev[2]].name} 發言", ms=3000)
+            elif code in REJECT_HINTS:
+                hint(r, cid, REJECT_HINTS[code])
+        elif kind == "session":
+            # 新局（分色分區）
+            broadcast(r, {"type":"chat_session","session": g.session})
+            broadcast(r, {"type":"sys_session","session": g.session})
+        elif kind == "roles":
+            for p in r.clients.values():
+                send_to(p.out, {"type":"you_are","word":g.word(p.slot),"alive":True,"role":g.role(p.slot)})
+            syslog(r, f"本局臥底人數：<b>{ev[1]}</b> 人。", session=g.session)
+        elif kind == "turn":
+            name = r.seats[ev[1]].name
+            if ev[2]:
+                syslog(r, f"本回合發言順序已隨機安排。現在輪到 <b>{name}</b> 發言。", session=g.session)
+            else:
+                syslog(r, f"現在輪到 <b>{name}</b> 發言。", session=g.session)
+            restart_speaker_timer(r)
+        elif kind == "started":
+            syslog(r, "遊戲開始！第 1 回合，請依序描述。", session=g.session)
+        elif kind == "spoke":
+            broadcast(r, {"type":"chat","from":r.seats[ev[1]].name,"text":text,"session": g.session})
+        elif kind == "timed_out":
+            syslog(r, f"{r.seats[ev[1]].name} 超過 {r.speak_seconds} 秒未發言，換下一位。", session=g.session)
+        elif kind == "vote_open":
+            cancel_timer(r)
+            broadcast(r, {"type":"chat_divider","session": g.session})
+            syslog(r, "投票開始！請選擇要淘汰的人。", session=g.session)
+            broadcast(r, {"type":"voting_open","alive":vote_candidates(r),"seconds":r.vote_seconds})
+            start_vote_timer(r)
+        elif kind == "vote_ack":
+            send_to(r.seats[ev[1]].out, {"type":"vote_ack","changed":ev[2]})
+        elif kind == "vote_timeout":
+            syslog(r, f"投票時間（{r.vote_seconds} 秒）已到，未投票者視為棄權。", session=g.session)
+        elif kind == "vote_result":
+            cancel_timer(r)
+            pairs = [{"from": r.seats[v].name, "to": r.seats[t].name if t is not None else "(未投)"}
+                     for v, t in ev[1]]
+            broadcast(r, {"type":"vote_result","pairs": pairs})
+        elif kind == "tie":
+            syslog(r, "平票！本回合無人出局，重新輪流發言。", session=g.session)
+        elif kind == "eliminated":
+            p = r.seats[ev[1]]
+            roster_delta(r, "player_eliminated", cid=p.cid)
+            syslog(r, f"本輪淘汰：{p.name}", session=g.session)
+            broadcast(r, {"type":"round_result","eliminated":p.name})
+            send_to(p.out, {"type":"you_died"})
+        elif kind == "gameover":
+            cancel_timer(r)
+            side = "平民" if ev[1] == "civilian" else "臥底"
+            syslog(r, f"遊戲結束：{side}勝利！本局詞語：平民「{g.pair[0]}」 / 臥底「{g.pair[1]}」。",
+                   session=g.session)
+            # 結束彈窗揭露全部身份與詞
+            reveal_all(r)
+            broadcast(r, {"type":"gameover","winner":side})
+        elif kind == "round":
+            if ev[2]:
+                syslog(r, f"Host 已切到第 {ev[1]} 回合。", session=g.session)
+            else:
+                syslog(r, f"進入第 {ev[1]} 回合，請依序描述。", session=g.session)
+        elif kind == "reset":
+            cancel_timer(r)
+            syslog(r, "遊戲已重置；按『開始遊戲』將開啟新的一局。")
+
+def vote_candidates(r: Room) -> list:
+    return [{"cid": p.cid, "name": p.name} for p in r.clients.values() if r.game.is_alive(p.slot)]
+
+def restart_speaker_timer(r: Room):
+    cancel_timer(r)
+    if not r.speak_seconds:
+        return
+    if r.game.current_speaker() is None:
+        return
+    r.timer = scheduler.call_later(r.speak_seconds, post_timeout, r)
 
-# ===== 內部工具 =====
-async def broadcast(room_id: str, payload: dict):
-    data = json.dumps(payload)
-    for _, info in list(rooms.get(room_id, {}).get("clients", {}).items()):
-        try:
-            await info["ws"].send_text(data)
-        except:
-            pass
+def start_vote_timer(r: Room):
+    cancel_timer(r)
+    if r.vote_seconds and r.status == "voting":
+        r.timer = scheduler.call_later(r.vote_seconds, post_timeout, r)
 
-async def unicast(cid: str, payload: dict):
-    rid = find_room(cid)
-    if not rid: return
-    info = rooms[rid]["clients"].get(cid)
-    if not info: return
-    try:
-        await info["ws"].send_text(json.dumps(payload))
-    except:
-        pass
+def post_timeout(r: Room, timer: "Timer"):
+    # 排程器只負責投遞，實際處理交給 actor；已被取代的計時器會被忽略
+    if rooms.get(r.id) is r:
+        r.inbox.put_nowait(("timeout", None, timer, None))
 
-async def syslog(room_id: str, text: str, session: int | None = None):
-    payload = {"type":"status", "msg": text}
-    if session is not None:
-        payload["session"] = session
-    await broadcast(room_id, payload)
+def cancel_timer(r: Room):
+    if r.timer:
+        scheduler.cancel(r.timer)
+        r.timer = None
 
-async def hint(room_id: str, cid: str, text: str, ms: int = 3000):
-    await unicast(cid, {"type":"hint","msg":text,"duration":ms})
+def on_timeout(r: Room, timer: "Timer"):
+    if r.timer is not timer:
+        return
+    r.timer = None
+    play(r, r.game.timeout)
 
-async def broadcast_room_list(room_id: str):
-    players = []
-    r = rooms.get(room_id)
-    if not r: return
-    for pcid, info in r["clients"].items():
-        players.append({
-            "cid": pcid, "name": info["name"], "alive": info["alive"],
-            "is_host": (pcid==r["host"]), "role": info.get("role","unknown")
+def reveal_all(r: Room):
+    """NEW: 廣播全體玩家身份與詞語，用於前端彈窗顯示 10 秒"""
+    g = r.game
+    detail = []
+    for p in r.clients.values():
+        detail.append({
+            "name": p.name,
+            "role": g.role(p.slot),
+            "word": g.word(p.slot)
         })
-    await broadcast(room_id, {"type":"room","status":r["status"],"round":r["round"],"players":players})
-
-def find_room(cid: str):
-    for rid, room in rooms.items():
-        if cid in room["clients"]:
-            return rid
-    return None
-
-def remove_client(cid: str):
-    rid = find_room(cid)
-    if not rid: return
-    room = rooms[rid]
-    room["clients"].pop(cid, None)
-    if not room["clients"]:
-        try:
-            if room.get("timer_task"):
-                room["timer_task"].cancel()
-        except:
-            pass
-        rooms.pop(rid, None)
-
-async def start_new_turn(room_id: str):
-    r = rooms[room_id]
-    alive = [cid for cid, info in r["clients"].items() if info["alive"]]
-    random.shuffle(alive)
-    r["speak_order"] = alive
-    r["speak_index"] = 0
-    r["spoken_this_turn"] = set()
-    if alive:
-        first_name = r["clients"][alive[0]]["name"]
-        await syslog(room_id, f"本回合發言順序已隨機安排。現在輪到 <b>{first_name}</b> 發言。", session=r["session"])
-        await restart_speaker_timer(room_id)
-
-async def open_vote(room_id: str):
-    r = rooms[room_id]
-    if r["status"] != "playing":
-        return
-    r["status"] = "voting"
-    r["votes"] = {}
-    await cancel_timer(room_id)
-    alive_list = [{"cid": xcid, "name": info["name"]} for xcid, info in r["clients"].items() if info["alive"]]
-    await broadcast(room_id, {"type":"chat_divider","session": r["session"]})
-    await syslog(room_id, "投票開始！請選擇要淘汰的人。", session=r["session"])
-    await broadcast(room_id, {"type":"voting_open","alive":alive_list})
-
-async def advance_after_speak(room_id: str, who_cid: str):
-    r = rooms[room_id]
-    if r["status"] != "playing":
-        return
-    alive_set = set([x for x,info in r["clients"].items() if info["alive"]])
-    # 全員講過？
-    if alive_set.issubset(r["spoken_this_turn"]):
-        await open_vote(room_id)
+    payload = {
+        "type": "reveal",
+        "uc_count": len(g.undercover),
+        "civil_word": g.pair[0],
+        "uc_word": g.pair[1],
+        "players": detail
+    }
+    broadcast(r, payload)
+
+# ===== 斷線重連 =====
+# 連線中斷時不馬上移除玩家：座位、角色、存活狀態保留 RESUME_GRACE 秒，期間的廣播照常進 history。
+# 前端帶 resume token 與最後收到的 seq 重連：缺口還在 history 內就只補送漏掉的事件，
+# 落後太多則給一份精簡快照（名單 + 目前階段）；兩種情況都會補上自己的詞/角色/存活。
+# 補送量不超過 Outbox 容量的一半，避免重連當下就把佇列塞爆。
+RESUME_GRACE = int(os.environ.get("RESUME_GRACE", "60"))       # 0 = 斷線即離房（舊行為）
+RESUME_BUFFER = int(os.environ.get("RESUME_BUFFER", "64"))     # 每房保留的廣播數
+RESUME_REPLAY_MAX = min(RESUME_BUFFER, OUTBOX_SIZE // 2)
+
+def post_expire(r: Room, cid: str, timer: "Timer"):
+    if rooms.get(r.id) is r:
+        r.inbox.put_nowait(("expire", cid, timer, None))
+
+def on_lost(r: Room, cid: str, out):
+    p = r.clients.get(cid)
+    if not p or p.out is not out:
         return
-    # 找下一位未發言者
-    order = [x for x in r["speak_order"] if x in alive_set]
-    if not order:
-        await open_vote(room_id)
+    if not RESUME_GRACE:
+        remove_client(r, cid)
         return
-    try:
-        start_idx = order.index(who_cid)
-    except ValueError:
-        start_idx = r["speak_index"] % len(order)
-    next_cid = None
-    for k in range(1, len(order)+1):
-        c = order[(start_idx + k) % len(order)]
-        if c not in r["spoken_this_turn"]:
-            next_cid = c
-            r["speak_index"] = (start_idx + k) % len(order)
-            break
-    if next_cid is None:
-        await open_vote(room_id)
+    p.out = OFFLINE
+    p.expire = scheduler.call_later(RESUME_GRACE, post_expire, r, cid)
+    syslog(r, f"{p.name} 斷線，保留座位 {RESUME_GRACE} 秒。", session=r.session or None)
+
+def on_expire(r: Room, cid: str, timer: "Timer"):
+    p = r.clients.get(cid)
+    if not p or p.expire is not timer:
         return
-    next_name = r["clients"][next_cid]["name"]
-    await syslog(room_id, f"現在輪到 <b>{next_name}</b> 發言。", session=r["session"])
-    await restart_speaker_timer(room_id)
-
-async def restart_speaker_timer(room_id: str):
-    r = rooms[room_id]
-    await cancel_timer(room_id)
-    if not r.get("limit_20s"):
+    p.expire = None
+    remove_client(r, cid)
+
+def resume_player(r: Room, p: Player, out, seq):
+    was_offline = p.out is OFFLINE
+    out.bind(p.cid)     # 先於任何回覆：連線收到 resumed 之後送的指令就以原座位身分投遞
+    if p.out is not out:
+        # 舊連線可能還半開著：關掉，它之後送來的離線通知會因 out 不符而被忽略
+        p.out.close(drain=False, code=4000)
+        p.out = out
+    if p.expire:
+        scheduler.cancel(p.expire)
+        p.expire = None
+    client_room[p.cid] = r.id
+
+    missed = r.seq - seq if isinstance(seq, int) and 0 <= seq <= r.seq else -1
+    history = r.history or ()
+    if 0 <= missed <= min(len(history), RESUME_REPLAY_MAX):
+        send_to(out, {"type":"resumed","mode":"replay","count":missed})
+        for f in list(history)[len(history) - missed:]:
+            out.push(f.data(out.fmt), f.low)
+    else:
+        send_to(out, {"type":"resumed","mode":"snapshot"})
+        send_snapshot(r, out)
+
+    # 私人狀態不在 history 裡，一律補上
+    g = r.game
+    if g.pair and g.status != "waiting":
+        send_to(out, {"type":"you_are","word":g.word(p.slot),"alive":g.is_alive(p.slot),"role":g.role(p.slot)})
+    if g.status == "voting" and p.slot in g.votes:
+        send_to(out, {"type":"vote_ack"})
+    if was_offline:
+        syslog(r, f"{p.name} 已重新連線。", session=r.session or None)
+
+def send_snapshot(r: Room, out):
+    send_roster(r, out)
+    if r.session:
+        send_to(out, {"type":"chat_session","session":r.session})
+        send_to(out, {"type":"sys_session","session":r.session})
+    if r.status == "voting":
+        send_to(out, {"type":"voting_open","alive":vote_candidates(r),"seconds":r.vote_seconds})
+    elif r.game.current_speaker() is not None:
+        cur = r.seats[r.game.current_speaker()]
+        if cur:
+            send_to(out, {"type":"status","msg":f"現在輪到 <b>{cur.name}</b> 發言。","session":r.session})
+
+# ===== 觀戰 =====
+# 觀眾不入座（不在 clients / seats / Game 裡），由每房一個 Audience 另外扇出：
+#   broadcast 只把共用的 Frame 丟進 Audience 的佇列就返回，玩家的訊息永遠先入列；
+#   pump task 每推 AUDIENCE_CHUNK 位觀眾讓出一次事件迴圈，上千觀眾也不會卡住房間 actor；
+#   醒來後先等 AUDIENCE_INTERVAL 秒把這段時間的廣播攢成一批，每位觀眾一次送出（併成一個 frame）。
+#   名單增量不轉給觀眾，只標記「名單變了」，pump 醒來時送一份當下的完整快照（多次變動併成一次）。
+#   觀眾自己的佇列超過 AUDIENCE_BEHIND 時只送 AUDIENCE_KEEP 裡的關鍵事件，其餘略過；
+#   追上後補一份名單快照。觀眾的訊息一律以低優先入列，佇列滿時丟最舊的，不會因此被斷線。
+AUDIENCE_MAX = int(os.environ.get("AUDIENCE_MAX", "5000"))     # 每房觀眾上限
+AUDIENCE_CHUNK = int(os.environ.get("AUDIENCE_CHUNK", "256"))
+AUDIENCE_INTERVAL = float(os.environ.get("AUDIENCE_INTERVAL", "0.2"))   # 觀眾端的更新延遲上限
+AUDIENCE_BEHIND = int(os.environ.get("AUDIENCE_BEHIND", str(OUTBOX_SIZE // 2)))
+AUDIENCE_KEEP = {"room", "chat_session", "sys_session", "voting_open", "vote_result",
+                 "round_result", "reveal", "gameover"}
+
+class Audience:
+    __slots__ = ("room", "viewers", "frames", "roster_dirty", "lagged", "wake", "task")
+
+    def __init__(self, r: Room):
+        self.room = r
+        self.viewers = {}           # cid -> Outbox / RemoteOutbox
+        self.frames = deque()       # 待扇出的廣播 Frame
+        self.roster_dirty = False
+        self.lagged = set()         # 曾被略過訊息、追上後要補快照的觀眾
+        self.wake = asyncio.Event()
+        self.task = asyncio.create_task(self._pump())
+
+    def add(self, cid: str, out):
+        self.viewers[cid] = out
+
+    def remove(self, cid: str, out) -> bool:
+        if self.viewers.get(cid) is not out:
+            return False
+        del self.viewers[cid]
+        self.lagged.discard(cid)
+        return True
+
+    def publish(self, f: Frame):
+        if f.payload.get("type") == "roster":
+            self.roster_dirty = True
+        else:
+            self.frames.append(f)
+        self.wake.set()
+
+    async def _pump(self):
+        while True:
+            await self.wake.wait()
+            if AUDIENCE_INTERVAL:
+                await asyncio.sleep(AUDIENCE_INTERVAL)
+            self.wake.clear()
+            # 快照與佇列要同一刻取，快照的 at 才會剛好接在這批訊息之後
+            frames = list(self.frames)
+            self.frames.clear()
+            snapshot = Frame(roster_snapshot(self.room)) if self.roster_dirty or self.lagged else None
+            if self.roster_dirty:
+                self.roster_dirty = False
+                frames.append(snapshot)
+            skipped = 0
+            for i, (cid, out) in enumerate(list(self.viewers.items())):
+                if self.viewers.get(cid) is not out:
+                    continue
+                batch = frames
+                if len(getattr(out, "queue", ())) >= AUDIENCE_BEHIND:
+                    batch = [f for f in frames if f.payload.get("type") in AUDIENCE_KEEP]
+                    if len(batch) != len(frames):
+                        skipped += len(frames) - len(batch)
+                        self.lagged.add(cid)
+                elif cid in self.lagged:
+                    self.lagged.discard(cid)
+                    if snapshot not in frames:
+                        batch = frames + [snapshot]
+                for f in batch:
+                    if not out.push(f.data(out.fmt), True):
+                        self.remove(cid, out)
+                        break
+                if (i + 1) % AUDIENCE_CHUNK == 0:
+                    await asyncio.sleep(0)
+            if skipped:
+                AUDIENCE_SKIPPED.inc(skipped)
+
+    def close(self):
+        for out in self.viewers.values():
+            send_to(out, {"type":"room_closed"})
+            out.close()
+        self.viewers.clear()
+        self.task.cancel()
+
+def watch(r: Room, cid: str, out):
+    if not r.audience:
+        r.audience = Audience(r)
+    elif cid not in r.audience.viewers and len(r.audience.viewers) >= AUDIENCE_MAX:
+        send_to(out, {"type":"error","msg":"觀戰人數已滿"})
         return
-    if r["status"] != "playing":
+    r.audience.add(cid, out)
+    send_to(out, {"type":"watching","room":r.id})
+    send_snapshot(r, out)
+
+# ===== 心跳與回收 =====
+# 每 HEARTBEAT_INTERVAL 秒對所有連線送一次應用層 ping（整批共用同一份編碼），前端回 pong；
+# 任何收到的 frame 都算活著。同一個迴圈順便回收：
+#   連線：超過 IDLE_TIMEOUT 秒沒有任何 frame（手機睡死、TCP 半開）→ 關閉，之後走斷線保留座位流程
+#   房間：超過 ROOM_TTL 秒沒有處理任何指令 → 通知在線者並拆房（連同計時器）
+#   題庫：沒有任何房間引用的上傳題庫 → 移出記憶體，需要時再從 POOL_DIR 載入
+# 每 worker 各自回收自己的連線與房間；累計數字在 reaper_stats。
+HEARTBEAT_INTERVAL = float(os.environ.get("HEARTBEAT_INTERVAL", "20"))
+IDLE_TIMEOUT = float(os.environ.get("IDLE_TIMEOUT", "60"))
+ROOM_TTL = float(os.environ.get("ROOM_TTL", "1800"))
+
+# connections[conn] = Outbox（本 worker 上的連線）
+connections = {}
+reaper_stats = {"runs": 0, "connections": 0, "rooms": 0, "pools": 0}
+
+def reap(now: float | None = None) -> dict:
+    """回收一輪，回傳本輪清掉的數量。"""
+    now = time.monotonic() if now is None else now
+    conns = 0
+    for out in list(connections.values()):
+        if not out.closing and now - out.last_seen > IDLE_TIMEOUT:
+            out.close(drain=False, code=1001)
+            conns += 1
+
+    stale = [r for r in rooms.values() if now - r.last_active > ROOM_TTL]
+    for r in stale:
+        for p in r.clients.values():
+            send_to(p.out, {"type":"room_closed"})
+            p.out.close()
+        drop_room(r.id)
+
+    # 題庫以 pairs tuple 的 identity 判斷是否仍被房間的 Deck 引用
+    used = {id(seg) for r in rooms.values() for seg in r.deck.segments}
+    idle_pools = [wp.id for wp in word_pools.values()
+                  if wp is not BUILTIN_POOL and id(wp.pairs) not in used]
+    for pool_id in idle_pools:
+        del word_pools[pool_id]
+
+    result = {"connections": conns, "rooms": len(stale), "pools": len(idle_pools)}
+    reaper_stats["runs"] += 1
+    for k, v in result.items():
+        reaper_stats[k] += v
+    return result
+
+async def reaper_loop():
+    ping = Frame({"type":"ping"})
+    while True:
+        await asyncio.sleep(HEARTBEAT_INTERVAL)
+        try:
+            for out in list(connections.values()):
+                out.push(ping.data(out.fmt), True)
+            result = reap()
+            if any(result.values()):
+                print(f"[reaper] reclaimed {result['connections']} connections, "
+                      f"{result['rooms']} rooms, {result['pools']} pools "
+                      f"(live: {len(connections)} connections, {len(rooms)} rooms)")
+        except Exception:
+            traceback.print_exc()
+
+# ===== 狀態日誌 =====
+# 房間的狀態轉移（建房、入座、離開、開局的詞與角色、淘汰、階段/回合）寫進日誌（journal.py，每 worker 一個
+# SQLite 檔）；worker 重啟或當掉後從 snapshot + 日誌尾端重建 rooms。恢復的玩家一律先視為斷線、保留座位
+# RESUME_GRACE 秒，前端照常帶 token 重連就回到原座位；進行中的回合重新輪流發言（或重新開票）。
+# event loop 上只 append 到記憶體；每 JOURNAL_FLUSH 秒把緩衝整批交給執行緒寫檔，不會卡住任何房間。
+# UC_JOURNAL_DIR 設為空字串即停用。
+JOURNAL_DIR = os.environ.get("UC_JOURNAL_DIR", "/tmp/undercover-journal")
+JOURNAL_FLUSH = float(os.environ.get("JOURNAL_FLUSH", "0.2"))
+JOURNAL_SNAPSHOT_EVERY = int(os.environ.get("JOURNAL_SNAPSHOT_EVERY", "5000"))
+# 恢復後的廣播序號從日誌記下的序號再往後跳這麼多：前端帶舊序號重連時不會被誤判成「只漏了幾則」
+RESTORE_SEQ_SKIP = 1 << 20
+
+journal = None      # Journal；停用時為 None
+
+def jot(r: Room, kind: str, data=None):
+    if journal:
+        journal.append(r.id, r.seq, kind, data)
+
+def jot_events(r: Room, events: list, changed: bool):
+    g = r.game
+    for ev in events:
+        if ev[0] == "started":
+            jot(r, "start", {"session": g.session, "pair": list(g.pair) if g.pair else None,
+                             "undercover": sorted(g.undercover), "alive": sorted(g.alive)})
+        elif ev[0] == "eliminated":
+            jot(r, "eliminate", ev[1])
+        elif ev[0] == "reset":
+            jot(r, "reset")
+    if changed:
+        jot(r, "phase", [g.status, g.round])
+
+def setup_room(room_id: str, setup: dict, host: str) -> Room:
+    """依建房設定重建空房（Deck 從題庫 id 與自訂題目重組）；日誌恢復與交接共用。"""
+    pools = [BUILTIN_POOL] if setup["use_builtin"] else []
+    pools += [wp for wp in map(get_pool, setup["pools"]) if wp]
+    deck = Deck(pools, tuple(tuple(x) for x in setup["custom"]))
+    if not deck.size:
+        deck = Deck([BUILTIN_POOL])
+    r = rooms[room_id] = Room(room_id, host, deck, setup["speak_seconds"])
+    r.setup = setup
+    r.vote_seconds = setup["vote_seconds"]
+    r.game.early = setup["early"]
+    return r
+
+def seat_offline(r: Room, players):
+    """players：[(cid, slot, name, token)]；全部先當成斷線，保留座位 RESUME_GRACE 秒等重連。"""
+    for cid, slot, name, token in sorted(players, key=lambda x: x[1]):
+        r.seats.extend([None] * (slot - len(r.seats)))
+        p = Player(cid, slot, name, OFFLINE)
+        p.token = token
+        p.expire = scheduler.call_later(RESUME_GRACE, post_expire, r, cid)
+        r.seats.append(p)
+        r.clients[cid] = p
+        client_room[cid] = r.id
+        r.game.seat(slot)
+
+def restore_room(room_id: str, st: dict) -> Room:
+    r = setup_room(room_id, st["settings"], st["host"])
+    r.seq = st["at"] + RESTORE_SEQ_SKIP
+    r.last_pair = tuple(st["pair"]) if st["pair"] else None
+    seat_offline(r, [(cid, *p) for cid, p in st["players"].items()])
+    r.actor = asyncio.create_task(room_actor(r))
+    g = r.game
+    play(r, lambda: g.restore(st["status"], st["round"], st["session"], st["pair"], st["alive"], st["undercover"]))
+    return r
+
+async def journal_open():
+    global journal
+    if not JOURNAL_DIR:
         return
-    order = r["speak_order"]
-    if not order: return
-    idx = r["speak_index"] % len(order)
-    current = order[idx]
-    token = str(uuid.uuid4())
-    r["speak_token"] = token
-
-    async def timer():
+    os.makedirs(JOURNAL_DIR, exist_ok=True)
+    index = getattr(backend, "index", None) or 0
+    path = os.path.join(JOURNAL_DIR, f"journal-{index}.db")
+    j = Journal(path, JOURNAL_SNAPSHOT_EVERY)
+    states = await asyncio.to_thread(j.open)
+    journal = j
+    restored = 0
+    for room_id, st in list(states.items()):
+        if room_id in rooms:
+            continue    # 已由上一代 worker 直接交接（比日誌精確）
+        # worker 數改過（房間歸屬換人）、不保留座位、或房裡沒人：不恢復，直接記成拆房
+        if (WORKERS > 1 and backend.owner(room_id) != backend.index) or not RESUME_GRACE or not st["players"]:
+            j.append(room_id, st["at"], "drop")
+            continue
         try:
-            await asyncio.sleep(20)
-            rr = rooms.get(room_id)
-            if not rr or rr["status"] != "playing": return
-            if rr.get("speak_token") != token: return
-            rr["spoken_this_turn"].add(current)
-            name = rr["clients"][current]["name"]
-            await syslog(room_id, f"{name} 超過 20 秒未發言，換下一位。", session=rr["session"])
-            await advance_after_speak(room_id, current)
+            restore_room(room_id, st)
+            restored += 1
+        except Exception:
+            traceback.print_exc()
+            rooms.pop(room_id, None)
+            j.append(room_id, st["at"], "drop")
+    print(f"[journal] {path}: restored {restored} rooms")
+
+async def journal_loop():
+    while True:
+        await asyncio.sleep(JOURNAL_FLUSH)
+        if not journal.buffer:
+            continue
+        batch = journal.take()
+        t0 = time.perf_counter()
+        fut = asyncio.ensure_future(asyncio.to_thread(journal.write, batch))
+        try:
+            await asyncio.shield(fut)
         except asyncio.CancelledError:
-            return
+            await fut   # 關機：等這批寫完，避免與 journal_close 同時使用連線
+            raise
         except Exception:
-            return
+            traceback.print_exc()
+            continue
+        JOURNAL_FLUSH_SECONDS.observe(time.perf_counter() - t0)
+        JOURNAL_RECORDS.inc(len(batch))
+
+async def journal_close():
+    global journal
+    if journal:
+        await asyncio.to_thread(journal.close, journal.take())
+        journal = None
+
+# ===== 換版交接 =====
+# 不中斷進行中的對局換版：舊 worker 收到 DRAIN_SIGNAL（預設 SIGUSR2）就進入 drain，不再開新房並走正常關閉；
+# gunicorn 的 HUP（先起新 worker、再對舊 worker 送 TERM）也走同一條關閉流程。關閉時：
+#   1. 日誌寫完並關閉；停掉房間 actor，之後狀態不再變動
+#   2. 全部房間完整序列化：座位、Game.dump()（發言順序、目前發言者、本輪的票）、Deck 位置、計時剩餘、重連緩衝
+#   3. 通知仍連著的玩家/觀眾 reconnect，在 handoff-<編號>.sock 等接手者，然後放掉 worker 編號與 IPC socket
+#   4. 新 worker 搶到同一個編號後先連上來取走狀態、回 ok，才開始收連線；玩家帶 token 重連回到原座位，
+#      重連緩衝也一併帶過來，前端只補收漏掉的事件
+# 有進行中的房間時最多等接手者 HANDOFF_WAIT 秒（單一 process：先送 SIGUSR2、再啟動新版即可；
+# gunicorn：kill -HUP <master>）。沒人接手就照常結束，房間留在日誌裡，下次啟動依日誌恢復。
+DRAIN_SIGNAL = signal.SIGUSR2
+HANDOFF_WAIT = float(os.environ.get("HANDOFF_WAIT", "10"))
+
+draining = False
+
+def handoff_path(index: int) -> str:
+    return os.path.join(IPC_DIR, f"handoff-{index}.sock")
+
+def room_state(r: Room, now: float) -> dict:
+    return {
+        "id": r.id, "setup": r.setup, "host": r.host,
+        "players": [[p.cid, p.slot, p.name, p.token] for p in r.clients.values()],
+        "seats": len(r.seats),
+        "game": r.game.dump(),
+        "deck": [r.deck.size, r.deck.drawn, list(r.deck.swaps.items())],
+        "last_pair": list(r.last_pair) if r.last_pair else None,
+        "timer": max(0.0, r.timer.when - now) if r.timer else None,
+        "roster_ver": r.roster_ver, "seq": r.seq,
+        "history": [f.payload for f in r.history or ()],
+        "record": r.record,
+    }
 
-    r["timer_task"] = asyncio.create_task(timer())
+def load_room(st: dict) -> Room:
+    r = setup_room(st["id"], st["setup"], st["host"])
+    seat_offline(r, st["players"])
+    r.seats.extend([None] * (st["seats"] - len(r.seats)))
+    r.game.load(st["game"])     # 蓋掉 seat 時的預設狀態
+    size, drawn, swaps = st["deck"]
+    if r.deck.size == size:
+        r.deck.drawn = drawn
+        r.deck.swaps = dict(swaps)
+    r.last_pair = tuple(st["last_pair"]) if st["last_pair"] else None
+    r.roster_ver = st["roster_ver"]
+    r.seq = st["seq"]
+    if st["history"]:
+        r.history = deque((Frame(payload) for payload in st["history"]), maxlen=RESUME_BUFFER)
+    r.record = st.get("record")
+    if st["timer"] is not None:
+        r.timer = scheduler.call_later(st["timer"], post_timeout, r)
+    r.actor = asyncio.create_task(room_actor(r))
+    return r
+
+def request_drain():
+    global draining
+    if draining:
+        return
+    draining = True
+    mark_draining()
+    print(f"[handoff] drain requested; rooms go to the next process that claims worker {backend.index}")
+    os.kill(os.getpid(), signal.SIGTERM)    # 走 uvicorn 的正常關閉：先停止接受連線
 
-async def cancel_timer(room_id: str):
-    r = rooms.get(room_id)
-    if not r: return
-    r["speak_token"] = None
-    task = r.get("timer_task")
-    if task and not task.done():
-        task.cancel()
-        try:
-            await task
-        except:
-            pass
-    r["timer_task"] = None
+def install_drain_signal():
+    try:
+        asyncio.get_running_loop().add_signal_handler(DRAIN_SIGNAL, request_drain)
+    except (ValueError, RuntimeError, NotImplementedError):
+        pass    # 不在主執行緒（例如測試內嵌）：只能靠一般關閉流程交接
 
-async def reveal_all(room_id: str):
-    """NEW: 廣播全體玩家身份與詞語，用於前端彈窗顯示 10 秒"""
-    r = rooms.get(room_id)
-    if not r: return
-    pair = r["pair"]
-    uc_ids = set(r["undercover_ids"])
-    uc_count = len(uc_ids)
-    detail = []
-    for pcid, info in r["clients"].items():
-        role = "undercover" if pcid in uc_ids else "civilian"
-        word = pair[1] if role == "undercover" else pair[0]
-        detail.append({
-            "name": info["name"],
-            "role": role,
-            "word": word
-        })
-    payload = {
-        "type": "reveal",
-        "uc_count": uc_count,
-        "civil_word": pair[0],
-        "uc_word": pair[1],
-        "players": detail
-    }
-    await broadcast(room_id, payload)
+def mark_draining():
+    """讓排隊中的新 process 知道這是換版，等編號放出來（見 claim_index）。"""
+    if backend.lock_fd is None:
+        return
+    try:
+        open(drain_marker(IPC_DIR, backend.index), "a").close()
+    except OSError:
+        pass
+
+async def drain():
+    global draining
+    draining = True
+    mark_draining()
+    await journal_close()
+    await history_close()   # 接手者會開同一個歷史檔：先寫完並存好 rollup
+    live = [r for r in rooms.values() if r.setup and r.clients]
+    if not live or not RESUME_GRACE:
+        return
+    loop = asyncio.get_running_loop()
+    now = loop.time()
+    for r in rooms.values():
+        if r.actor:
+            r.actor.cancel()
+    blob = json.dumps({"rooms": [room_state(r, now) for r in live]}, ensure_ascii=False).encode()
+    # uvicorn 已先關掉本機連線；經 IPC 連進來的玩家與觀眾在這裡通知重連
+    for r in live:
+        for p in r.clients.values():
+            if p.out is not OFFLINE:
+                send_to(p.out, {"type":"reconnect"})
+        if r.audience:
+            for out in r.audience.viewers.values():
+                send_to(out, {"type":"reconnect"})
+    for out in list(connections.values()):
+        send_to(out, {"type":"reconnect"})
+        out.close(drain=True, code=1012)
+
+    taken = loop.create_future()
+    async def give(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            if taken.done():
+                return
+            writer.write(blob)
+            writer.write_eof()
+            await writer.drain()
+            ok = await reader.readline() == b"ok\n"
+            if not taken.done():
+                taken.set_result(ok)
+        except Exception as e:
+            print(f"[handoff] transfer failed: {e}")
+        finally:
+            writer.close()
+
+    path = handoff_path(backend.index)
+    if os.path.exists(path):
+        os.unlink(path)
+    server = await asyncio.start_unix_server(give, path)
+    await backend.stop()    # 放掉編號：排隊中的新 worker 會搶到它並連上來
+    t0 = time.perf_counter()
+    try:
+        ok = await asyncio.wait_for(taken, HANDOFF_WAIT)
+    except asyncio.TimeoutError:
+        ok = False
+    server.close()
+    if os.path.exists(path):
+        os.unlink(path)
+    if ok:
+        print(f"[handoff] {len(live)} rooms ({len(blob)} bytes) handed off in {time.perf_counter() - t0:.3f}s")
+    else:
+        print(f"[handoff] no replacement took over; {len(live)} rooms left to the journal")
+
+async def handoff_receive():
+    path = handoff_path(backend.index)
+    if not os.path.exists(path):
+        return
+    try:
+        reader, writer = await asyncio.open_unix_connection(path)
+    except OSError:
+        os.unlink(path)     # 上一代已經結束，留下的 socket 檔
+        return
+    t0 = time.perf_counter()
+    try:
+        state = json.loads(await reader.read())
+        loaded = 0
+        for st in state["rooms"]:
+            try:
+                load_room(st)
+                loaded += 1
+            except Exception:
+                traceback.print_exc()
+                rooms.pop(st["id"], None)
+        writer.write(b"ok\n")
+        await writer.drain()
+        print(f"[handoff] took over {loaded} rooms in {time.perf_counter() - t0:.3f}s")
+    except Exception as e:
+        print(f"[handoff] receive failed: {e}")
+    finally:
+        writer.close()
+
+# ===== 對局歷史 =====
+# 每局結束把整局紀錄（詞對、每人身份、每次開票的票、淘汰順序、平票次數、回合數、勝方）交給 history.py：
+# event loop 上只 append；每 HISTORY_FLUSH 秒整批附加到 history-<編號>.jsonl（背景執行緒），同時累加進 rollup。
+# GET /stats、/stats/pairs 只讀 rollup（成本與詞對數有關，與局數無關），不掃原始紀錄。
+# 其他 worker 的部分讀它們最近存下的 rollup-<編號>.json（每 HISTORY_ROLLUP_SAVE 秒存一次，最多落後這麼久）。
+# 只收完整打完的局：由日誌恢復（回合層級、沒有前面的票）的局不列入；交接則連同進行中的紀錄一起帶過去。
+# UC_HISTORY_DIR 設為空字串即停用。
+HISTORY_DIR = os.environ.get("UC_HISTORY_DIR", "/tmp/undercover-history")
+HISTORY_FLUSH = float(os.environ.get("HISTORY_FLUSH", "1"))
+HISTORY_ROLLUP_SAVE = float(os.environ.get("HISTORY_ROLLUP_SAVE", "10"))
+STATS_SORT = {
+    "games": lambda e: e[GAMES],
+    "undercover_win_rate": lambda e: e[UC_WINS] / e[GAMES],
+    "civilian_win_rate": lambda e: 1 - e[UC_WINS] / e[GAMES],
+}
+
+history_store = None    # HistoryStore；停用時為 None
+peer_rollups = {}       # 其他 worker 的 rollup 檔 -> (mtime, rollup)
+
+def record_events(r: Room, events: list):
+    g = r.game
+    rec = r.record
+    for ev in events:
+        kind = ev[0]
+        if kind == "started":
+            rec = r.record = {
+                "room": r.id, "session": g.session, "started": round(time.time(), 3), "pair": list(g.pair),
+                "players": [[p.slot, p.name, g.role(p.slot)] for p in r.clients.values()],
+                "votes": [], "eliminated": [], "ties": 0,
+            }
+        elif rec is None:
+            continue
+        elif kind == "vote_result":
+            rec["votes"].append(ev[1])
+        elif kind == "tie":
+            rec["ties"] += 1
+        elif kind == "eliminated":
+            rec["eliminated"].append(ev[1])
+        elif kind == "gameover":
+            rec.update(ended=round(time.time(), 3), rounds=g.round, winner=ev[1])
+            history_store.append(rec)
+            rec = r.record = None
+        elif kind == "reset":
+            rec = r.record = None   # 沒打完就重置：不記
+
+async def history_open():
+    global history_store
+    if not HISTORY_DIR:
+        return
+    os.makedirs(HISTORY_DIR, exist_ok=True)
+    index = getattr(backend, "index", None) or 0
+    store = HistoryStore(HISTORY_DIR, index)
+    rollup = await asyncio.to_thread(store.open)
+    history_store = store
+    print(f"[history] {store.log_path}: {rollup['total'][GAMES]} games")
+
+async def history_loop():
+    saved, saved_at = history_store.rollup["total"][GAMES], time.monotonic()
+    while True:
+        await asyncio.sleep(HISTORY_FLUSH)
+        if history_store.buffer:
+            batch = history_store.take()
+            t0 = time.perf_counter()
+            fut = asyncio.ensure_future(asyncio.to_thread(history_store.write, batch))
+            try:
+                await asyncio.shield(fut)
+            except asyncio.CancelledError:
+                await fut   # 關機：等這批寫完，history_close 才存 rollup
+                raise
+            except Exception:
+                traceback.print_exc()
+                continue
+            HISTORY_FLUSH_SECONDS.observe(time.perf_counter() - t0)
+            HISTORY_GAMES.inc(len(batch))
+        games = history_store.rollup["total"][GAMES]
+        if games != saved and time.monotonic() - saved_at >= HISTORY_ROLLUP_SAVE:
+            # 序列化在 loop 上（此時沒有寫入進行），寫檔在執行緒
+            await asyncio.to_thread(history_store.save_rollup, history_store.rollup_text())
+            saved, saved_at = games, time.monotonic()
+
+async def history_close():
+    global history_store
+    if history_store:
+        store, history_store = history_store, None
+        await asyncio.to_thread(store.close, store.take())
+
+def load_peer_rollups() -> list:
+    own = history_store.rollup_path
+    found = []
+    for name in os.listdir(HISTORY_DIR):
+        path = os.path.join(HISTORY_DIR, name)
+        if not (name.startswith("rollup-") and name.endswith(".json")) or path == own:
+            continue
+        try:
+            mtime = os.stat(path).st_mtime_ns
+            hit = peer_rollups.get(path)
+            if not hit or hit[0] != mtime:
+                with open(path, encoding="utf-8") as f:
+                    hit = peer_rollups[path] = (mtime, json.load(f))
+        except (OSError, ValueError):
+            continue
+        found.append(hit[1])
+    return found
+
+async def stats_rollup() -> dict:
+    """本 worker 的即時 rollup 加上其他 worker 存下的 rollup（包括 worker 數改小前留下的）。"""
+    peers = await asyncio.to_thread(load_peer_rollups)
+    if not peers:
+        return history_store.rollup
+    merged = new_rollup()
+    for rollup in [history_store.rollup, *peers]:
+        merge_rollup(merged, rollup)
+    return merged
+
+def query_int(q, key: str, default: int, lo: int, hi: int) -> int | None:
+    try:
+        return min(max(int(q.get(key, default)), lo), hi)
+    except ValueError:
+        return None
+
+@app.get("/stats")
+async def stats():
+    if not history_store:
+        return JSONResponse({"error": "history disabled"}, status_code=404)
+    rollup = await stats_rollup()
+    by_players = sorted(rollup["players"].items(), key=lambda kv: int(kv[0]))
+    return JSONResponse({**summarize(rollup["total"]), "pairs": len(rollup["pairs"]),
+                         "by_players": {n: summarize(e) for n, e in by_players}})
+
+@app.get("/stats/pairs")
+async def stats_pairs(request: Request):
+    """?sort=games|undercover_win_rate|civilian_win_rate&limit=50&min_games=1：前 limit 個詞對。"""
+    if not history_store:
+        return JSONResponse({"error": "history disabled"}, status_code=404)
+    q = request.query_params
+    key = STATS_SORT.get(q.get("sort", "games"))
+    if not key:
+        return JSONResponse({"error": f"sort must be one of {', '.join(STATS_SORT)}"}, status_code=400)
+    limit = query_int(q, "limit", 50, 1, 1000)
+    min_games = query_int(q, "min_games", 1, 1, 1 << 30)
+    if limit is None or min_games is None:
+        return JSONResponse({"error": "limit and min_games must be integers"}, status_code=400)
+    rollup = await stats_rollup()
+    rows = ((k, e) for k, e in rollup["pairs"].items() if e[GAMES] >= min_games)
+    top = heapq.nlargest(limit, rows, key=lambda kv: (key(kv[1]), kv[1][GAMES]))
+    return JSONResponse({"pairs": [dict(zip(("civil_word", "uc_word"), k.split("\t", 1)), **summarize(e))
+                                   for k, e in top]})
 
 # ===== 前端（新增結束彈窗 reveal、開始時顯示臥底人數） =====
-HTML = """
-<!doctype html>
-<html>
-<head>
-<meta charset="utf-8"/>
-<title>誰是臥底 · 多臥底版</title>
-<style>
+CSS = """
   body{background:#fff;font-family:-apple-system,BlinkMacSystemFont,Segoe UI,Roboto,"PingFang TC","Microsoft JhengHei",Arial,sans-serif;margin:0}
   #app{max-width:960px;margin:0 auto;padding:20px}
   .hidden{display:none}
@@ -613,104 +2569,19 @@ HTML = """
   #modal .sub{color:#64748b;margin-bottom:10px}
   #modal .row{padding:6px 0;border-bottom:1px dashed #e5e7eb}
   #modal .row:last-child{border-bottom:0}
-</style>
-</head>
-<body>
-<div id="app">
-  <div id="toast"></div>
-
-  <!-- NEW: 結束彈窗 -->
-  <div id="modalMask">
-    <div id="modal">
-      <h3>本局結果</h3>
-      <div class="sub" id="modalDesc"></div>
-      <div id="modalBody"></div>
-    </div>
-  </div>
-
-  <div class="card" id="screen-entry">
-    <h2>誰是臥底 · 多臥底版</h2>
-    <button id="goHost" type="button">我是 Host</button>
-    <button id="goPlayer" type="button" class="ghost">我是 Player</button>
-  </div>
-
-  <div class="card hidden" id="screen-host">
-    <h3>建立房間</h3>
-    暱稱 <input id="h-name" placeholder="Host 名稱"/>
-    房號 <input id="h-room" placeholder="輸入房號"/>
-    <div><label><input type="checkbox" id="h-useBuiltin" checked> 包含內建清單</label></div>
-    <div><label><input type="checkbox" id="h-limit20"> 是否限制發言時間為 20 秒</label></div>
-    <div><textarea id="h-custom" rows="5" cols="40" placeholder="自訂題庫：每行一組，用逗號分隔（例：西瓜,哈蜜瓜）"></textarea></div>
-    <div>
-      <button id="h-create" type="button">建立房間並進入大廳</button>
-      <button id="h-back" type="button" class="ghost">返回</button>
-    </div>
-  </div>
-
-  <div class="card hidden" id="screen-join">
-    <h3>加入房間</h3>
-    暱稱 <input id="p-name" placeholder="你的名稱"/>
-    房號 <input id="p-room" placeholder="輸入房號"/>
-    <div>
-      <button id="p-join" type="button">加入</button>
-      <button id="p-back" type="button" class="ghost">返回</button>
-    </div>
-  </div>
-
-  <div class="card hidden" id="screen-lobby">
-    <div><b>狀態：</b><span id="lblStatus" class="muted">尚未開始</span>　
-         <b>回合：</b><span id="lblRound">0</span></div>
-    <div id="players" style="margin-top:6px; position:relative;"></div>
-
-    <!-- Host玩家選單 -->
-    <div id="playerMenu">
-      <button id="btnKick">踢出該玩家</button>
-      <button id="btnMenuClose">關閉</button>
-    </div>
-
-    <div id="hostPanel" class="hidden" style="margin:8px 0;">
-      <button id="btnStart" type="button">開始遊戲</button>
-      <button id="btnOpenVote" type="button" class="ghost">開始投票</button>
-      <button id="btnNextRound" type="button" class="ghost">下一回合</button>
-      <button id="btnReset" type="button" class="ghost">重新開始</button>
-    </div>
-
-    <div class="card">
-      <div><b>你的詞：</b><span id="myWord" class="pill muted">尚未分配</span></div>
-      <div style="margin-top:6px;">
-        <input id="sayText" placeholder="說一句描述，不要暴雷～" style="width:70%;"/>
-        <button id="btnSay" type="button">送出</button>
-      </div>
-    </div>
-
-    <div class="flex">
-      <div class="box card">
-        <div class="muted">玩家聊天（依局分區）</div>
-        <div id="chat" class="log"></div>
-      </div>
-      <div class="box card">
-        <div class="muted">系統訊息（依局分區）</div>
-    <div id="syslog" class="log"></div>
-      </div>
-    </div>
-
-    <div class="card hidden" id="votePanel">
-      <div><b>投票淘汰</b></div>
-      <div>
-        <select id="voteSelect"></select>
-        <button id="btnVote" type="button">投票</button>
-        <span id="voteInfo" class="muted"></span>
-      </div>
-      <div id="voteDetail" class="muted" style="margin-top:8px;"></div>
-    </div>
-  </div>
-</div>
+"""
 
-<script>
+APP_JS = """
 window.onload = function(){
   let ws=null, myName="", myRoom="", isHost=false, meAlive=true;
   let currentSession = 0;
+  // 名單：完整快照 + 帶版本號的增量
+  let roster = new Map(), rosterVer = 0, rosterSyncing = false;
   let toastTimer = null;
+  // 斷線重連：resume token 與最後收到的廣播序號
+  let resumeToken = null, lastSeq = 0, retries = 0, handoff = false;
+  // 觀戰：不入座，斷線後重新 watch_room 即可
+  let spectating = false;
 
   // Host 踢人選單狀態
   let menuVisible=false, menuTargetCid=null;
@@ -748,31 +2619,84 @@ window.onload = function(){
     modalTimer = setTimeout(()=>{ el("modalMask").style.display="none"; }, 10000);
   }
 
+  // 瀏覽器支援 deflate-raw 才宣告 z=1，伺服器會把大訊息壓縮後以二進位 frame 送來
+  const canInflate = typeof DecompressionStream !== "undefined";
+  function wsUrl(){ return (location.protocol==="https:"?"wss":"ws")+"://"+location.host+"/ws?batch=1"+(canInflate?"&z=1":""); }
+  function inflate(buf){
+    return new Response(new Blob([buf]).stream().pipeThrough(new DecompressionStream("deflate-raw"))).text();
+  }
+
+  // 開連線；first() 產生連上後的第一則訊息。非預期斷線時帶 token 與 seq 自動重連
+  function connect(first){
+    ws = new WebSocket(wsUrl());
+    ws.binaryType = "arraybuffer";
+    ws.onopen = ()=>{ retries = 0; ws.send(JSON.stringify(first())); };
+    ws.onmessage = onMsg;
+    ws.onclose = ()=>{
+      if(!resumeToken && !spectating) return;
+      if(retries >= 8){ addSys("<span class='danger'>無法重新連線，請重新整理頁面。</span>"); return; }
+      // 伺服器換版：狀態已交給新版，打散一下馬上重連；其他斷線照指數退避
+      const delay = handoff ? Math.random() * 250 : Math.min(500 * 2 ** retries, 8000);
+      if(retries++ === 0 && !handoff) addSys("連線中斷，重新連線中…");
+      handoff = false;
+      setTimeout(()=>connect(()=>spectating ? {type:"watch_room", room:myRoom}
+                                            : {type:"resume", room:myRoom, token:resumeToken, seq:lastSeq}), delay);
+    };
+  }
+
   // 入口
   el("goHost").onclick = ()=> show("screen-host");
   el("h-back").onclick = ()=> show("screen-entry");
   el("goPlayer").onclick = ()=> show("screen-join");
   el("p-back").onclick = ()=> show("screen-entry");
 
+  // 上傳題庫檔（CSV / JSONL），回傳共用題庫 id；上傳期間輪詢進度
+  async function uploadPool(file){
+    const token = Math.random().toString(36).slice(2);
+    const fmt = /\\.jsonl?$/i.test(file.name) ? "jsonl" : "csv";
+    const status = el("h-fileStatus");
+    const poll = setInterval(async ()=>{
+      try{
+        const r = await fetch(`/pools/progress/${token}`);
+        if(r.ok){ const s = await r.json(); status.textContent = `上傳中…已讀 ${s.lines} 行，收錄 ${s.accepted} 組`; }
+      }catch(e){}
+    }, 500);
+    try{
+      const r = await fetch(`/pools?fmt=${fmt}&upload=${token}&name=${encodeURIComponent(file.name)}`, {method:"POST", body:file});
+      const s = await r.json();
+      if(!r.ok){ status.textContent = `上傳失敗：${s.error}`; return null; }
+      status.textContent = `${s.name}：收錄 ${s.size} 組（重複 ${s.duplicates}、內建已有 ${s.builtin}、格式不符 ${s.invalid}）`;
+      return s.id;
+    }finally{
+      clearInterval(poll);
+    }
+  }
+
   // 建房
-  el("h-create").onclick = ()=>{
+  el("h-create").onclick = async ()=>{
     myName = el("h-name").value.trim() || "Host";
     myRoom = el("h-room").value.trim() || Math.random().toString(36).slice(2,8);
     isHost = true;
 
+    const file = el("h-file").files[0];
+    const poolIds = [];
+    if(file){
+      const id = await uploadPool(file);
+      if(!id) return;
+      poolIds.push(id);
+    }
     const lines = el("h-custom").value.split("\\n").map(s=>s.trim()).filter(s=>s.includes(",")).map(s=>s.split(",").map(x=>x.trim()));
-    ws = new WebSocket((location.protocol==="https:"?"wss":"ws")+"://"+location.host+"/ws");
-    ws.onopen = ()=>{
-      ws.send(JSON.stringify({
-        type:"create_room_setup",
-        name:myName, room:myRoom,
-        use_builtin: el("h-useBuiltin").checked,
-        custom_list: lines,
-        limit_20s: el("h-limit20").checked
-      }));
-      show("screen-lobby"); setControlsVisible(true);
-    };
-    ws.onmessage = onMsg;
+    connect(()=>({
+      type:"create_room_setup",
+      name:myName, room:myRoom,
+      use_builtin: el("h-useBuiltin").checked,
+      custom_list: lines,
+      pool_ids: poolIds,
+      speak_seconds: +el("h-speakSec").value,
+      vote_seconds: +el("h-voteSec").value,
+      early_settle: el("h-early").checked
+    }));
+    show("screen-lobby"); setControlsVisible(true);
   };
 
   // 入房
@@ -780,12 +2704,17 @@ window.onload = function(){
     myName = el("p-name").value.trim() || "玩家";
     myRoom = el("p-room").value.trim();
     isHost = false;
-    ws = new WebSocket((location.protocol==="https:"?"wss":"ws")+"://"+location.host+"/ws");
-    ws.onopen = ()=>{
-      ws.send(JSON.stringify({type:"join_room", name:myName, room:myRoom}));
-      show("screen-lobby"); setControlsVisible(false);
-    };
-    ws.onmessage = onMsg;
+    connect(()=>({type:"join_room", name:myName, room:myRoom}));
+    show("screen-lobby"); setControlsVisible(false);
+  };
+
+  // 觀戰：只看不玩，隱藏自己的詞、發言與投票操作
+  el("p-watch").onclick = ()=>{
+    myRoom = el("p-room").value.trim();
+    isHost = false; spectating = true;
+    connect(()=>({type:"watch_room", room:myRoom}));
+    show("screen-lobby"); setControlsVisible(false);
+    ["myCard","voteSelect","btnVote"].forEach(id=>el(id).classList.add("hidden"));
   };
 
   // 控制
@@ -859,34 +2788,90 @@ window.onload = function(){
     }
   }
 
+  function setStatus(status, round){
+    el("lblStatus") && (el("lblStatus").textContent = status);
+    el("lblRound") && (el("lblRound").textContent = round);
+  }
+  function renderPlayers(){
+    const box = el("players");
+    box.innerHTML = "";
+    roster.forEach(p=>{
+      const span = document.createElement("span");
+      span.className = "pill"+(p.alive?"":" danger")+(p.is_host?" host":"")+(isHost?" clickable":"");
+      span.textContent = p.name + (p.is_host?"(Host)":"");
+      span.dataset.cid = p.cid;
+      if(isHost){
+        span.onclick = (e)=>{
+          const rect = box.getBoundingClientRect();
+          const x = e.clientX - rect.left;
+          const y = e.clientY - rect.top;
+          if(p.is_host) return;
+          showMenu(x, y, p.cid);
+        };
+      }
+      box.appendChild(span);
+    });
+  }
+
+  // 伺服器可能把同一批訊息併成陣列送來；解壓是非同步的，用 promise 串起來保持順序
+  let msgChain = Promise.resolve();
   function onMsg(ev){
-    const m = JSON.parse(ev.data);
+    msgChain = msgChain
+      .then(()=> typeof ev.data === "string" ? ev.data : inflate(ev.data))
+      .then(text=>{
+        const data = JSON.parse(text);
+        if(Array.isArray(data)) data.forEach(handleMsg);
+        else handleMsg(data);
+      })
+      .catch(err=>console.error(err));
+  }
+
+  function handleMsg(m){
+    if(m.type==="ping"){ ws && ws.readyState === 1 && ws.send('{"type":"pong"}'); return; }
+    // 廣播帶序號：重連補送時可能與已收到的重疊，舊的直接略過
+    if(m.seq){
+      if(m.seq <= lastSeq) return;
+      lastSeq = m.seq;
+    }
+
+    if(m.type==="resume_token"){ resumeToken = m.token; }
+    if(m.type==="watching"){ addSys("觀戰中（房號 "+m.room+"）。"); }
+    if(m.type==="resumed"){ addSys(m.mode==="replay" ? "已重新連線。" : "已重新連線（重新同步目前狀態）。"); }
+    if(m.type==="reconnect"){ handoff = true; addSys("伺服器更新中，重新連線…"); return; }
+    if(m.type==="resume_failed"){
+      resumeToken = null;
+      alert("無法回到原房間（房間已關閉或座位已釋出）。");
+      location.reload();
+    }
 
     if(m.type==="status"){ addSys(m.msg, m.session || null); }
     if(m.type==="hint"){ toast(m.msg, m.duration || 3000); }
     if(m.type==="error"){ addSys("<span class='danger'>"+m.msg+"</span>", m.session || null); }
 
     if(m.type==="room"){
-      el("lblStatus") && (el("lblStatus").textContent = m.status);
-      el("lblRound") && (el("lblRound").textContent = m.round);
-      const box = el("players");
-      box.innerHTML = "";
-      (m.players || []).forEach(p=>{
-        const span = document.createElement("span");
-        span.className = "pill"+(p.alive?"":" danger")+(p.is_host?" host":"")+(isHost?" clickable":"");
-        span.textContent = p.name + (p.is_host?"(Host)":"");
-        span.dataset.cid = p.cid;
-        if(isHost){
-          span.onclick = (e)=>{
-            const rect = box.getBoundingClientRect();
-            const x = e.clientX - rect.left;
-            const y = e.clientY - rect.top;
-            if(p.is_host) return;
-            showMenu(x, y, p.cid);
-          };
-        }
-        box.appendChild(span);
-      });
+      roster = new Map((m.players || []).map(p=>[p.cid, p]));
+      rosterVer = m.v || 0; rosterSyncing = false;
+      lastSeq = m.at || 0;
+      setStatus(m.status, m.round);
+      renderPlayers();
+    }
+
+    if(m.type==="roster"){
+      if(m.v <= rosterVer) return;
+      if(m.v !== rosterVer + 1){
+        // 漏了增量：要一次完整快照
+        if(!rosterSyncing){ rosterSyncing = true; ws.send(JSON.stringify({type:"roster_sync"})); }
+        return;
+      }
+      rosterVer = m.v;
+      if(m.op==="player_joined"){ roster.set(m.player.cid, m.player); }
+      if(m.op==="player_left"){ roster.delete(m.cid); }
+      if(m.op==="player_eliminated"){ const p = roster.get(m.cid); if(p) p.alive = false; }
+      if(m.op==="status_changed"){
+        if(m.reset) roster.forEach(p=>{ p.alive = true; });
+        setStatus(m.status, m.round);
+      }
+      renderPlayers();
     }
 
     if(m.type==="chat_session"){ ensureChatSection(m.session); }
@@ -895,11 +2880,18 @@ window.onload = function(){
     if(m.type==="you_are"){
       el("myWord").textContent = m.word;
       el("myWord").classList.remove("muted");
-      meAlive = true;
-      el("sayText").disabled = false; el("btnSay").disabled = false;
+      meAlive = m.alive !== false;
+      el("sayText").disabled = !meAlive; el("btnSay").disabled = !meAlive;
+    }
+
+    if(m.type==="room_closed"){
+      alert(spectating ? "房間已關閉。" : "房間閒置過久，已關閉。");
+      resumeToken = null; spectating = false;
+      location.reload();
     }
 
     if(m.type==="kicked"){
+      resumeToken = null;
       alert("你已被 Host 踢出房間。");
       location.reload();
     }
@@ -939,12 +2931,12 @@ window.onload = function(){
         sel.appendChild(opt);
       });
       setVoteVisible(true);
-      el("voteInfo").textContent = "投票中...";
+      el("voteInfo").textContent = m.seconds ? `投票中...（限時 ${m.seconds} 秒）` : "投票中...";
       el("voteDetail").textContent = "";
     }
 
     if(m.type==="vote_ack"){
-      el("voteInfo").textContent = "你已投票，等待他人...";
+      el("voteInfo").textContent = (m.changed ? "已改票" : "你已投票") + "，等待他人...（結算前可改票）";
     }
 
     if(m.type==="vote_result"){
@@ -976,10 +2968,184 @@ window.onload = function(){
     }
   }
 };
-</script>
+"""
+
+HTML = """
+<!doctype html>
+<html>
+<head>
+<meta charset="utf-8"/>
+<title>誰是臥底 · 多臥底版</title>
+<link rel="stylesheet" href="__CSS_URL__"/>
+<script src="__JS_URL__" defer></script>
+</head>
+<body>
+<div id="app">
+  <div id="toast"></div>
+
+  <!-- NEW: 結束彈窗 -->
+  <div id="modalMask">
+    <div id="modal">
+      <h3>本局結果</h3>
+      <div class="sub" id="modalDesc"></div>
+      <div id="modalBody"></div>
+    </div>
+  </div>
+
+  <div class="card" id="screen-entry">
+    <h2>誰是臥底 · 多臥底版</h2>
+    <button id="goHost" type="button">我是 Host</button>
+    <button id="goPlayer" type="button" class="ghost">我是 Player</button>
+  </div>
+
+  <div class="card hidden" id="screen-host">
+    <h3>建立房間</h3>
+    暱稱 <input id="h-name" placeholder="Host 名稱" maxlength="40"/>
+    房號 <input id="h-room" placeholder="輸入房號" maxlength="64"/>
+    <div><label><input type="checkbox" id="h-useBuiltin" checked> 包含內建清單</label></div>
+    <div>發言時限
+      <select id="h-speakSec">
+        <option value="0">不限</option><option value="15">15 秒</option><option value="20">20 秒</option>
+        <option value="30">30 秒</option><option value="45">45 秒</option><option value="60">60 秒</option>
+      </select>
+      投票時限
+      <select id="h-voteSec">
+        <option value="0">不限</option><option value="30">30 秒</option><option value="60">60 秒</option><option value="90">90 秒</option>
+      </select>
+      <label><input type="checkbox" id="h-early"> 勝負已定時提前結算投票（只看未投的票，已投的票不再能改）</label>
+    </div>
+    <div><textarea id="h-custom" rows="5" cols="40" placeholder="自訂題庫：每行一組，用逗號分隔（例：西瓜,哈蜜瓜）"></textarea></div>
+    <div>或上傳題庫檔 <input type="file" id="h-file" accept=".csv,.txt,.jsonl,.json"/> <span id="h-fileStatus" class="muted"></span></div>
+    <div>
+      <button id="h-create" type="button">建立房間並進入大廳</button>
+      <button id="h-back" type="button" class="ghost">返回</button>
+    </div>
+  </div>
+
+  <div class="card hidden" id="screen-join">
+    <h3>加入房間</h3>
+    暱稱 <input id="p-name" placeholder="你的名稱" maxlength="40"/>
+    房號 <input id="p-room" placeholder="輸入房號" maxlength="64"/>
+    <div>
+      <button id="p-join" type="button">加入</button>
+      <button id="p-watch" type="button" class="ghost">觀戰</button>
+      <button id="p-back" type="button" class="ghost">返回</button>
+    </div>
+  </div>
+
+  <div class="card hidden" id="screen-lobby">
+    <div><b>狀態：</b><span id="lblStatus" class="muted">尚未開始</span>　
+         <b>回合：</b><span id="lblRound">0</span></div>
+    <div id="players" style="margin-top:6px; position:relative;"></div>
+
+    <!-- Host玩家選單 -->
+    <div id="playerMenu">
+      <button id="btnKick">踢出該玩家</button>
+      <button id="btnMenuClose">關閉</button>
+    </div>
+
+    <div id="hostPanel" class="hidden" style="margin:8px 0;">
+      <button id="btnStart" type="button">開始遊戲</button>
+      <button id="btnOpenVote" type="button" class="ghost">開始投票</button>
+      <button id="btnNextRound" type="button" class="ghost">下一回合</button>
+      <button id="btnReset" type="button" class="ghost">重新開始</button>
+    </div>
+
+    <div class="card" id="myCard">
+      <div><b>你的詞：</b><span id="myWord" class="pill muted">尚未分配</span></div>
+      <div style="margin-top:6px;">
+        <input id="sayText" placeholder="說一句描述，不要暴雷～" maxlength="500" style="width:70%;"/>
+        <button id="btnSay" type="button">送出</button>
+      </div>
+    </div>
+
+    <div class="flex">
+      <div class="box card">
+        <div class="muted">玩家聊天（依局分區）</div>
+        <div id="chat" class="log"></div>
+      </div>
+      <div class="box card">
+        <div class="muted">系統訊息（依局分區）</div>
+    <div id="syslog" class="log"></div>
+      </div>
+    </div>
+
+    <div class="card hidden" id="votePanel">
+      <div><b>投票淘汰</b></div>
+      <div>
+        <select id="voteSelect"></select>
+        <button id="btnVote" type="button">投票</button>
+        <span id="voteInfo" class="muted"></span>
+      </div>
+      <div id="voteDetail" class="muted" style="margin-top:8px;"></div>
+    </div>
+  </div>
+</div>
 </body>
 </html>
 """
 
+# ===== 靜態資源 =====
+# 啟動時把前端各編碼一次（gzip，裝了 brotli 再加 br），附強 ETag。
+# CSS/JS 網址帶內容雜湊，可永久快取；首頁本身 no-cache，每次以 If-None-Match 驗證，沒變回 304。
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+class Asset:
+    __slots__ = ("media_type", "cache_control", "variants")
+
+    def __init__(self, body: str, media_type: str, cache_control: str):
+        raw = body.encode()
+        digest = hashlib.sha256(raw).hexdigest()[:16]
+        self.media_type = media_type
+        self.cache_control = cache_control
+        # 編碼 -> (內容, ETag)；不同編碼是不同表示，ETag 也要不同
+        self.variants = {"identity": (raw, f'"{digest}"')}
+        self.variants["gzip"] = (gzip.compress(raw, 9), f'"{digest}-gz"')
+        if brotli:
+            self.variants["br"] = (brotli.compress(raw, quality=11), f'"{digest}-br"')
+
+    @property
+    def digest(self) -> str:
+        return self.variants["identity"][1].strip('"')
+
+def pick_encoding(accept: str, variants: dict) -> str:
+    offered = set()
+    for part in accept.split(","):
+        token, _, params = part.strip().partition(";")
+        if params.replace(" ", "") in ("q=0", "q=0.0"):
+            continue
+        offered.add(token.strip().lower())
+    for enc in ("br", "gzip"):
+        if enc in variants and (enc in offered or "*" in offered):
+            return enc
+    return "identity"
+
+def asset_response(request: Request, asset: Asset) -> Response:
+    enc = pick_encoding(request.headers.get("accept-encoding", ""), asset.variants)
+    body, etag = asset.variants[enc]
+    headers = {"ETag": etag, "Cache-Control": asset.cache_control, "Vary": "Accept-Encoding"}
+    inm = request.headers.get("if-none-match")
+    if inm:
+        tags = {t.strip().removeprefix("W/") for t in inm.split(",")}
+        if "*" in tags or tags & {v[1] for v in asset.variants.values()}:
+            return Response(status_code=304, headers=headers)
+    if enc != "identity":
+        headers["Content-Encoding"] = enc
+    return Response(body, media_type=asset.media_type, headers=headers)
+
+def build_assets() -> dict:
+    css = Asset(CSS, "text/css; charset=utf-8", "public, max-age=31536000, immutable")
+    js = Asset(APP_JS, "application/javascript; charset=utf-8", "public, max-age=31536000, immutable")
+    assets = {f"app.{css.digest}.css": css, f"app.{js.digest}.js": js}
+    page = HTML.replace("__CSS_URL__", f"/static/app.{css.digest}.css").replace("__JS_URL__", f"/static/app.{js.digest}.js")
+    assets[""] = Asset(page, "text/html; charset=utf-8", "no-cache")
+    return assets
+
+ASSETS = build_assets()
+
 if __name__ == "__main__":
-    uvicorn.run("server_V2:app", host="0.0.0.0", port=8000, reload=False)
+    uvicorn.run("server_V2:app", host="0.0.0.0", port=8000, reload=False, ws_per_message_deflate=False,
+                ws_max_size=MAX_FRAME_BYTES)
@@ -0,0 +1,139 @@
+# 離線對局模擬：直接驅動 engine.Game，不開 socket，用多 process 批次跑大量對局，
+# 比較不同臥底人數公式 / 投票策略下的勝率與局長。
+# 用法：python sim.py --games 1000000 --players 4,6,8,10 --strategy skilled:0.6 --formula default
+#       python sim.py --strategy mybots:smart        # module:function 形式可接外部策略
+# 策略簽名：strategy(game, voter_slot, rng) -> 目標 slot（必須是存活者）
+# 臥底人數公式簽名：formula(n) -> 人數（engine 仍會夾在 1..n-1）
+import os, time, random, argparse, importlib
+from concurrent.futures import ProcessPoolExecutor
+from engine import Game, undercover_count
+
+MAX_VOTES = 64      # 單局投票次數上限，超過視為卡住（例如策略永遠平票）
+CHUNK = 20000       # 每個工作單位的局數
+PAIR = ("平民詞", "臥底詞")
+
+# ===== 投票策略 =====
+def vote_random(g: Game, voter: int, rng) -> int:
+    """隨機投給一位其他存活者。"""
+    return rng.choice([s for s in g.alive if s != voter])
+
+def vote_herd(g: Game, voter: int, rng) -> int:
+    """跟票：投給目前最多票的人，還沒人投就隨機。"""
+    best = next(iter(g.tally.leaders()), None)
+    if best is None or best == voter:
+        return vote_random(g, voter, rng)
+    return best
+
+def make_skilled(p: float):
+    """平民以機率 p 認出一名臥底並投他，否則隨機；臥底一律隨機投平民。"""
+    def vote_skilled(g: Game, voter: int, rng) -> int:
+        if voter in g.undercover:
+            civ = [s for s in g.alive if s not in g.undercover]
+            return rng.choice(civ)
+        if rng.random() < p:
+            uc = [s for s in g.alive if s in g.undercover]
+            if uc:
+                return rng.choice(uc)
+        return vote_random(g, voter, rng)
+    return vote_skilled
+
+STRATEGIES = {
+    "random": lambda arg: vote_random,
+    "herd": lambda arg: vote_herd,
+    "skilled": lambda arg: make_skilled(float(arg or 0.5)),
+}
+
+FORMULAS = {
+    "default": undercover_count,        # floor(n/2) - 1
+    "third": lambda n: n // 3,
+    "one": lambda n: 1,
+}
+
+def load(spec: str, table: dict, with_arg: bool):
+    """名稱查表（可帶參數，如 skilled:0.7）；查不到就當成 module:function 匯入。"""
+    name, _, arg = spec.partition(":")
+    if name in table:
+        return table[name](arg) if with_arg else table[name]
+    if not arg:
+        raise ValueError(f"unknown {spec!r}; use one of {sorted(table)} or module:function")
+    return getattr(importlib.import_module(name), arg)
+
+# ===== 跑局 =====
+def play_one(g: Game, n: int, strategy, rng) -> tuple:
+    """回傳 (勝方, 回合數, 平票數)；卡住時勝方為 None。"""
+    g.reset()
+    g.start(lambda: PAIR)
+    ties = 0
+    for _ in range(MAX_VOTES):
+        while g.status == "playing":
+            g.say(g.current_speaker())
+        events = []
+        for voter in sorted(g.alive):
+            events = g.vote(voter, strategy(g, voter, rng))
+            if g.status != "voting":
+                break   # 提前結算
+        for ev in events:
+            if ev[0] == "tie":
+                ties += 1
+            elif ev[0] == "gameover":
+                return ev[1], g.round, ties
+    return None, g.round, ties
+
+def run_chunk(job: tuple) -> dict:
+    seed, n, games, strategy_spec, formula_spec, early = job
+    rng = random.Random(seed)
+    strategy = load(strategy_spec, STRATEGIES, True)
+    g = Game(rng, load(formula_spec, FORMULAS, False), early)
+    for s in range(n):
+        g.seat(s)
+    stats = {"civilian": 0, "undercover": 0, "stalled": 0, "rounds": 0, "ties": 0}
+    for _ in range(games):
+        winner, rounds, ties = play_one(g, n, strategy, rng)
+        stats[winner or "stalled"] += 1
+        stats["rounds"] += rounds
+        stats["ties"] += ties
+    return stats
+
+def simulate(n: int, games: int, strategy: str, formula: str, early: bool, seed: int,
+             pool: ProcessPoolExecutor) -> dict:
+    # 每個 chunk 的種子由 (seed, n, chunk 編號) 決定，結果與 worker 數無關
+    jobs = []
+    for i, start in enumerate(range(0, games, CHUNK)):
+        jobs.append((hash((seed, n, i)), n, min(CHUNK, games - start), strategy, formula, early))
+    total = {"civilian": 0, "undercover": 0, "stalled": 0, "rounds": 0, "ties": 0}
+    for part in pool.map(run_chunk, jobs):
+        for k, v in part.items():
+            total[k] += v
+    return total
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="play headless games on engine.Game and report balance stats")
+    ap.add_argument("--games", type=int, default=200000, help="games per player count")
+    ap.add_argument("--players", default="4,6,8,10", help="comma separated player counts (>= 3)")
+    ap.add_argument("--strategy", default="random", help="random | herd | skilled[:p] | module:function")
+    ap.add_argument("--formula", default="default", help="default | third | one | module:function")
+    ap.add_argument("--early", action="store_true", help="settle votes as soon as the result is decided")
+    ap.add_argument("--workers", type=int, default=os.cpu_count())
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+    counts = [int(x) for x in args.players.split(",")]
+    if min(counts) < 3:
+        ap.error("--players must be >= 3")
+    try:
+        load(args.strategy, STRATEGIES, True)
+        load(args.formula, FORMULAS, False)
+    except (ValueError, ImportError, AttributeError) as e:
+        ap.error(str(e))
+
+    print(f"strategy={args.strategy} formula={args.formula} early={args.early} games={args.games:,} workers={args.workers}")
+    print(f"{'players':>7} {'uc':>3} {'civ win':>8} {'uc win':>8} {'stalled':>8} {'rounds':>7} {'ties':>6} {'games/s':>10}")
+    formula = load(args.formula, FORMULAS, False)
+    with ProcessPoolExecutor(args.workers) as pool:
+        for n in counts:
+            t0 = time.perf_counter()
+            s = simulate(n, args.games, args.strategy, args.formula, args.early, args.seed, pool)
+            dt = time.perf_counter() - t0
+            g = args.games
+            uc = max(1, min(formula(n), n - 1))
+            print(f"{n:>7} {uc:>3} {s['civilian'] / g:>8.1%} {s['undercover'] / g:>8.1%} {s['stalled'] / g:>8.2%} "
+                  f"{s['rounds'] / g:>7.2f} {s['ties'] / g:>6.2f} {g / dt:>10,.0f}")
@@ -0,0 +1,7 @@
+# 測試直接 import 專案根目錄的模組（與 bench/ 相同做法，不另建套件）。
+# server_V2 在 import 時讀環境變數：日誌/歷史停用、IPC 與題庫放暫存目錄，關閉時不等交接。
+import os, sys, tempfile
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.update(UC_JOURNAL_DIR="", UC_HISTORY_DIR="", HANDOFF_WAIT="0",
+                  UC_IPC_DIR=tempfile.mkdtemp(prefix="uc-test-ipc-"),
+                  UC_POOL_DIR=tempfile.mkdtemp(prefix="uc-test-pools-"))
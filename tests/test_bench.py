@@ -0,0 +1,9 @@
+# bench 腳本直接碰 Room / Game 內部；規模縮到最小跑一遍，內部結構改了測試就會先壞，而不是等下次量測。
+import os, sys
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "bench"))
+import room_memory
+
+def test_room_memory_builders():
+    room_memory.ROOMS = 2
+    assert room_memory.measure(room_memory.legacy_room, 10) > 0
+    assert room_memory.measure(room_memory.slots_room, 10) > 0
@@ -0,0 +1,28 @@
+# worker 編號的搶占：單一 process 遇到別的 instance 占著編號要立刻失敗，只有對方在 drain（換版）時才等。
+import os, time, asyncio, tempfile
+import pytest
+from server_V2 import claim_index, drain_marker
+
+def test_busy_slot_fails_fast_without_drain():
+    d = tempfile.mkdtemp(prefix="uc-test-claim-")
+    _, fd = asyncio.run(claim_index(d, 1, deploy_only=True))
+    try:
+        t0 = time.perf_counter()
+        with pytest.raises(RuntimeError, match="another running instance"):
+            asyncio.run(claim_index(d, 1, deploy_only=True))
+        assert time.perf_counter() - t0 < 1
+    finally:
+        os.close(fd)
+
+def test_waits_for_draining_holder():
+    d = tempfile.mkdtemp(prefix="uc-test-claim-")
+    _, fd = asyncio.run(claim_index(d, 1, deploy_only=True))
+    open(drain_marker(d, 0), "a").close()
+
+    async def replace():
+        asyncio.get_running_loop().call_later(0.3, os.close, fd)    # 舊 process 交接完放掉編號
+        return await claim_index(d, 1, deploy_only=True)
+
+    index, fd2 = asyncio.run(replace())
+    os.close(fd2)
+    assert index == 0 and not os.path.exists(drain_marker(d, 0))
@@ -0,0 +1,26 @@
+# Deck（共用題庫上的洗牌袋）：同一袋不重複、換袋時避開上一題。
+import random
+from server_V2 import Deck, register_pool
+
+def pool(n: int, tag: str):
+    return register_pool([(f"{tag}{i}a", f"{tag}{i}b") for i in range(n)], f"test-{tag}-{n}")
+
+def test_bag_has_no_repeats():
+    random.seed(1)
+    deck = Deck([pool(7, "x"), pool(5, "y")], overlay=(("o1", "o2"),))
+    assert deck.size == 13
+    for _ in range(3):
+        bag = [deck.draw() for _ in range(deck.size)]
+        assert len(set(bag)) == deck.size   # 一整袋剛好每題一次，換袋後再來一輪
+
+def test_avoid_across_refill():
+    random.seed(2)
+    deck = Deck([pool(3, "z")])
+    last = None
+    for _ in range(300):
+        pair = deck.draw(avoid=last)
+        assert pair != last
+        last = pair
+
+def test_empty_deck():
+    assert Deck([]).draw() is None
@@ -0,0 +1,80 @@
+# engine.Game 的規則回歸測試：只驅動純狀態轉移，不開 server。
+import random
+from engine import Game, Tally, SlotSet
+
+PAIR = ("平民詞", "臥底詞")
+
+def voting_game(players: int = 3) -> Game:
+    g = Game(random.Random(1))
+    for s in range(players):
+        g.seat(s)
+    g.start(lambda: PAIR)
+    g.open_vote()
+    return g
+
+def kinds(events: list) -> list:
+    return [ev[0] for ev in events]
+
+def test_join_mid_vote_waits_for_joiner():
+    g = voting_game()
+    g.seat(3)
+    events = g.vote(0, 1) + g.vote(1, 0) + g.vote(3, 1)
+    assert "vote_result" not in kinds(events)     # 2 號還沒投
+    assert g.status == "voting" and g.pending == 1
+    events = g.vote(2, 1)
+    result = next(ev for ev in events if ev[0] == "vote_result")[1]
+    assert dict(result) == {0: 1, 1: 0, 2: 1, 3: 1}
+
+def test_join_then_leave_mid_vote_keeps_pending():
+    g = voting_game()
+    g.seat(3)
+    g.unseat(3)
+    assert g.pending == 3
+    events = g.vote(0, 1) + g.vote(1, 0)
+    assert "vote_result" not in kinds(events)
+    assert g.status == "voting" and g.pending == 1
+
+def test_voted_joiner_leaving_mid_vote():
+    g = voting_game()
+    g.seat(3)
+    g.vote(3, 1)
+    g.unseat(3)                                 # 他的票作廢，不多扣 pending
+    assert g.pending == 3
+    assert "vote_result" in kinds(g.vote(0, 1) + g.vote(1, 0) + g.vote(2, 1))
+
+def test_last_non_voter_leaving_settles():
+    g = voting_game(4)
+    for voter, target in ((0, 1), (1, 0), (2, 1)):
+        g.vote(voter, target)
+    events = g.unseat(3)                        # 被踢或重連逾時
+    assert "vote_result" in kinds(events)
+    assert g.status != "voting" and g.pending == 0
+
+def test_leaving_can_decide_early_vote():
+    g = voting_game(6)
+    g.early = True
+    events = g.vote(0, 5) + g.vote(1, 5) + g.vote(2, 5)
+    assert "vote_result" not in kinds(events)   # 差 3 票、3 票未投：還追得上
+    assert "vote_result" in kinds(g.unseat(3))
+
+def test_slot_set():
+    s = SlotSet([5, 0, 70])
+    s.add(3)
+    s.discard(5)
+    assert list(s) == [0, 3, 70] and len(s) == 3
+    assert 70 in s and 5 not in s and None not in s and -1 not in s
+    assert list(s & SlotSet([3, 70, 9])) == [3, 70]
+
+def test_tally_levels_follow_changes():
+    t = Tally()
+    for voter, target in ((0, 1), (1, 1), (2, 1), (3, 2)):
+        t.cast(voter, target)
+    assert list(t.leaders()) == [1] and t.margin() == 2
+    t.cast(0, 2)                                # 改票
+    t.cast(1, 2)
+    assert list(t.leaders()) == [2] and t.margin() == 2
+    assert t.ranking(2) == [(2, 3), (1, 1)]
+    assert sorted(t.void_target(2)) == [0, 1, 3]
+    assert list(t.leaders()) == [1] and t.count(2) == 0
+    t.withdraw(2)
+    assert list(t.leaders()) == [] and t.margin() == 0
@@ -0,0 +1,58 @@
+# 對局歷史：rollup 與紀錄檔一致、寫到一半的最後一行在開檔時截掉、存好的 rollup 只補 fold 尾巴。
+import os, json, tempfile
+from history import HistoryStore, GAMES, UC_WINS, ROUNDS, TIES, TIE_GAMES, new_rollup, fold
+
+def game(i: int) -> dict:
+    return {"room": f"r{i}", "session": 1, "started": 0.0, "ended": 1.0,
+            "pair": ["平民詞", "臥底詞"] if i % 2 else ["甲", "乙"],
+            "players": [[s, f"p{s}", "undercover" if s == 0 else "civilian"] for s in range(4 + i % 3)],
+            "votes": [], "eliminated": [1], "ties": i % 3, "rounds": 1 + i % 4,
+            "winner": "undercover" if i % 5 == 0 else "civilian"}
+
+def scan(path: str) -> dict:
+    rollup = new_rollup()
+    with open(path, "rb") as f:
+        for line in f:
+            fold(rollup, json.loads(line))
+    return rollup
+
+def store_with(games: list, batch: int = 4) -> HistoryStore:
+    store = HistoryStore(tempfile.mkdtemp(prefix="uc-test-history-"), 0)
+    store.open()
+    for i in range(0, len(games), batch):
+        for g in games[i:i + batch]:
+            store.append(g)
+        store.write(store.take())
+    return store
+
+def test_rollup_matches_log():
+    games = [game(i) for i in range(20)]
+    store = store_with(games)
+    rebuilt = scan(store.log_path)
+    assert store.rollup["total"] == rebuilt["total"]
+    assert store.rollup["players"] == rebuilt["players"] and store.rollup["pairs"] == rebuilt["pairs"]
+    total = store.rollup["total"]
+    assert total[GAMES] == 20 and total[UC_WINS] == 4
+    assert total[ROUNDS] == sum(g["rounds"] for g in games) and total[TIES] == sum(g["ties"] for g in games)
+    assert total[TIE_GAMES] == sum(g["ties"] > 0 for g in games)
+    assert store.rollup["offset"] == os.path.getsize(store.log_path)
+
+def test_open_truncates_torn_last_line():
+    store = store_with([game(i) for i in range(6)])
+    good = os.path.getsize(store.log_path)
+    with open(store.log_path, "ab") as f:
+        f.write(b'{"room":"half","ses')         # 寫到一半當掉
+    reopened = HistoryStore(os.path.dirname(store.log_path), 0)
+    rollup = reopened.open()
+    assert os.path.getsize(store.log_path) == good
+    assert rollup["total"][GAMES] == 6 and rollup["offset"] == good
+    reopened.write([game(6)])                   # 下一批接在完整的行後面
+    assert scan(store.log_path)["total"][GAMES] == 7
+
+def test_saved_rollup_folds_only_the_tail():
+    store = store_with([game(i) for i in range(8)])
+    store.save_rollup(store.rollup_text())
+    store.write([game(8), game(9)])             # rollup 存檔之後才寫進檔案的紀錄
+    reopened = HistoryStore(os.path.dirname(store.log_path), 0)
+    rollup = reopened.open()
+    assert rollup["total"] == scan(store.log_path)["total"] and rollup["total"][GAMES] == 10
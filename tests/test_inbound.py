@@ -0,0 +1,39 @@
+# 入站限流：token bucket 的突發與回補、RATE_LIMITS 解析、違規額度扣光後以 1008 斷線。
+import time
+import pytest
+import server_V2 as srv
+
+def test_bucket_burst_then_refill():
+    b = srv.TokenBucket(2, 5, 100.0)
+    assert all(b.take(100.0) for _ in range(5))
+    assert not b.take(100.0)
+    assert b.take(100.5)                    # 0.5 秒回補 1 個
+    assert not b.take(100.5)
+    assert sum(b.take(200.0) for _ in range(10)) == 5   # 回補不超過突發上限
+
+def test_parse_rate_limits():
+    assert srv.parse_rate_limits("say=2:5, vote=3 ,bad,=1") == {"say": (2.0, 5.0), "vote": (3.0, 3.0)}
+
+def test_allow_uses_per_type_bucket():
+    lim, now = srv.InboundLimiter(), time.monotonic()
+    rate, burst = srv.RATE_LIMITS["say"]
+    assert sum(lim.allow("say", now) for _ in range(int(burst) + 3)) == int(burst)
+    assert lim.allow("vote", now)           # 其他種類各自一個 bucket
+    assert lim.allow("no_such_type", now)   # 未列出的種類用 "*"
+    assert set(lim.buckets) == {"say", "vote", "no_such_type"}
+
+def test_strikes_escalate_to_1008():
+    lim, now = srv.InboundLimiter(), time.monotonic()
+    rate, burst = srv.STRIKE_LIMIT
+    for _ in range(int(burst)):
+        lim.strike("rate_limited", now)     # 額度內：只記丟棄
+    with pytest.raises(srv.InboundViolation) as e:
+        lim.strike("rate_limited", now)
+    assert e.value.code == 1008 and lim.dropped == int(burst) + 1
+
+def test_strikes_refill_over_time():
+    lim, now = srv.InboundLimiter(), time.monotonic()
+    rate, burst = srv.STRIKE_LIMIT
+    for _ in range(int(burst)):
+        lim.strike("rate_limited", now)
+    lim.strike("rate_limited", now + 1 / rate)  # 偶爾超量、額度已回補：不斷線
@@ -0,0 +1,60 @@
+# 房間日誌：fold 的座位規則，以及 compaction 前後重開檔都得到同一份狀態。
+import os, tempfile
+from journal import Journal, fold
+
+CREATE = {"host": "h", "speak_seconds": 0, "vote_seconds": 0, "early": False,
+          "use_builtin": True, "pools": [], "custom": []}
+
+def records(room: str = "r") -> list:
+    return [
+        (room, 0, "create", CREATE),
+        (room, 1, "join", ["h", 0, "H", "h.s0"]),
+        (room, 2, "join", ["a", 1, "A", "a.s1"]),
+        (room, 3, "join", ["b", 2, "B", "b.s2"]),
+        (room, 4, "join", ["c", 3, "C", "c.s3"]),
+        (room, 5, "start", {"session": 1, "pair": ["x", "y"], "undercover": [1], "alive": [0, 1, 2, 3]}),
+        (room, 6, "join", ["a", 1, "A2", "a.s1"]),      # 改名：不重新復活
+        (room, 7, "eliminate", 2),
+        (room, 8, "phase", ["playing", 2]),
+        (room, 9, "leave", "c"),
+    ]
+
+def test_fold():
+    rooms = {}
+    for rec in records():
+        fold(rooms, *rec)
+    st = rooms["r"]
+    assert st["players"] == {"h": [0, "H", "h.s0"], "a": [1, "A2", "a.s1"], "b": [2, "B", "b.s2"]}
+    assert st["alive"] == {0, 1} and st["undercover"] == {1}
+    assert (st["status"], st["round"], st["session"], st["at"]) == ("playing", 2, 1, 9)
+    fold(rooms, "r", 10, "join", ["d", 4, "D", "d.s4"])    # 中途加入：存活的平民
+    assert st["alive"] == {0, 1, 4}
+    fold(rooms, "r", 11, "reset", None)
+    assert st["status"] == "waiting" and st["undercover"] == set() and st["alive"] == {0, 1, 2, 4}
+    fold(rooms, "r", 12, "drop", None)
+    assert rooms == {}
+    fold(rooms, "gone", 1, "join", ["x", 0, "X", "x.s"])   # 不存在的房間：忽略
+    assert rooms == {}
+
+def reopen(path: str) -> dict:
+    j = Journal(path)
+    rooms = j.open()
+    j.close()
+    return rooms
+
+def test_reopen_with_and_without_compaction():
+    path = os.path.join(tempfile.mkdtemp(prefix="uc-test-journal-"), "journal-0.db")
+    j = Journal(path, snapshot_every=8)     # 第一批觸發 compaction，第二批留在日誌：snapshot + 尾巴
+    j.open()
+    for rec in records("r") + records("q") + [("q", 10, "drop", None)]:
+        j.append(*rec)
+    batch = j.take()
+    j.write(batch[:15])
+    assert j.snapshots > 0
+    j.write(batch[15:])
+    assert j.snapshots == 1 and j.since_snapshot == 6
+    expected = {k: dict(v) for k, v in j.rooms.items()}
+    assert set(expected) == {"r"}
+    j.db.close()                            # 模擬當機：不走 close() 的最後一次 compaction
+    assert reopen(path) == expected
+    assert reopen(path) == expected         # 上一次開檔已 compaction：只剩 snapshot
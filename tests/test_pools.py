@@ -0,0 +1,75 @@
+# 題庫上傳：POST /pools 的參數檢查與上傳進度表。
+import pytest
+from starlette.testclient import TestClient
+import server_V2 as srv
+
+@pytest.fixture
+def client():
+    with TestClient(srv.app) as c:
+        yield c
+    srv.uploads.clear()
+    srv.draining = False    # TestClient 關閉時走完整關閉流程（drain），後面的測試還要開房
+
+def test_bad_content_length_is_400(client):
+    r = client.post("/pools?fmt=csv", content=b"a,b\n", headers={"content-length": "x"})
+    assert r.status_code == 400
+
+def test_upload_token_in_use_is_409(client):
+    srv.uploads["busy"] = {"done": False}
+    r = client.post("/pools?fmt=csv&upload=busy", content="甲,乙\n".encode())
+    assert r.status_code == 409
+    assert srv.uploads["busy"] == {"done": False}
+
+def test_old_drop_timer_keeps_newer_upload():
+    first, second = {"done": True}, {"done": True}
+    srv.uploads["t"] = second              # 同一個 token 又傳了一次
+    srv.drop_upload("t", first, None)      # 第一次上傳的 60 秒清除到期
+    assert srv.uploads["t"] is second
+    srv.drop_upload("t", second, None)
+    assert "t" not in srv.uploads
+
+def import_chunks(chunks, fmt="csv") -> srv.PairImport:
+    imp = srv.PairImport(fmt)
+    for chunk in chunks:
+        imp.feed(chunk)
+    imp.feed(b"", final=True)
+    return imp
+
+def test_chunk_boundaries_split_lines_and_characters():
+    data = "蘋果,香蕉\n西瓜,哈密瓜\n草莓,藍莓".encode()
+    whole = import_chunks([data])
+    for cut in range(1, len(data)):         # 每個切點（含切在 UTF-8 字元中間、換行前後）
+        imp = import_chunks([data[:cut], data[cut:]])
+        assert imp.pairs == whole.pairs
+    assert whole.pairs == [("蘋果", "香蕉"), ("西瓜", "哈密瓜"), ("草莓", "藍莓")]
+
+def test_dedupe_and_builtin():
+    a, b = srv.WORD_PAIRS[0]
+    lines = [f"{b},{a}", "貓,狗", "狗,貓", "貓 ,  狗", "#註解", "", "只有一個", "同,同"]
+    imp = import_chunks(["\n".join(lines).encode()])
+    st = imp.stats
+    assert imp.pairs == [("貓", "狗")]
+    assert (st["builtin"], st["duplicates"], st["invalid"], st["accepted"]) == (1, 2, 2, 1)
+    jsonl = import_chunks(['["魚","鳥"]\n{"a":"鳥","b":"魚"}\n{"a":"花"}\n'.encode()], fmt="jsonl")
+    assert jsonl.pairs == [("魚", "鳥")] and jsonl.stats["duplicates"] == 1 and jsonl.stats["invalid"] == 1
+
+@pytest.mark.parametrize("limit, data", [
+    ("UPLOAD_MAX_BYTES", b"a,b\n" * 10),
+    ("UPLOAD_MAX_PAIRS", "".join(f"x{i},y{i}\n" for i in range(10)).encode()),
+])
+def test_limits_are_413(monkeypatch, limit, data):
+    monkeypatch.setattr(srv, limit, 5)
+    with pytest.raises(srv.UploadError) as e:
+        import_chunks([data])
+    assert e.value.status == 413
+
+def test_unterminated_long_line_is_413():
+    imp = srv.PairImport("csv")
+    with pytest.raises(srv.UploadError) as e:
+        imp.feed(b"x" * (srv.UPLOAD_LINE_MAX + 1))
+    assert e.value.status == 413
+
+def test_upload_endpoint_registers_pool(client):
+    r = client.post("/pools?fmt=csv&name=t", content="貓,狗\n魚,鳥\n".encode())
+    assert r.status_code == 200 and r.json()["size"] == 2
+    assert srv.get_pool(r.json()["id"]).pairs == (("貓", "狗"), ("魚", "鳥"))
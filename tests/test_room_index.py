@@ -0,0 +1,98 @@
+# client_room 反查索引：建房 / 入房 / 踢人 / 斷線 / 重連 / 冒用 cid 重連 / 拆房，每一步都跑 check_room_index()。
+import time
+import pytest
+from starlette.testclient import TestClient
+import server_V2 as srv
+
+def until(pred, timeout: float = 2.0):
+    """房間 actor 在 server 的 event loop 上非同步處理：輪詢到條件成立。"""
+    deadline = time.monotonic() + timeout
+    while not pred():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+def recv_until(ws, t: str) -> dict:
+    while True:
+        m = ws.receive_json()
+        if m["type"] == t:
+            return m
+
+open_sessions = []
+
+def connect(client):
+    ws = client.websocket_connect("/ws").__enter__()
+    open_sessions.append(ws)
+    return ws
+
+def hang_up(ws):
+    open_sessions.remove(ws)
+    ws.__exit__(None, None, None)     # 等同離開 with 區塊：送出斷線並收掉測試端的 session
+
+def seated(room_id: str) -> set:
+    r = srv.rooms.get(room_id)
+    return set(r.clients) if r else set()
+
+@pytest.fixture
+def client():
+    with TestClient(srv.app) as c:
+        try:
+            yield c
+        finally:
+            for ws in list(open_sessions):  # 測試中途失敗也要收掉，否則 TestClient 關不掉
+                hang_up(ws)
+    srv.rooms.clear()
+    srv.client_room.clear()
+
+def test_room_index_lifecycle(client, monkeypatch):
+    def enter(msg: dict):
+        ws = connect(client)
+        ws.send_json(msg)
+        token = recv_until(ws, "resume_token")["token"]
+        return ws, token.partition(".")[0], token
+
+    h, host, _ = enter({"type": "create_room_setup", "room": "R", "name": "H"})
+    srv.check_room_index()
+    a, a_cid, a_token = enter({"type": "join_room", "room": "R", "name": "A"})
+    b, b_cid, _ = enter({"type": "join_room", "room": "R", "name": "B"})
+    assert seated("R") == {host, a_cid, b_cid}
+    srv.check_room_index()
+    o, other, _ = enter({"type": "create_room_setup", "room": "OTHER", "name": "O"})
+    srv.check_room_index()
+
+    # 踢人
+    h.send_json({"type": "kick", "target": b_cid})
+    recv_until(b, "kicked")
+    until(lambda: b_cid not in seated("R"))
+    srv.check_room_index()
+    hang_up(b)
+
+    # 斷線：保留座位，索引照舊指回原房
+    hang_up(a)
+    until(lambda: srv.rooms["R"].clients[a_cid].out is srv.OFFLINE)
+    assert srv.client_room[a_cid] == "R"
+    srv.check_room_index()
+
+    # 帶 token 重連回原座位
+    a = connect(client)
+    a.send_json({"type": "resume", "room": "R", "token": a_token, "seq": 0})
+    recv_until(a, "resumed")
+    until(lambda: srv.rooms["R"].clients[a_cid].out is not srv.OFFLINE)
+    srv.check_room_index()
+
+    # 冒用公開的 host cid 重連（token 錯），接著入別的房：不可以 host 身分坐進 OTHER
+    x = connect(client)
+    x.send_json({"type": "resume", "room": "R", "token": f"{host}.bogus"})
+    x.send_json({"type": "join_room", "room": "OTHER", "name": "X"})
+    recv_until(x, "resume_failed")
+    time.sleep(0.2)
+    assert host not in seated("OTHER")
+    assert srv.client_room[host] == "R"
+    srv.check_room_index()
+
+    # 拆房：不保留座位時全員斷線即離房，人走光就拆
+    monkeypatch.setattr(srv, "RESUME_GRACE", 0)
+    for ws in (h, a, o, x):
+        hang_up(ws)
+    until(lambda: not srv.rooms)
+    assert not srv.client_room
+    srv.check_room_index()
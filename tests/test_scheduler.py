@@ -0,0 +1,42 @@
+# 共用計時器 heap：觸發順序、取消，以及 len()（/metrics 的 undercover_timers_pending）不會算錯。
+import asyncio
+from server_V2 import Scheduler
+
+def run(coro):
+    return asyncio.run(coro)
+
+def test_fires_in_order_and_skips_cancelled():
+    async def main():
+        s, fired = Scheduler(), []
+        s.call_later(0.03, lambda name, t: fired.append(name), "c")
+        b = s.call_later(0.02, lambda name, t: fired.append(name), "b")
+        s.call_later(0.01, lambda name, t: fired.append(name), "a")
+        s.cancel(b)
+        assert len(s) == 2
+        await asyncio.sleep(0.08)
+        assert fired == ["a", "c"] and len(s) == 0
+    run(main())
+
+def test_cancel_after_fire_is_noop():
+    async def main():
+        s, fired = Scheduler(), []
+        timers = [s.call_later(0, lambda t: fired.append(t)) for _ in range(10)]
+        await asyncio.sleep(0.02)
+        assert len(fired) == 10
+        for t in timers:
+            s.cancel(t)     # 指令先於到期處理：取消已觸發的計時器
+        assert len(s) == 0 and s.cancelled == 0
+        later = s.call_later(0.01, lambda t: fired.append(t))
+        assert len(s) == 1
+        await asyncio.sleep(0.03)
+        assert fired[-1] is later and len(s) == 0
+    run(main())
+
+def test_compacts_heap_after_many_cancels():
+    async def main():
+        s = Scheduler()
+        timers = [s.call_later(60, lambda t: None) for _ in range(100)]
+        for t in timers[:80]:
+            s.cancel(t)
+        assert len(s) == 20 and len(s.heap) < 100
+    run(main())
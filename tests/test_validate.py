@@ -0,0 +1,38 @@
+# 連線端訊息驗證：格式錯誤、未知種類、欄位不合格都在投遞前擋下。
+import pytest
+from server_V2 import validate_message
+
+@pytest.mark.parametrize("msg", [None, [], "vote", 3, {}, {"type": 1}, {"type": None}, {"type": ["say"]}])
+def test_malformed(msg):
+    assert validate_message(msg) == "malformed"
+
+def test_unknown_type():
+    assert validate_message({"type": "drop_tables"}) == "unknown_type"
+
+@pytest.mark.parametrize("msg", [
+    {"type": "vote"},                                   # 缺必填欄位
+    {"type": "vote", "target": 5},
+    {"type": "vote", "target": "x" * 65},
+    {"type": "join_room", "name": "p"},                 # 缺 room
+    {"type": "join_room", "room": "r", "name": "x" * 41},
+    {"type": "say", "text": ["hi"]},
+    {"type": "resume", "room": "r", "token": "t", "seq": -1},
+    {"type": "resume", "room": "r", "token": "t", "seq": True},     # bool 不算數字
+    {"type": "create_room_setup", "room": "r", "speak_seconds": "20"},
+    {"type": "create_room_setup", "room": "r", "early_settle": 1},
+    {"type": "create_room_setup", "room": "r", "pool_ids": ["a", 2]},
+    {"type": "create_room_setup", "room": "r", "pool_ids": ["a"] * 9},
+])
+def test_invalid_fields(msg):
+    assert validate_message(msg) == "invalid"
+
+@pytest.mark.parametrize("msg", [
+    {"type": "pong"},
+    {"type": "say"},                                    # 選填欄位可省略
+    {"type": "say", "text": None},
+    {"type": "vote", "target": "cid", "extra": object()},   # 未列出的欄位忽略
+    {"type": "resume", "room": "r", "token": "t", "seq": 20.0},
+    {"type": "create_room_setup", "room": "r", "speak_seconds": 20, "pool_ids": ["a"], "early_settle": True},
+])
+def test_valid(msg):
+    assert validate_message(msg) is None
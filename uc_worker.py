@@ -0,0 +1,10 @@
+# gunicorn worker：關閉 permessage-deflate，並把單一 websocket frame 的上限壓到 MAX_FRAME_BYTES。
+# 大訊息已在應用層壓縮一次、整房共用（見 server_V2.py 的 Frame），不需要每條連線再各自壓縮。
+# frame 上限要在 uvicorn 這層設：應用層的檢查要等整個 frame 收進記憶體才看得到（預設 16MB）。
+import os
+from uvicorn.workers import UvicornWorker
+
+MAX_FRAME_BYTES = int(os.environ.get("MAX_FRAME_BYTES", "32768"))    # 與 server_V2.MAX_FRAME_BYTES 同一個設定
+
+class Worker(UvicornWorker):
+    CONFIG_KWARGS = {**UvicornWorker.CONFIG_KWARGS, "ws_per_message_deflate": False, "ws_max_size": MAX_FRAME_BYTES}